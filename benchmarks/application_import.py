@@ -0,0 +1,112 @@
+"""
+Бенчмарк массового импорта заявок
+Замеряет разбор и проверку CSV (без БД) и, если задан BENCH_DATABASE_URL, вставку
+пачками через ApplicationImporter в сравнении с созданием заявок по одной
+
+Для режима с БД нужна отдельная база с примененными миграциями: созданные заявки
+удаляются после замера.
+
+Запуск из корня проекта:
+    python -m benchmarks.application_import --rows 20000
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.application_import --rows 20000 --single 500
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import time
+
+from telegram_bot.services.application_validation import validate_signup
+
+FIELDS = ["fullName", "phone", "age", "city", "category", "experience", "transport", "loadCapacity", "deliveryType", "agreeTerms"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург"]
+
+
+def build_csv(rows: int) -> str:
+    """Синтетическая выгрузка партнера (каждая 50-я строка с ошибкой)"""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=FIELDS)
+    writer.writeheader()
+    for i in range(rows):
+        category = random.choice(["driver", "courier", "both", "cargo"])
+        writer.writerow({
+            "fullName": f"Тестовый Кандидат {i}",
+            "phone": f"+7 9{random.randint(10, 99)} {random.randint(100, 999)}-{random.randint(10, 99)}-{random.randint(10, 99)}",
+            "age": "abc" if i % 50 == 0 else random.randint(18, 60),
+            "city": random.choice(CITIES),
+            "category": category,
+            "experience": "3-5",
+            "transport": "car" if category in ("courier", "both") else "",
+            "loadCapacity": "1.5" if category == "cargo" else "",
+            "deliveryType": "food;parcels" if category in ("courier", "both") else "",
+            "agreeTerms": "true",
+        })
+    return out.getvalue()
+
+
+def measure_validation(data: str) -> float:
+    """Строк в секунду на разборе и проверке"""
+    started = time.perf_counter()
+    rows = 0
+    for row in csv.DictReader(io.StringIO(data)):
+        rows += 1
+        try:
+            validate_signup({key: value for key, value in row.items() if value}, source="bulk_import")
+        except ValueError:
+            pass
+    return rows / (time.perf_counter() - started)
+
+
+async def measure_database(data: str, batch_size: int, single: int):
+    # Движок БД создается при импорте моделей - подменяем адрес до импорта
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+
+    from sqlalchemy import delete, func, select
+    from telegram_bot.models.database import AsyncSessionLocal, close_db
+    from telegram_bot.models.support_models import Application
+    from telegram_bot.services.application_import import ApplicationImporter, iter_records
+    from telegram_bot.services.application_service import application_service
+
+    async with AsyncSessionLocal() as session:
+        max_before = (await session.execute(select(func.coalesce(func.max(Application.id), 0)))).scalar()
+
+    try:
+        importer = ApplicationImporter(batch_size=batch_size, auto_assign=False)
+        stats = await importer.run(iter_records(io.StringIO(data), "csv"))
+        print(f"Пачками по {batch_size}: {stats['inserted']} заявок за {stats['seconds']}с - {stats['rows_per_second']} строк/с")
+
+        if single:
+            records = [validate_signup(row, source="bulk_import") for row in csv.DictReader(io.StringIO(data)) if row["age"].isdigit()][:single]
+            started = time.perf_counter()
+            for record in records:
+                await application_service.create_application_from_api(record, auto_assign=False)
+            elapsed = time.perf_counter() - started
+            print(f"По одной:          {len(records)} заявок за {elapsed:.3f}с - {len(records) / elapsed:.0f} строк/с")
+    finally:
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Application).where(Application.id > max_before))
+            await session.commit()
+        await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность массового импорта заявок")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--single", type=int, default=500, help="сколько заявок вставить по одной для сравнения")
+    args = parser.parse_args()
+
+    data = build_csv(args.rows)
+    print(f"Разбор и проверка: {measure_validation(data):,.0f} строк/с")
+
+    if os.getenv("BENCH_DATABASE_URL"):
+        asyncio.run(measure_database(data, args.batch_size, args.single))
+    else:
+        print("BENCH_DATABASE_URL не задан - замер вставки пропущен")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Бенчмарк классификатора сообщений ИИ-консультанта
+Сравнивает прежние проверки (lower() + any(k in msg) по каждому списку ключевых слов
+в detect_intent, should_use_web_search и get_fallback_response) с одним проходом
+services.message_classifier, и сверяет результат с размеченным корпусом
+benchmarks/classifier_corpus.jsonl
+
+Запуск из корня проекта:
+    python -m benchmarks.message_classifier --repeat 2000
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from services import message_classifier
+from services.message_classifier import classify
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "classifier_corpus.jsonl")
+
+# Прежний список признаков веб-поиска - дословно, вместе с ключами в верхнем регистре,
+# которые после lower() сообщения никогда не совпадали
+LEGACY_WEB_SEARCH = [
+    "где", "адрес", "находится", "местонахождение", "как добраться",
+    "медкнижка", "медкнижку", "медицинская книжка", "справка", "медицинская справка", "Медсправка", "анализы",
+    "поликлиника", "больница", "медцентр", "клиника",
+    "мфц", "госуслуги", "паспорт", "справка о несудимости",
+    "Лицензия", "Лицензию", "Разрешение", "Разрешения",
+    "сейчас", "сегодня", "текущий", "последний", "новый", "цена", "стоимость",
+    "расписание", "часы работы", "время работы", "график",
+    "телефон", "номер", "контакт", "связаться",
+    "пенза", "пензе", "Москва", "Москве", "Санкт-Петербург", "Санкт-Петербурга", "Питер", "Питере", "район", "городе", "области"
+]
+
+
+def legacy_classify(message: str) -> tuple:
+    """Три прежних прохода: интент, веб-поиск, тема резервного ответа"""
+    intent = "general"
+    message_lower = message.lower()
+    for name, keywords in message_classifier.INTENT_KEYWORDS.items():
+        if any(keyword in message_lower for keyword in keywords):
+            intent = name
+            break
+
+    message_lower = message.lower()
+    needs_web_search = any(indicator in message_lower for indicator in LEGACY_WEB_SEARCH)
+
+    bucket = "default"
+    message_lower = message.lower()
+    for name, keywords in message_classifier.FALLBACK_KEYWORDS.items():
+        if any(word in message_lower for word in keywords):
+            bucket = name
+            break
+
+    return intent, needs_web_search, bucket
+
+
+def load_corpus() -> List[Dict]:
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_labels(corpus: List[Dict]) -> int:
+    """Расхождения с разметкой корпуса"""
+    errors = 0
+    for item in corpus:
+        result = classify(item["text"])
+        expected = (item["intent"], item["web_search"], item["fallback"])
+        if tuple(result) != expected:
+            errors += 1
+            print(f"  ❌ {item['text']!r}: ожидалось {expected}, получено {tuple(result)}")
+    return errors
+
+
+def measure(func, messages: List[str], repeat: int) -> float:
+    """Микросекунд на сообщение"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            func(message)
+    return (time.perf_counter() - started) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк классификатора сообщений")
+    parser.add_argument("--repeat", type=int, default=2000, help="Сколько раз прогнать корпус")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    print(f"📚 Корпус: {len(corpus)} размеченных сообщений, выражение {len(message_classifier._PATTERN.pattern)} символов")
+
+    errors = check_labels(corpus)
+    print(f"✅ Совпадение с разметкой: {len(corpus) - errors}/{len(corpus)}")
+
+    differences = [item["text"] for item in corpus if legacy_classify(item["text"]) != tuple(classify(item["text"]))]
+    print(f"🔁 Отличий от прежних проверок: {len(differences)} (ключи в верхнем регистре теперь срабатывают)")
+    for text in differences:
+        print(f"  • {text!r}: было {legacy_classify(text)}, стало {tuple(classify(text))}")
+
+    # Кэш classify отключаем: замеряется сам проход по сообщению
+    uncached = classify.__wrapped__
+    messages = [item["text"] for item in corpus]
+
+    legacy_us = measure(legacy_classify, messages, args.repeat)
+    single_us = measure(uncached, messages, args.repeat)
+    cached_us = measure(classify, messages, args.repeat)
+
+    print(f"\n⏱️ Прежние проверки:       {legacy_us:7.2f} мкс/сообщение")
+    print(f"⏱️ Один проход:            {single_us:7.2f} мкс/сообщение ({legacy_us / single_us:.1f}x)")
+    print(f"⏱️ Повтор (lru_cache):     {cached_us:7.2f} мкс/сообщение")
+
+
+if __name__ == "__main__":
+    main()
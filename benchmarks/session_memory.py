@@ -0,0 +1,131 @@
+"""
+Бенчмарк памяти in-memory чат-сессий
+Сравнивает прежнее представление (dataclass + ISO-строки + uuid4 на сообщение, вся история)
+с компактным (__slots__, epoch-время, интернированные строки, кольцевой буфер)
+
+Запуск из корня проекта:
+    python -m benchmarks.session_memory --sessions 10000 --messages 30
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List
+
+from services.session_store import ChatMessage, ChatSession
+
+
+@dataclass
+class LegacyChatMessage:
+    """Прежняя структура сообщения (до перехода на __slots__)"""
+    role: str
+    content: str
+    timestamp: str
+    message_id: str = None
+    intent: str = None
+    processing_time: float = None
+
+    def __post_init__(self):
+        if self.message_id is None:
+            self.message_id = str(uuid.uuid4())
+
+
+@dataclass
+class LegacyChatSession:
+    """Прежняя структура сессии"""
+    session_id: str
+    user_id: str = None
+    created_at: str = None
+    last_activity: str = None
+    messages: List[LegacyChatMessage] = None
+    context: Dict[str, Any] = None
+
+    def __post_init__(self):
+        if self.created_at is None:
+            self.created_at = datetime.now().isoformat()
+        if self.last_activity is None:
+            self.last_activity = self.created_at
+        if self.messages is None:
+            self.messages = []
+        if self.context is None:
+            self.context = {}
+
+
+USER_TEXTS = [
+    "Какие документы нужны для подключения?",
+    "Сколько можно заработать в месяц?",
+    "Какая у вас комиссия?",
+    "Как быстро подключают?",
+]
+AI_TEXT = "Для подключения нужны паспорт, водительское удостоверение и СТС. Оформление занимает около 15 минут."
+
+
+def _role(i: int) -> str:
+    # Строки собираются заново, как после json.loads из WebSocket
+    return "".join(["us", "er"]) if i % 2 == 0 else "".join(["assis", "tant"])
+
+
+def build_legacy(sessions: int, messages: int) -> list:
+    result = []
+    for s in range(sessions):
+        session = LegacyChatSession(session_id=str(uuid.uuid4()), user_id=f"anonymous_{s}")
+        for i in range(messages):
+            session.messages.append(LegacyChatMessage(
+                role=_role(i),
+                content=USER_TEXTS[i % len(USER_TEXTS)] if i % 2 == 0 else AI_TEXT,
+                timestamp=datetime.now().isoformat(),
+                intent="".join(["docu", "ments"]) if i % 2 else None,
+                processing_time=1.2 if i % 2 else None
+            ))
+        result.append(session)
+    return result
+
+
+def build_compact(sessions: int, messages: int) -> list:
+    result = []
+    for s in range(sessions):
+        session = ChatSession(session_id=str(uuid.uuid4()), user_id=f"anonymous_{s}")
+        for i in range(messages):
+            session.append(ChatMessage(
+                role=_role(i),
+                content=USER_TEXTS[i % len(USER_TEXTS)] if i % 2 == 0 else AI_TEXT,
+                timestamp=time.time(),
+                intent="".join(["docu", "ments"]) if i % 2 else None,
+                processing_time=1.2 if i % 2 else None
+            ))
+        result.append(session)
+    return result
+
+
+def measure(builder, sessions: int, messages: int) -> int:
+    """Возвращает объем памяти (байт), занятый построенными сессиями"""
+    gc.collect()
+    tracemalloc.start()
+    data = builder(sessions, messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на чат-сессию: до и после")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=30, help="сообщений в каждой сессии")
+    args = parser.parse_args()
+
+    legacy = measure(build_legacy, args.sessions, args.messages)
+    compact = measure(build_compact, args.sessions, args.messages)
+
+    print(f"Сессий: {args.sessions}, сообщений в сессии: {args.messages}")
+    print(f"До:    {legacy / args.sessions:10.0f} байт/сессия  ({legacy / 1024 / 1024:.1f} МБ)")
+    print(f"После: {compact / args.sessions:10.0f} байт/сессия  ({compact / 1024 / 1024:.1f} МБ)")
+    print(f"Экономия: {100 * (1 - compact / legacy):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Бенчмарк поиска активного чата поддержки по web_session_id
+Сравнивает прежний фильтр по JSON (chat_metadata ->> 'web_session_id') с индексированной колонкой
+
+Создает отдельную таблицу bench_support_chats (рабочие таблицы не затрагиваются),
+заполняет ее 1M чатов и замеряет латентность поиска.
+
+Запуск из корня проекта:
+    python -m benchmarks.support_chat_lookup --rows 1000000 --lookups 200
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.support_chat_lookup
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from telegram_bot.config.settings import settings
+
+TABLE = "bench_support_chats"
+
+JSON_LOOKUP = f"""
+    SELECT id FROM {TABLE}
+    WHERE chat_metadata ->> 'web_session_id' = :session_id AND is_active = true
+"""
+
+COLUMN_LOOKUP = f"""
+    SELECT id FROM {TABLE}
+    WHERE web_session_id = :session_id AND is_active = true
+"""
+
+
+async def seed(conn, rows: int, active_share: float):
+    """Создать и заполнить таблицу (структура повторяет нужные колонки support_chats)"""
+    await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    await conn.execute(text(f"""
+        CREATE TABLE {TABLE} (
+            id SERIAL PRIMARY KEY,
+            chat_id VARCHAR(100) NOT NULL,
+            is_active BOOLEAN DEFAULT true,
+            chat_metadata JSON,
+            web_session_id VARCHAR(100)
+        )
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO {TABLE} (chat_id, is_active, chat_metadata, web_session_id)
+        SELECT
+            'web_' || md5(g::text) || '_' || g,
+            random() < :active_share,
+            json_build_object('web_session_id', md5(g::text), 'source', 'web_chat', 'chat_history', json_build_array()),
+            md5(g::text)
+        FROM generate_series(1, :rows) AS g
+    """), {"rows": rows, "active_share": active_share})
+
+    # Те же индексы, что и в рабочей схеме
+    await conn.execute(text(f"CREATE INDEX ON {TABLE} (is_active)"))
+    await conn.execute(text(f"CREATE INDEX ON {TABLE} (web_session_id) WHERE is_active = true"))
+    await conn.execute(text(f"ANALYZE {TABLE}"))
+
+
+async def measure(conn, query: str, session_ids: list) -> float:
+    """Средняя латентность запроса в миллисекундах"""
+    started = time.perf_counter()
+    for session_id in session_ids:
+        await conn.execute(text(query), {"session_id": session_id})
+    return (time.perf_counter() - started) * 1000 / len(session_ids)
+
+
+async def plan(conn, query: str, session_id: str) -> str:
+    result = await conn.execute(text(f"EXPLAIN {query}"), {"session_id": session_id})
+    return result.scalars().first()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Поиск чата по web_session_id: JSON vs колонка")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--active-share", type=float, default=0.02, help="доля активных чатов")
+    parser.add_argument("--keep", action="store_true", help="не удалять таблицу после замера")
+    args = parser.parse_args()
+
+    engine = create_async_engine(os.getenv("BENCH_DATABASE_URL", settings.DATABASE_URL))
+
+    async with engine.begin() as conn:
+        print(f"🌱 Заполнение {TABLE}: {args.rows} чатов...")
+        started = time.perf_counter()
+        await seed(conn, args.rows, args.active_share)
+        print(f"✅ Готово за {time.perf_counter() - started:.1f}с")
+
+    async with engine.connect() as conn:
+        # Ищем как существующие активные сессии, так и отсутствующие (обычный случай ИИ-чата)
+        result = await conn.execute(text(f"SELECT web_session_id FROM {TABLE} WHERE is_active LIMIT :n"), {"n": args.lookups // 2})
+        session_ids = list(result.scalars().all())
+        session_ids += [f"missing-{i}" for i in range(args.lookups - len(session_ids))]
+        random.shuffle(session_ids)
+
+        print(f"JSON-фильтр:  {await plan(conn, JSON_LOOKUP, session_ids[0])}")
+        print(f"Колонка:      {await plan(conn, COLUMN_LOOKUP, session_ids[0])}")
+
+        json_ms = await measure(conn, JSON_LOOKUP, session_ids)
+        column_ms = await measure(conn, COLUMN_LOOKUP, session_ids)
+
+        print(f"JSON-фильтр:  {json_ms:8.3f} мс/запрос")
+        print(f"Колонка:      {column_ms:8.3f} мс/запрос")
+        print(f"Ускорение:    x{json_ms / column_ms:.1f}")
+
+    if not args.keep:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+"""Add indexed web_session_id column to support_chats
+
+Revision ID: 20261017_001
+Revises: 20250116_001, 859e4dff0fb6
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+# Ревизия также объединяет две существующие головы миграций
+revision = '20261017_001'
+down_revision = ('20250116_001', '859e4dff0fb6')
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Выносим web_session_id из chat_metadata в отдельную колонку с частичным индексом"""
+    op.add_column('support_chats', sa.Column('web_session_id', sa.String(100), nullable=True, comment='ID сессии веб-чата (для чатов с сайта)'))
+
+    # Переносим значения из JSON для уже существующих чатов
+    op.execute(
+        """
+        UPDATE support_chats
+        SET web_session_id = chat_metadata ->> 'web_session_id'
+        WHERE chat_metadata IS NOT NULL
+          AND web_session_id IS NULL
+          AND chat_metadata ->> 'web_session_id' IS NOT NULL
+        """
+    )
+
+    # Маршрутизация ищет только активные чаты - индекс по ним остается маленьким
+    op.create_index(
+        'idx_support_chats_web_session_active',
+        'support_chats',
+        ['web_session_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active = true')
+    )
+
+
+def downgrade() -> None:
+    """Откат: удаляем индекс и колонку (значения остаются в chat_metadata)"""
+    op.drop_index('idx_support_chats_web_session_active', table_name='support_chats')
+    op.drop_column('support_chats', 'web_session_id')
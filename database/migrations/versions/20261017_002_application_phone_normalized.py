@@ -0,0 +1,51 @@
+"""Add normalized phone column to applications for duplicate detection
+
+Revision ID: 20261017_002
+Revises: 20261017_001
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_002'
+down_revision = '20261017_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Добавляем phone_normalized (7XXXXXXXXXX) и индекс для поиска повторных заявок"""
+    op.add_column('applications', sa.Column('phone_normalized', sa.String(20), nullable=True, comment='Телефон в формате 7XXXXXXXXXX (поиск повторных заявок)'))
+
+    # Заполняем для существующих заявок по тем же правилам, что normalize_phone
+    op.execute(
+        """
+        UPDATE applications
+        SET phone_normalized = CASE
+            WHEN length(digits) = 11 AND left(digits, 1) = '8' THEN '7' || substr(digits, 2)
+            WHEN length(digits) = 10 AND left(digits, 1) = '9' THEN '7' || digits
+            ELSE NULLIF(digits, '')
+        END
+        FROM (
+            SELECT id AS app_id, regexp_replace(phone, '[^0-9]', '', 'g') AS digits
+            FROM applications
+        ) AS normalized
+        WHERE applications.id = normalized.app_id
+          AND applications.phone_normalized IS NULL
+        """
+    )
+
+    op.create_index(
+        'idx_applications_phone_normalized_created',
+        'applications',
+        ['phone_normalized', 'created_at'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Откат: удаляем индекс и колонку"""
+    op.drop_index('idx_applications_phone_normalized_created', table_name='applications')
+    op.drop_column('applications', 'phone_normalized')
@@ -0,0 +1,39 @@
+"""Add composite indexes for manager statistics queries
+
+Revision ID: 20261017_003
+Revises: 20261017_002
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261017_003'
+down_revision = '20261017_002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Индексы для агрегирующих запросов статистики менеджера"""
+    # Счетчики заявок менеджера и выборки за период по processed_at
+    op.create_index(
+        'idx_applications_manager_processed',
+        'applications',
+        ['assigned_manager_id', 'processed_at'],
+        unique=False
+    )
+
+    # Часы работы за период
+    op.create_index(
+        'idx_work_sessions_manager_started',
+        'manager_work_sessions',
+        ['manager_id', 'started_at'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Откат: удаляем индексы"""
+    op.drop_index('idx_work_sessions_manager_started', table_name='manager_work_sessions')
+    op.drop_index('idx_applications_manager_processed', table_name='applications')
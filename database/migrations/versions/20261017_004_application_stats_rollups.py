@@ -0,0 +1,47 @@
+"""Add hourly and daily application rollup tables
+
+Revision ID: 20261017_004
+Revises: 20261017_003
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_004'
+down_revision = '20261017_003'
+branch_labels = None
+depends_on = None
+
+
+def _create_stats_table(name: str) -> None:
+    op.create_table(
+        name,
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False, comment='Начало интервала (UTC)'),
+        sa.Column('category', sa.String(50), nullable=False, comment='Категория заявки'),
+        sa.Column('city', sa.String(100), nullable=False, comment='Город'),
+        sa.Column('manager_id', sa.Integer(), nullable=False, comment='ID менеджера (0 - не назначен)'),
+        sa.Column('created_count', sa.Integer(), nullable=False, comment='Поступило заявок'),
+        sa.Column('completed_count', sa.Integer(), nullable=False, comment='Завершено заявок'),
+        sa.Column('cancelled_count', sa.Integer(), nullable=False, comment='Отменено заявок'),
+        sa.Column('processing_seconds', sa.BigInteger(), nullable=False, comment='Суммарное время обработки завершенных (сек)'),
+        sa.Column('processing_histogram', sa.JSON(), nullable=True, comment='Гистограмма времени обработки по PROCESSING_BUCKETS'),
+        sa.PrimaryKeyConstraint('bucket_start', 'category', 'city', 'manager_id')
+    )
+
+
+def upgrade() -> None:
+    """Таблицы агрегатов для отчетов; заполняются фоновой задачей бота (stats_rollup)"""
+    _create_stats_table('application_stats_hourly')
+    _create_stats_table('application_stats_daily')
+
+    # Пересчет завершенных заявок за последние часы
+    op.create_index('idx_applications_processed', 'applications', ['processed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Откат: удаляем индекс и таблицы агрегатов"""
+    op.drop_index('idx_applications_processed', table_name='applications')
+    op.drop_table('application_stats_daily')
+    op.drop_table('application_stats_hourly')
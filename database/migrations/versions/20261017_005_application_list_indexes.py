@@ -0,0 +1,69 @@
+"""Add composite indexes for keyset pagination of application lists
+
+Revision ID: 20261017_005
+Revises: 20261017_004
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_005'
+down_revision = '20261017_004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Индексы под фильтры get_manager_applications с сортировкой (created_at, id)"""
+    # Конкретный статус у менеджера, "В работе" и незавершенные заявки менеджера во "Новых"
+    op.create_index(
+        'idx_applications_manager_status_created',
+        'applications',
+        ['assigned_manager_id', 'status', 'created_at', 'id'],
+        unique=False
+    )
+
+    # "Мои заявки" (все статусы, кроме завершенных)
+    op.create_index(
+        'idx_applications_manager_created',
+        'applications',
+        ['assigned_manager_id', 'created_at', 'id'],
+        unique=False
+    )
+
+    # Конкретный статус для администратора
+    op.create_index(
+        'idx_applications_status_created',
+        'applications',
+        ['status', 'created_at', 'id'],
+        unique=False
+    )
+
+    # Неназначенные новые заявки
+    op.create_index(
+        'idx_applications_new_unassigned_created',
+        'applications',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("status = 'NEW' AND assigned_manager_id IS NULL")
+    )
+
+    # "Все заявки" администратора (незавершенные)
+    op.create_index(
+        'idx_applications_open_created',
+        'applications',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("status <> 'COMPLETED'")
+    )
+
+
+def downgrade() -> None:
+    """Откат: удаляем индексы"""
+    op.drop_index('idx_applications_open_created', table_name='applications')
+    op.drop_index('idx_applications_new_unassigned_created', table_name='applications')
+    op.drop_index('idx_applications_status_created', table_name='applications')
+    op.drop_index('idx_applications_manager_created', table_name='applications')
+    op.drop_index('idx_applications_manager_status_created', table_name='applications')
@@ -15,7 +15,13 @@ import asyncio
 # Импорты наших сервисов
 from services.chat_manager import chat_manager
 from services.openrouter_ai import OpenRouterAI
+from services.ai_admission import ai_admission
+from services.context_builder import context_builder
+from services.response_cache import response_cache
 from telegram_bot.config.settings import settings
+from telegram_bot.services.webchat_bus import webchat_bus
+from telegram_bot.services.chat_routing import chat_routing
+from telegram_bot.services.messenger import messenger
 
 import logging
 logger = logging.getLogger(__name__)
@@ -55,22 +61,33 @@ class ConnectionManager:
             session_id = await chat_manager.create_session()
         else:
             # Проверяем, существует ли сессия с данным ID
-            existing_session = await chat_manager.get_session(session_id)
-            if not existing_session:
+            if not await chat_manager.session_exists(session_id):
                 print(f"⚠️ Сессия {session_id} не найдена, создаем новую")
                 session_id = await chat_manager.create_session()
         
         self.active_connections[session_id] = websocket
         self.connection_sessions[websocket] = session_id
         
+        # Пока сессия была у другого воркера, маршрут мог измениться
+        chat_routing.forget(session_id)
+        
+        # Подписываем воркер на канал сессии: сообщения менеджеров приходят через шину
+        # независимо от того, какой процесс их отправил
+        async def deliver(message_json: dict) -> bool:
+            return await self.send_to_session(session_id, json.dumps(message_json, ensure_ascii=False))
+        
+        await webchat_bus.subscribe(session_id, deliver)
+        
         print(f"🔗 Новое WebSocket соединение для сессии {session_id}. Всего: {len(self.active_connections)}")
         
         return session_id
     
-    def disconnect(self, websocket: WebSocket):
+    async def disconnect(self, websocket: WebSocket):
         session_id = self.connection_sessions.get(websocket)
-        if session_id and session_id in self.active_connections:
+        if session_id and self.active_connections.get(session_id) is websocket:
             del self.active_connections[session_id]
+            await webchat_bus.unsubscribe(session_id)
+            chat_routing.forget(session_id)
         if websocket in self.connection_sessions:
             del self.connection_sessions[websocket]
         
@@ -93,7 +110,7 @@ class ConnectionManager:
             except Exception as e:
                 print(f"❌ Ошибка отправки в сессию {session_id}: {e}")
                 # Удаляем разорванное соединение
-                self.disconnect(websocket)
+                await self.disconnect(websocket)
                 return False
         else:
             print(f"⚠️ WebSocket соединение для сессии {session_id} не найдено")
@@ -167,17 +184,16 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
             # Проверяем, передан ли чат менеджеру
             from telegram_bot.services.manager_service import manager_service
             
-            # Ищем активный чат поддержки для этой сессии
-            logger.info(f"🔍 Проверка передачи чата менеджеру для session_id: {session_id}")
-            support_chat = await check_if_transferred_to_manager(session_id)
+            # Маршрут сессии берется из кэша (память процесса / Redis), БД - только при промахе
+            route = await check_if_transferred_to_manager(session_id)
             
-            if support_chat and support_chat.is_active:
+            if route:
                 # Чат передан менеджеру - пересылаем сообщение
-                logger.info(f"✅ Чат {support_chat.chat_id} (сессия {session_id}) передан менеджеру {support_chat.manager.first_name}. Пересылка сообщения.")
+                logger.info(f"✅ Чат {route['chat_id']} (сессия {session_id}) передан менеджеру {route.get('manager_name')}. Пересылка сообщения.")
                 success = await manager_service.send_message_to_manager(
-                    chat_id=support_chat.chat_id,
+                    chat_id=route["chat_id"],
                     message_text=user_message,
-                    client_name=support_chat.client_name
+                    client_name=route.get("client_name")
                 )
                 
                 if success:
@@ -217,8 +233,29 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
             }
             await manager.send_personal_message(json.dumps(typing_message), websocket)
             
-            # Получаем историю разговора
-            conversation_history = await chat_manager.get_conversation_history(session_id, limit=10)
+            # Получаем всю сохраненную историю: построитель контекста укладывает в бюджет токенов
+            # последние реплики, а более ранние, еще не вошедшие в краткое содержание, сворачивает
+            conversation_history = await chat_manager.get_conversation_history(session_id, limit=None)
+            
+            # Фрагменты ответа отправляем клиенту по мере генерации (ai_delta),
+            # итоговое сообщение ai_message заменяет собранный текст
+            async def send_delta(chunk: str):
+                delta_message = {
+                    "type": "ai_delta",
+                    "content": chunk,
+                    "session_id": session_id
+                }
+                await manager.send_personal_message(json.dumps(delta_message), websocket)
+            
+            # При пиковой нагрузке запрос ждет свободный слот модели - сообщаем позицию в очереди
+            async def send_queue_status(position: int, queue_size: int):
+                queue_message = {
+                    "type": "queue_status",
+                    "position": position,
+                    "queue_size": queue_size,
+                    "session_id": session_id
+                }
+                await manager.send_personal_message(json.dumps(queue_message), websocket)
             
             # Генерируем умный ответ через OpenRouter API
             ai_response_data = await openrouter_ai.get_smart_response(
@@ -226,7 +263,9 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
                 context={
                     "session_id": session_id,
                     "conversation_history": conversation_history
-                }
+                },
+                on_delta=send_delta,
+                on_queue=send_queue_status
             )
             
             # Формируем ответное сообщение
@@ -237,6 +276,7 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
                 "intent": ai_response_data["intent"],
                 "processing_time": ai_response_data["processing_time"],
                 "model": ai_response_data["model"],
+                "cached": ai_response_data.get("cached", False),
                 "session_id": session_id
             }
             
@@ -273,10 +313,10 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
             
     except WebSocketDisconnect:
         print(f"📱 Пользователь отключился от сессии {session_id}")
-        manager.disconnect(websocket)
+        await manager.disconnect(websocket)
     except ConnectionResetError:
         print(f"🔌 Соединение сброшено для сессии {session_id}")
-        manager.disconnect(websocket)
+        await manager.disconnect(websocket)
     except Exception as e:
         print(f"❌ Ошибка WebSocket в сессии {session_id}: {e}")
         try:
@@ -290,7 +330,7 @@ async def websocket_chat(websocket: WebSocket, session_id: str = Query(None)):
         except:
             pass  # Если не удалось отправить, просто игнорируем
         finally:
-            manager.disconnect(websocket)
+            await manager.disconnect(websocket)
 
 @chat_router.get("/api/chat/sessions/{session_id}/stats")
 async def get_session_stats(session_id: str):
@@ -351,6 +391,11 @@ async def chat_health_check():
             "openrouter_api": "working" if test_response else "error",
             "active_sessions": stats.get("active_sessions", 0),
             "total_sessions": stats.get("total_sessions", 0),
+            "response_cache": response_cache.get_stats(),
+            "openrouter_transport": openrouter_ai.get_transport_stats(),
+            "prompt_cache": openrouter_ai.get_prompt_cache_stats(),
+            "ai_admission": ai_admission.get_stats(),
+            "context_builder": context_builder.get_stats(),
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -430,8 +475,8 @@ async def send_message_to_client(request: Request):
                 content={"success": False, "error": "session_id и message_json обязательны"}
             )
         
-        # Используем глобальный менеджер соединений из этого модуля
-        success = await manager.send_to_session(session_id, json.dumps(message_json, ensure_ascii=False))
+        # Доставляем через шину: сессию может обслуживать другой воркер
+        success = await webchat_bus.publish(session_id, message_json)
 
         if success:
             return {"success": True, "message": "Сообщение успешно отправлено клиенту."}
@@ -483,31 +528,16 @@ async def send_message_to_support(request: Request):
         }
 
 async def check_if_transferred_to_manager(session_id: str):
-    """Проверить, передан ли веб-чат менеджеру"""
+    """
+    Проверить, передан ли веб-чат менеджеру
+    
+    Returns:
+        {"chat_id", "client_name", "manager_name"} если чат у менеджера, иначе None
+    """
     try:
-        from telegram_bot.models.database import AsyncSessionLocal
-        from telegram_bot.models.support_models import SupportChat
-        from sqlalchemy import select
-        from sqlalchemy.orm import selectinload
-        
-        async with AsyncSessionLocal() as session:
-            # Ищем активный чат поддержки с указанным web_session_id
-            from sqlalchemy import text
-            result = await session.execute(
-                select(SupportChat)
-                .options(selectinload(SupportChat.manager))
-                .where(
-                    text("chat_metadata ->> 'web_session_id' = :session_id"),
-                    SupportChat.is_active == True
-                ).params(session_id=session_id)
-            )
-            support_chat = result.scalar_one_or_none()
-            return support_chat
-            
+        return await chat_routing.get_route(session_id)
     except Exception as e:
         logger.error(f"❌ Ошибка проверки передачи чата менеджеру: {e}")
-        import traceback
-        logger.error(f"Полная ошибка: {traceback.format_exc()}")
         return None
 
 @chat_router.get("/api/chat/{chat_id}/messages")
@@ -576,5 +606,7 @@ async def shutdown_event():
     print("🔄 Завершение работы чат-сервиса...")
     if openrouter_ai:
         await openrouter_ai.close()
-    await chat_manager.cleanup_sessions() # Убедитесь, что эта функция корректно останавливает задачу
+    await chat_manager.shutdown()
+    await webchat_bus.close()
+    await messenger.close()
     print("✅ Чат-сервис корректно завершен") 
\ No newline at end of file
@@ -4,11 +4,18 @@
 """
 
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 import asyncio
+import hmac
+import io
 import json
+import tempfile
 from datetime import datetime
+from typing import Optional
+
+from telegram_bot.config.settings import settings
+from telegram_bot.services.application_validation import validate_signup, ApplicationValidationError
 
 # Создаем роутер для основных маршрутов
 main_router = APIRouter()
@@ -16,6 +23,18 @@ main_router = APIRouter()
 # Настройка шаблонов
 templates = Jinja2Templates(directory="templates")
 
+@main_router.on_event("startup")
+async def start_application_workers():
+    """Запуск фоновой обработки заявок"""
+    from telegram_bot.services.application_pipeline import application_pipeline
+    application_pipeline.start()
+
+@main_router.on_event("shutdown")
+async def stop_application_workers():
+    """Остановка фоновой обработки заявок"""
+    from telegram_bot.services.application_pipeline import application_pipeline
+    await application_pipeline.stop()
+
 @main_router.get("/", response_class=HTMLResponse)
 async def read_root():
     """Главная страница сайта"""
@@ -93,107 +112,39 @@ async def signup_application(request: Request):
     try:
         data = await request.json()
         
-        # Валидация обязательных полей
-        required_fields = ["fullName", "phone", "age", "city", "category"]
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return {"success": False, "error": f"Поле {field} обязательно для заполнения"}
+        # Валидация по общим правилам (те же, что у массового импорта)
+        try:
+            application_data = validate_signup(data)
+        except ApplicationValidationError as e:
+            return {"success": False, "error": str(e)}
         
-        # Специальная валидация в зависимости от категории
-        category = data["category"]
-        if category in ["driver", "both", "cargo"]:
-            if "experience" not in data or not data["experience"]:
-                return {"success": False, "error": "Для водителей обязательно указать стаж вождения"}
+        category = application_data["category"]
         
-        if category in ["courier", "both"]:
-            if "transport" not in data or not data["transport"]:
-                return {"success": False, "error": "Для курьеров обязательно указать вид транспорта"}
+        print(f"📋 Новая заявка на подключение ({category}): {application_data}")
         
-        if category == "cargo":
-            if "loadCapacity" not in data or not data["loadCapacity"]:
-                return {"success": False, "error": "Для грузовых перевозок обязательно указать грузоподъемность"}
+        # Сохраняем заявку; назначение менеджера и уведомления выполняются в фоне
+        from telegram_bot.services.application_pipeline import application_pipeline
         
-        # Создаем заявку
-        application_data = {
-            "id": f"app_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{category}",
-            "category": category,
-            
-            # Основные поля (используем правильные имена полей из формы)
-            "full_name": data["fullName"],
-            "phone": data["phone"],
-            "age": int(data["age"]),
-            "city": data["city"],
-            "email": data.get("email", ""),
-            
-            # Новые основные поля
-            "citizenship": data.get("citizenship"),
-            "workStatus": data.get("workStatus"),
-            "preferredTime": data.get("preferredTime"),
-            "workSchedule": data.get("workSchedule"),
-            "comments": data.get("comments"),
-            
-            # Информация для водителей
-            "experience": data.get("experience"),
-            "hasDriverLicense": data.get("hasDriverLicense"),
-            "hasCar": data.get("hasCar"),
-            "carBrand": data.get("carBrand"),
-            "carModel": data.get("carModel"),
-            "carYear": data.get("carYear"),
-            "carClass": data.get("carClass"),
-            "hasTaxiPermit": data.get("hasTaxiPermit"),
-            
-            # Информация для курьеров
-            "transport": data.get("transport", ""),
-            "deliveryType": data.get("deliveryType", []),
-            "hasThermoBag": data.get("hasThermoBag"),
-            "courierLicense": data.get("courierLicense"),
-            
-            # Информация для грузовых
-            "loadCapacity": data.get("loadCapacity", ""),
-            "truckType": data.get("truckType"),
-            "cargoLicense": data.get("cargoLicense"),
-            
-            # Документы и опыт
-            "workExperience": data.get("workExperience"),
-            "previousPlatforms": data.get("previousPlatforms"),
-            "hasMedicalCert": data.get("hasMedicalCert"),
-            "documents": data.get("documents", []),
-            
-            # Согласия
-            "hasDocuments": data.get("hasDocuments", False),
-            "agreeTerms": data.get("agreeTerms", False),
-            "agreeMarketing": data.get("agreeMarketing", False),
-            
-            # Метаданные
-            "status": "new",
-            "created_at": datetime.now().isoformat(),
-            "source": "signup_page"
-        }
+        result = await application_pipeline.submit(
+            application_data,
+            idempotency_key=request.headers.get("Idempotency-Key")
+        )
         
-        print(f"📋 Новая заявка на подключение ({category}): {application_data}")
+        if not result:
+            return {"success": False, "error": "Не удалось сохранить заявку, попробуйте позже"}
         
-        # Интегрируем с Telegram ботом для отправки заявки менеджерам
-        try:
-            # Импортируем функцию обработки заявок
-            from telegram_bot.services.application_service import handle_new_application_from_site
-            
-            # Обрабатываем заявку через Telegram бот (передаем исходные данные формы)
-            # Передаем уже обработанные и приведённые к нужным типам данные
-            bot_success = await handle_new_application_from_site(application_data)
-            
-            if bot_success:
-                print(f"✅ Заявка успешно отправлена менеджерам через Telegram бот")
-            else:
-                print(f"⚠️ Заявка сохранена локально (бот временно недоступен)")
-                
-        except Exception as e:
-            print(f"❌ Ошибка интеграции с Telegram ботом: {e}")
-            # Логируем полную ошибку для отладки
-            import traceback
-            print(f"Подробности ошибки: {traceback.format_exc()}")
+        if result["in_progress"]:
+            # Первая отправка с этим ключом еще не завершилась - исход неизвестен, успех не подтверждаем
+            return JSONResponse(
+                status_code=409,
+                headers={"Retry-After": "1"},
+                content={"success": False, "in_progress": True, "error": "Заявка уже обрабатывается, повторите запрос"}
+            )
         
-        # Имитируем обработку заявки
-        await asyncio.sleep(1)
+        if result["duplicate"]:
+            print(f"🔁 Повторная отправка заявки, ID: {result['application_id']}")
+        else:
+            print(f"✅ Заявка #{result['application_id']} сохранена и поставлена в очередь обработки")
         
         # Определяем тип заявки для ответа
         category_names = {
@@ -216,6 +167,44 @@ async def signup_application(request: Request):
         print(f"❌ Ошибка обработки заявки на подключение: {e}")
         return {"success": False, "error": "Произошла ошибка при обработке заявки"}
 
+@main_router.post("/api/applications/import")
+async def import_applications(
+    request: Request,
+    format: Optional[str] = None,
+    batch_size: int = 500,
+    auto_assign: bool = True
+):
+    """
+    Массовый импорт заявок (CSV с заголовком из имен полей формы или JSONL)
+    
+    Требует заголовок X-API-Key со значением API_SECRET_KEY. Тело запроса читается потоком
+    во временный файл, строки проверяются по правилам /api/signup.
+    """
+    if settings.API_SECRET_KEY in ("", "your-secret-key"):
+        raise HTTPException(status_code=503, detail="API_SECRET_KEY не настроен")
+    
+    if not hmac.compare_digest(request.headers.get("X-API-Key", ""), settings.API_SECRET_KEY):
+        raise HTTPException(status_code=401, detail="Неверный API-ключ")
+    
+    from telegram_bot.services.application_import import ApplicationImporter, FORMATS, detect_format, iter_records
+    
+    fmt = format or detect_format(request.headers.get("content-type", ""))
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail="Укажите формат: ?format=csv или ?format=jsonl")
+    
+    with tempfile.TemporaryFile() as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        importer = ApplicationImporter(batch_size=min(batch_size, 5000), auto_assign=auto_assign)
+        stats = await importer.run(iter_records(text, fmt))
+        text.detach()
+    
+    print(f"📥 Импорт заявок: {stats['inserted']}/{stats['total']} ({stats['rows_per_second']} строк/с)")
+    return {"success": True, **stats}
+
 @main_router.get("/api/stats")
 async def get_stats():
     """Получение статистики таксопарка"""
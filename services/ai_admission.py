@@ -0,0 +1,245 @@
+"""
+AI Admission - Контроль допуска запросов к ИИ-консультанту
+Ограничивает число одновременных запросов к каждой модели OpenRouter; остальные ждут
+в ограниченной очереди, которая обслуживает сессии по кругу (одна активная вкладка
+не вытесняет остальных), сообщает клиенту позицию в очереди и собирает метрики
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+# Колбэк позиции в очереди: (позиция начиная с 1, всего ожидающих в очереди модели)
+QueueCallback = Callable[[int, int], Awaitable[None]]
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь переполнена, у сессии слишком много запросов или истек срок ожидания"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("session_id", "future", "enqueued_at")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """Очередь и слоты одной модели"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        # session_id -> ожидающие запросы сессии; порядок ключей - очередность обслуживания по кругу
+        self.sessions: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self.waiting = 0
+
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "session_busy": 0, "timeout": 0}
+        self.wait_times: Deque[float] = deque(maxlen=500)
+        self.max_waiting = 0
+
+    def position(self, waiter: _Waiter) -> int:
+        """Позиция в порядке обслуживания по кругу (без учета лимитов сессий)"""
+        queue = self.sessions.get(waiter.session_id)
+        if not queue or waiter not in queue:
+            return 0
+
+        index = queue.index(waiter)
+        ahead = 0
+        before_own = True
+        for session_id, other in self.sessions.items():
+            if session_id == waiter.session_id:
+                before_own = False
+                continue
+            # Сессии раньше в круге успевают получить index+1 слотов, остальные - index
+            ahead += min(len(other), index + 1 if before_own else index)
+        return ahead + index + 1
+
+    def remove(self, waiter: _Waiter) -> bool:
+        queue = self.sessions.get(waiter.session_id)
+        if not queue or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            del self.sessions[waiter.session_id]
+        self.waiting -= 1
+        return True
+
+
+class AdmissionController:
+    """Семафоры моделей, справедливая очередь между сессиями и лимит запросов на сессию"""
+
+    def __init__(self):
+        self.lanes: Dict[str, _Lane] = {
+            "consultant": _Lane("consultant", int(os.getenv("AI_CONSULTANT_CONCURRENCY", "8"))),
+            "search": _Lane("search", int(os.getenv("AI_SEARCH_CONCURRENCY", "4")))
+        }
+        self.max_queue = int(os.getenv("AI_QUEUE_MAX", "100"))  # Ожидающих на одну модель
+        self.queue_timeout = float(os.getenv("AI_QUEUE_TIMEOUT", "30"))
+        self.session_max_in_flight = int(os.getenv("AI_SESSION_MAX_IN_FLIGHT", "1"))
+        self.session_max_queued = int(os.getenv("AI_SESSION_MAX_QUEUED", "2"))
+        self.status_interval = 1.0  # Как часто обновлять позицию в очереди у клиента
+
+        # Выполняемые запросы по сессиям (по всем моделям)
+        self.in_flight: Dict[str, int] = {}
+
+    def _session_ready(self, session_id: str) -> bool:
+        return self.in_flight.get(session_id, 0) < self.session_max_in_flight
+
+    def _grant(self, lane: _Lane, session_id: str):
+        lane.active += 1
+        lane.admitted += 1
+        self.in_flight[session_id] = self.in_flight.get(session_id, 0) + 1
+
+    def _dispatch(self):
+        """Раздать освободившиеся слоты ожидающим: сессии по кругу, пропуская занятые"""
+        for lane in self.lanes.values():
+            while lane.active < lane.limit and lane.waiting:
+                session_id = next((sid for sid in lane.sessions if self._session_ready(sid)), None)
+                if session_id is None:
+                    break
+
+                queue = lane.sessions[session_id]
+                waiter = queue.popleft()
+                lane.waiting -= 1
+                if queue:
+                    lane.sessions.move_to_end(session_id)
+                else:
+                    del lane.sessions[session_id]
+
+                self._grant(lane, session_id)
+                lane.wait_times.append(time.monotonic() - waiter.enqueued_at)
+                waiter.future.set_result(True)
+
+    def _release(self, lane: _Lane, session_id: str):
+        lane.active -= 1
+        remaining = self.in_flight.get(session_id, 1) - 1
+        if remaining > 0:
+            self.in_flight[session_id] = remaining
+        else:
+            self.in_flight.pop(session_id, None)
+        self._dispatch()
+
+    async def _wait(self, lane: _Lane, waiter: _Waiter, on_queue: Optional[QueueCallback]):
+        """Ожидание слота с периодической отправкой позиции в очереди"""
+        deadline = waiter.enqueued_at + self.queue_timeout
+        last_position = None
+        try:
+            while True:
+                position = lane.position(waiter)
+                if on_queue and position and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queue(position, lane.waiting)
+                    except Exception as e:
+                        print(f"⚠️ Не удалось отправить позицию в очереди: {e}")
+
+                # Слот мог быть выдан, пока отправлялась позиция в очереди
+                if waiter.future.done():
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), timeout=min(remaining, self.status_interval))
+                    return
+                except asyncio.TimeoutError:
+                    if waiter.future.done():
+                        return
+        except BaseException as e:
+            if lane.remove(waiter):
+                if isinstance(e, asyncio.TimeoutError):
+                    lane.rejected["timeout"] += 1
+                    raise AdmissionRejected("timeout") from None
+                raise
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Срок ожидания истек одновременно с выдачей слота - слот уже наш, используем его
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                # Ожидание прервано (отмена) после выдачи слота - возвращаем слот
+                self._release(lane, waiter.session_id)
+            if isinstance(e, asyncio.TimeoutError):
+                lane.rejected["timeout"] += 1
+                raise AdmissionRejected("timeout") from None
+            raise
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str, session_id: Optional[str], on_queue: Optional[QueueCallback] = None) -> AsyncIterator[float]:
+        """
+        Занять слот модели на время запроса
+
+        Args:
+            lane_name: consultant или search
+            session_id: Сессия чата (без сессии запрос считается отдельной сессией)
+            on_queue: Корутина для уведомления клиента о позиции в очереди
+
+        Yields:
+            Время ожидания в очереди (сек)
+
+        Raises:
+            AdmissionRejected: Запрос не допущен
+        """
+        lane = self.lanes[lane_name]
+        session_id = session_id or f"anonymous:{id(asyncio.current_task())}"
+        started = time.monotonic()
+
+        if lane.active < lane.limit and not lane.waiting and self._session_ready(session_id):
+            self._grant(lane, session_id)
+            lane.wait_times.append(0.0)
+        else:
+            if lane.waiting >= self.max_queue:
+                lane.rejected["queue_full"] += 1
+                raise AdmissionRejected("queue_full")
+            if len(lane.sessions.get(session_id, ())) >= self.session_max_queued:
+                lane.rejected["session_busy"] += 1
+                raise AdmissionRejected("session_busy")
+
+            waiter = _Waiter(session_id)
+            lane.sessions.setdefault(session_id, deque()).append(waiter)
+            lane.waiting += 1
+            lane.queued_total += 1
+            lane.max_waiting = max(lane.max_waiting, lane.waiting)
+            # Слот мог освободиться для этой сессии, а очередь - состоять только из нее
+            self._dispatch()
+            await self._wait(lane, waiter, on_queue)
+
+        try:
+            yield time.monotonic() - started
+        finally:
+            self._release(lane, session_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очередей, занятость слотов и время ожидания по моделям"""
+        stats = {}
+        for name, lane in self.lanes.items():
+            waits = sorted(lane.wait_times)
+            stats[name] = {
+                "limit": lane.limit,
+                "active": lane.active,
+                "queued": lane.waiting,
+                "queued_sessions": len(lane.sessions),
+                "max_queued": lane.max_waiting,
+                "admitted": lane.admitted,
+                "queued_total": lane.queued_total,
+                "rejected": dict(lane.rejected),
+                "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p95_wait": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                "max_wait": round(waits[-1], 3) if waits else 0.0
+            }
+        stats["sessions_in_flight"] = len(self.in_flight)
+        return stats
+
+# Глобальный экземпляр контроля допуска (общий для всех экземпляров OpenRouterAI в процессе)
+ai_admission = AdmissionController()
@@ -0,0 +1,232 @@
+"""
+Context Builder - Сборка контекста запроса к OpenRouter в бюджете токенов
+Последние реплики укладываются в бюджет от новых к старым, не поместившиеся
+сворачиваются в краткое содержание разговора, которое хранится в контексте сессии
+и обновляется в фоне. Usage из ответов OpenRouter накапливается по сессиям.
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services.chat_manager import chat_manager
+
+# Колбэк сворачивания истории: (прежнее краткое содержание, новые реплики) -> новое краткое содержание
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]], Optional[str]], Awaitable[Optional[str]]]
+
+# Служебные токены разметки одного сообщения (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_HEADER = "Краткое содержание предыдущей части разговора с пользователем:\n"
+
+
+class TokenEstimator:
+    """
+    Оценка числа токенов по длине текста
+
+    Токенизаторы моделей недоступны локально, поэтому число символов на токен
+    подстраивается по prompt_tokens из ответов OpenRouter (скользящее среднее).
+    """
+
+    def __init__(self, chars_per_token: float = 3.0):
+        self.chars_per_token = chars_per_token
+        self.samples = 0
+
+    def count(self, text: str) -> int:
+        return MESSAGE_OVERHEAD + math.ceil(len(text or "") / self.chars_per_token)
+
+    def calibrate(self, prompt_chars: int, message_count: int, prompt_tokens: int):
+        """Уточнить оценку по фактическому prompt_tokens запроса"""
+        text_tokens = prompt_tokens - MESSAGE_OVERHEAD * message_count
+        if prompt_chars <= 0 or text_tokens <= 0:
+            return
+
+        observed = min(6.0, max(1.5, prompt_chars / text_tokens))
+        self.chars_per_token += 0.1 * (observed - self.chars_per_token)
+        self.samples += 1
+
+
+class ContextBuilder:
+    """Построитель контекста: бюджет токенов истории, краткое содержание, учет usage по сессиям"""
+
+    def __init__(self):
+        self.history_budget = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+        self.summary_max_tokens = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+        # Сворачивать историю, только когда из бюджета выпало хотя бы столько реплик
+        self.summary_min_messages = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "2"))
+        self.estimator = TokenEstimator(float(os.getenv("CHAT_CHARS_PER_TOKEN", "3.0")))
+
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        # Учет ответа и фонового сворачивания одной сессии не должен перезаписывать друг друга
+        self._usage_lock = asyncio.Lock()
+
+        # Статистика
+        self.builds = 0
+        self.history_tokens_sum = 0
+        self.dropped_messages = 0
+        self.summaries = 0
+        self.summary_failures = 0
+        self.usage_totals = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+
+    async def build(
+        self,
+        session_id: Optional[str],
+        system_prompt: str,
+        history: Optional[List[Dict[str, Any]]],
+        user_message: str,
+        summarizer: Optional[Summarizer] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Собрать сообщения запроса: системный промпт, краткое содержание, реплики в бюджете, вопрос
+
+        Args:
+            session_id: Сессия чата (без нее краткое содержание не используется)
+            system_prompt: Системный промпт
+            history: История в формате get_conversation_history (от старых к новым)
+            user_message: Текущее сообщение пользователя
+            summarizer: Корутина сворачивания выпавших из бюджета реплик (запускается в фоне)
+        """
+        history = list(history or [])
+        # Текущее сообщение уже сохранено в истории перед запросом - не дублируем его
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == user_message:
+            history.pop()
+
+        context = await chat_manager.get_context(session_id) if session_id else {}
+        summary = context.get("history_summary")
+        summary_until = context.get("summary_until") or 0
+
+        # Реплики, уже вошедшие в краткое содержание, в запрос не попадают
+        history = [message for message in history if (message.get("timestamp") or 0) > summary_until or not summary]
+
+        budget = self.history_budget
+        if summary:
+            budget -= self.estimator.count(SUMMARY_HEADER + summary)
+
+        kept: List[Dict[str, Any]] = []
+        used = 0
+        for message in reversed(history):
+            tokens = self.estimator.count(message.get("content", ""))
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+
+        dropped = history[:len(history) - len(kept)]
+        self.builds += 1
+        self.history_tokens_sum += used
+        self.dropped_messages += len(dropped)
+
+        if session_id and summarizer and len(dropped) >= self.summary_min_messages:
+            self._schedule_summary(session_id, summary, dropped, summarizer)
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": SUMMARY_HEADER + summary})
+        messages.extend({"role": message["role"], "content": message["content"]} for message in kept)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    # Краткое содержание
+
+    def _schedule_summary(self, session_id: str, summary: Optional[str], dropped: List[Dict[str, Any]], summarizer: Summarizer):
+        task = self._summary_tasks.get(session_id)
+        if task and not task.done():
+            return
+
+        task = asyncio.create_task(self._summarize(session_id, summary, dropped, summarizer))
+        self._summary_tasks[session_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(session_id, None))
+
+    async def _summarize(self, session_id: str, summary: Optional[str], dropped: List[Dict[str, Any]], summarizer: Summarizer):
+        """Свернуть выпавшие реплики вместе с прежним кратким содержанием и сохранить в контекст сессии"""
+        started = time.monotonic()
+        new_summary = None
+        try:
+            new_summary = await summarizer(summary, dropped, session_id)
+        except Exception as e:
+            print(f"⚠️ Ошибка сворачивания истории сессии {session_id}: {e}")
+
+        if not new_summary:
+            # Модель недоступна - сохраняем хотя бы вопросы пользователя
+            self.summary_failures += 1
+            new_summary = self.extractive_summary(summary, dropped)
+
+        await chat_manager.update_context(session_id, {
+            "history_summary": new_summary,
+            "summary_until": max(message.get("timestamp") or 0 for message in dropped),
+            "summary_tokens": self.estimator.count(new_summary)
+        })
+        self.summaries += 1
+        print(f"📝 История сессии {session_id} свернута: {len(dropped)} реплик за {time.monotonic() - started:.1f}с")
+
+    def extractive_summary(self, summary: Optional[str], dropped: List[Dict[str, Any]]) -> str:
+        """Краткое содержание без модели: прежнее содержание и вопросы пользователя, обрезанные по бюджету"""
+        questions = [message["content"].strip()[:200] for message in dropped if message.get("role") == "user"]
+        parts = [summary] if summary else []
+        if questions:
+            parts.append("Пользователь спрашивал: " + "; ".join(questions))
+
+        text = "\n".join(parts)
+        max_chars = int(self.summary_max_tokens * self.estimator.chars_per_token)
+        # Старое содержание менее важно - при переполнении обрезается начало
+        return text[-max_chars:]
+
+    # Учет токенов
+
+    async def record_usage(self, session_id: Optional[str], usage: Optional[Dict[str, Any]], prompt_chars: int = 0, message_count: int = 0):
+        """Учесть usage ответа OpenRouter в сессии и уточнить оценку токенов"""
+        if not usage:
+            return
+
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        cached_tokens = int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        cost = float(usage.get("cost") or 0)
+
+        if prompt_tokens and prompt_chars:
+            self.estimator.calibrate(prompt_chars, message_count, prompt_tokens)
+
+        totals = self.usage_totals
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["total_tokens"] += prompt_tokens + completion_tokens
+        totals["cost"] += cost
+
+        if not session_id:
+            return
+
+        try:
+            async with self._usage_lock:
+                context = await chat_manager.get_context(session_id)
+                session_usage = context.get("usage") or {}
+                await chat_manager.update_context(session_id, {"usage": {
+                    "requests": session_usage.get("requests", 0) + 1,
+                    "prompt_tokens": session_usage.get("prompt_tokens", 0) + prompt_tokens,
+                    "cached_tokens": session_usage.get("cached_tokens", 0) + cached_tokens,
+                    "completion_tokens": session_usage.get("completion_tokens", 0) + completion_tokens,
+                    "total_tokens": session_usage.get("total_tokens", 0) + prompt_tokens + completion_tokens,
+                    "cost": round(session_usage.get("cost", 0) + cost, 6)
+                }})
+        except Exception as e:
+            print(f"⚠️ Ошибка учета токенов сессии {session_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "history_budget": self.history_budget,
+            "avg_history_tokens": round(self.history_tokens_sum / self.builds, 1) if self.builds else 0,
+            "dropped_messages": self.dropped_messages,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "summaries_in_progress": len(self._summary_tasks),
+            "chars_per_token": round(self.estimator.chars_per_token, 3),
+            "calibration_samples": self.estimator.samples,
+            "usage": dict(self.usage_totals, cost=round(self.usage_totals["cost"], 6))
+        }
+
+# Глобальный экземпляр построителя контекста
+context_builder = ContextBuilder()
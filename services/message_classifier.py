@@ -0,0 +1,154 @@
+"""
+Message Classifier - Классификация сообщений ИИ-консультанта
+Все наборы ключевых слов (интенты, признаки веб-поиска, темы резервных ответов)
+собраны при импорте в одно регулярное выражение-префиксное дерево; один проход по
+сообщению дает интент, необходимость веб-поиска и тему резервного ответа
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Tuple
+
+# Порядок важен: побеждает первый интент, у которого нашлось ключевое слово
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "greeting": ["привет", "здравствуй", "добро", "хай", "hey"],
+    "documents": ["документы", "справки", "нужно", "требования", "паспорт", "права"],
+    "earnings": ["заработок", "деньги", "зарплата", "доход", "сколько", "платят"],
+    "connection": ["подключ", "регистр", "оформ", "заявка", "начать"],
+    "car_rental": ["машина", "авто", "аренда", "автопарк", "тачка"],
+    "schedule": ["график", "время", "смена", "работать", "часы"],
+    "courier": ["курьер", "доставка", "еда", "пешком", "велосипед"],
+    "taxi": ["водитель", "такси", "машина", "поездка"],
+    "commission": ["комиссия", "процент", "забирает", "остается"],
+    "support": ["помощь", "поддержка", "вопрос", "проблема"],
+    "web_search": ["где", "адрес", "медкнижка", "поликлиника", "мфц", "телефон"]
+}
+
+# Ключевые слова, указывающие на необходимость актуальной информации
+WEB_SEARCH_KEYWORDS: List[str] = [
+    # Географические запросы
+    "где", "адрес", "находится", "местонахождение", "как добраться",
+    # Медицинские услуги и документы
+    "медкнижка", "медкнижку", "медицинская книжка", "справка", "медицинская справка", "медсправка", "анализы",
+    "поликлиника", "больница", "медцентр", "клиника",
+    # Административные услуги
+    "мфц", "госуслуги", "паспорт", "справка о несудимости",
+    # Разрешения
+    "лицензия", "лицензию", "разрешение", "разрешения",
+    # Актуальная информация
+    "сейчас", "сегодня", "текущий", "последний", "новый", "цена", "стоимость",
+    # Время и расписание
+    "расписание", "часы работы", "время работы", "график",
+    # Контакты и телефоны
+    "телефон", "номер", "контакт", "связаться",
+    # Конкретные города и районы
+    "пенза", "пензе", "москва", "москве", "санкт-петербург", "санкт-петербурга", "питер", "питере", "район", "городе", "области"
+]
+
+# Темы резервных ответов (когда API недоступно), в порядке проверки
+FALLBACK_KEYWORDS: Dict[str, List[str]] = {
+    "greeting": ["привет", "здравствуй", "добро"],
+    "documents": ["документы", "нужно", "требования"],
+    "earnings": ["заработок", "деньги", "зарплата", "доход"],
+    "connection": ["подключ", "регистр", "оформ"],
+    "car_rental": ["машина", "авто", "аренда"],
+    "schedule": ["график", "время", "смена"],
+    "courier": ["курьер", "доставка", "еда"],
+    "cargo": ["груз", "грузовик", "фура", "камаз"]
+}
+
+DEFAULT_INTENT = "general"
+DEFAULT_FALLBACK = "default"
+
+_SEARCH_TAG = ("search", "")
+
+
+class Classification(NamedTuple):
+    """Результат классификации сообщения"""
+    intent: str
+    needs_web_search: bool
+    fallback_bucket: str
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Регулярное выражение-префиксное дерево: общие префиксы проверяются один раз, совпадение - самое длинное"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        terminal = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            return ("(?:" + body + ")?") if len(branches) == 1 and len(body) > 1 else body + "?"
+        return body
+
+    return build(trie)
+
+
+def _build() -> Tuple["re.Pattern", Dict[str, FrozenSet[Tuple[str, str]]]]:
+    tags: Dict[str, set] = {}
+    for intent, keywords in INTENT_KEYWORDS.items():
+        for keyword in keywords:
+            tags.setdefault(keyword, set()).add(("intent", intent))
+    for keyword in WEB_SEARCH_KEYWORDS:
+        tags.setdefault(keyword, set()).add(_SEARCH_TAG)
+    for bucket, keywords in FALLBACK_KEYWORDS.items():
+        for keyword in keywords:
+            tags.setdefault(keyword, set()).add(("fallback", bucket))
+
+    # Выражение находит в каждой позиции только самое длинное слово, поэтому найденное
+    # слово несет и метки всех ключевых слов, которые в него входят ("справка о несудимости" -> "справка")
+    closure = {}
+    for keyword in tags:
+        combined = set()
+        for other, other_tags in tags.items():
+            if other in keyword:
+                combined |= other_tags
+        closure[keyword] = frozenset(combined)
+
+    # Просмотр вперед: совпадения ищутся с каждой позиции и не поглощают друг друга
+    pattern = re.compile("(?=(" + _trie_pattern(tags) + "))")
+    return pattern, closure
+
+
+_PATTERN, _TAGS = _build()
+
+_INTENT_ORDER = {intent: index for index, intent in enumerate(INTENT_KEYWORDS)}
+_FALLBACK_ORDER = {bucket: index for index, bucket in enumerate(FALLBACK_KEYWORDS)}
+
+
+def _first(found: Iterable[str], order: Dict[str, int], default: str) -> str:
+    return min(found, key=order.__getitem__, default=default)
+
+
+@lru_cache(maxsize=2048)
+def classify(message: str) -> Classification:
+    """
+    Классифицировать сообщение за один проход
+
+    Результат кэшируется: одно сообщение классифицируется несколько раз за запрос
+    (интент, веб-поиск, резервный ответ при ошибке API)
+    """
+    tags = set()
+    for match in _PATTERN.finditer(message.lower()):
+        tags |= _TAGS[match.group(1)]
+
+    intents = [name for kind, name in tags if kind == "intent"]
+    buckets = [name for kind, name in tags if kind == "fallback"]
+    return Classification(
+        intent=_first(intents, _INTENT_ORDER, DEFAULT_INTENT),
+        needs_web_search=_SEARCH_TAG in tags,
+        fallback_bucket=_first(buckets, _FALLBACK_ORDER, DEFAULT_FALLBACK)
+    )
+
+
+def matched_keywords(message: str) -> List[str]:
+    """Найденные ключевые слова (для отладки классификации)"""
+    return [match.group(1) for match in _PATTERN.finditer(message.lower())]
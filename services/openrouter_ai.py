@@ -3,68 +3,27 @@ OpenRouter AI Service - Интеграция с OpenRouter API
 Умный ИИ-консультант для ILPO-TAXI таксопарка
 """
 
-import httpx
 import json
 import asyncio
-from typing import Optional, Dict, Any, List
+from contextlib import aclosing
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Tuple
 from datetime import datetime
+import hashlib
 import os
 import re
 
-class OpenRouterAI:
-    """Сервис для работы с OpenRouter API"""
-    
-    def __init__(self, api_key_consultant: str, api_key_search: str, base_url: str):
-        # Используем разные ключи и модели для разных задач
-        self.api_key_consultant = api_key_consultant
-        self.api_key_search = api_key_search
-        self.base_url = base_url
-        
-        # Основная модель (дешевая) для консультирования
-        self.model_consultant = os.getenv("OPENROUTER_MODEL_CONSULTANT", "google/gemini-2.0-flash-001")
-        # Поисковая модель (дорогая) только для веб-поиска
-        self.model_search = os.getenv("OPENROUTER_MODEL_SEARCH", "openai/gpt-4o-mini-search-preview")
-        
-        self.site_url = os.getenv("SITE_URL", "https://ilpo-taxi.top")
-        self.site_name = os.getenv("SITE_NAME", "ILPO-TAXI Smart Taxi")
+from services.ai_admission import ai_admission, AdmissionRejected, QueueCallback
+from services.context_builder import context_builder
+from services.message_classifier import classify
+from services.openrouter_transport import OpenRouterTransport
+from services.response_cache import response_cache
 
-        # Удаляем отладочный вывод
-        # print(f"DEBUG: OPENROUTER_API_KEY_CONSULTANT = {os.getenv('OPENROUTER_API_KEY_CONSULTANT')}")
+# Колбэк для потоковой передачи фрагментов ответа (например, в WebSocket)
+DeltaCallback = Callable[[str], Awaitable[None]]
 
-        if not self.api_key_consultant:
-            raise ValueError("OPENROUTER_API_KEY_CONSULTANT не найден в переменных окружения")
-        if not self.api_key_search:
-            raise ValueError("OPENROUTER_API_KEY_SEARCH не найден в переменных окружения")
-        
-        # Создаем HTTP клиенты для разных задач с правильными ключами
-        self.client_consultant = httpx.AsyncClient(
-            timeout=30.0,
-            headers={
-                "Authorization": f"Bearer {self.api_key_consultant}",
-                "HTTP-Referer": self.site_url,
-                "X-Title": self.site_name,
-                "Content-Type": "application/json"
-            }
-        )
-        
-        self.client_search = httpx.AsyncClient(
-            timeout=30.0,
-            headers={
-                "Authorization": f"Bearer {self.api_key_search}",
-                "HTTP-Referer": self.site_url,
-                "X-Title": self.site_name,
-                "Content-Type": "application/json"
-            }
-        )
-    
-    async def close(self):
-        """Закрыть HTTP клиенты"""
-        await self.client_consultant.aclose()
-        await self.client_search.aclose()
-    
-    def get_system_prompt(self) -> str:
-        """Возвращает системный промпт для ИИ-консультанта ILPO-TAXI"""
-        return """Ты - ИИ-консультант ILPO-TAXI, первого в России умного таксопарка. Твоя задача - помочь водителям и курьерам подключиться ТОЛЬКО к ILPO-TAXI.
+# Системный промпт ИИ-консультанта: собирается один раз при импорте и не меняется между
+# запросами, поэтому провайдеры с кэшированием промптов переиспользуют его как префикс
+SYSTEM_PROMPT = """Ты - ИИ-консультант ILPO-TAXI, первого в России умного таксопарка. Твоя задача - помочь водителям и курьерам подключиться ТОЛЬКО к ILPO-TAXI.
 
 ОГРАНИЧЕНИЯ НА ОТВЕТЫ:
 • Максимум 2000 токенов на ответ
@@ -150,7 +109,335 @@ class OpenRouterAI:
 
 КРИТИЧЕСКИ ВАЖНО: НИКОГДА не упоминай, не рекомендуй и не давай контакты других таксопарков. Ты работаешь ТОЛЬКО для ILPO-TAXI!"""
 
-    async def generate_response(self, user_message: str, conversation_history: List[Dict] = None, use_web_search: bool = True) -> str:
+# Версия промпта: входит в ключ кэша ответов и видна в health-check
+SYSTEM_PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+# Модели, которым нужна явная разметка cache_control (OpenAI, DeepSeek и др. кэшируют префикс сами)
+CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+# Инструкция для сворачивания выпавшей из бюджета части разговора
+SUMMARY_PROMPT = """Ты ведешь заметки о разговоре консультанта таксопарка ILPO-TAXI с пользователем.
+Обнови краткое содержание разговора с учетом новых реплик. Сохрани факты о пользователе
+(город, категория работы, транспорт, опыт, документы), его вопросы и что ему уже ответили.
+Пиши по-русски, кратко, списком, без приветствий и без выдумок."""
+
+# Резервные ответы по темам классификатора, когда API недоступен
+FALLBACK_RESPONSES = {
+    "greeting": "Привет! 👋 Я ИИ-консультант ILPO-TAXI. Помогу подключиться к Яндекс.Такси или Доставке через наш таксопарк. Что вас интересует - работа водителем, курьером или и то и другое?",
+    "documents": "📋 Для водителей нужны: паспорт, права, СТС, диагностическая карта. Для курьеров: паспорт, справка о несудимости. Подключение к ILPO-TAXI за 24 часа!",
+    "earnings": "💰 С ILPO-TAXI водители зарабатывают 80-120 тысяч, курьеры 50-80 тысяч рублей в месяц. Наша комиссия всего 1,5-7% - одна из самых низких в России!",
+    "connection": "🚀 Подключение к ILPO-TAXI очень быстрое! Водители - 24 часа, курьеры - 2-4 часа. Заполните заявку по ссылке <a href='/signup'>/signup</a> или свяжитесь с менеджером <a href='tel:+79273748151'>+7 (927) 374-81-51</a>!",
+    "car_rental": "🚗 Можете работать на своем авто или взять в аренду через ILPO-TAXI от 1200₽/сутки (для Пензы). У нас большой автопарк с лицензией такси!",
+    "schedule": "⏰ С ILPO-TAXI график работы свободный! Работайте когда удобно. Многие выбирают 8-12 часов в день, 5-6 дней в неделю.",
+    "courier": "🛵 Отличный выбор! Курьеры с ILPO-TAXI зарабатывают 50-80 тысяч в месяц. Подключение за 2-4 часа, можно работать пешком, на велосипеде или авто!",
+    "cargo": "🚛 Грузовые перевозки с ILPO-TAXI - это высокий заработок 100-150 тысяч в месяц! Работайте с любым типом груза и грузоподъемностью. Заполните заявку по ссылке <a href='/signup'>/signup</a>!",
+    "default": "🤖 Сейчас у меня технические неполадки, но я все равно помогу! Спрашивайте о документах, заработке, условиях работы или подключении к ILPO-TAXI. Что интересует больше всего?"
+}
+
+def _content_length(message: Dict[str, Any]) -> int:
+    """Длина текста сообщения (content - строка или список частей с cache_control)"""
+    content = message.get("content")
+    if isinstance(content, list):
+        return sum(len(part.get("text", "")) for part in content)
+    return len(content or "")
+
+class OpenRouterAI:
+    """Сервис для работы с OpenRouter API"""
+    
+    def __init__(self, api_key_consultant: str, api_key_search: str, base_url: str):
+        # Используем разные ключи и модели для разных задач
+        self.api_key_consultant = api_key_consultant
+        self.api_key_search = api_key_search
+        self.base_url = base_url
+        
+        # Основная модель (дешевая) для консультирования
+        self.model_consultant = os.getenv("OPENROUTER_MODEL_CONSULTANT", "google/gemini-2.0-flash-001")
+        # Поисковая модель (дорогая) только для веб-поиска
+        self.model_search = os.getenv("OPENROUTER_MODEL_SEARCH", "openai/gpt-4o-mini-search-preview")
+        
+        self.site_url = os.getenv("SITE_URL", "https://ilpo-taxi.top")
+        self.site_name = os.getenv("SITE_NAME", "ILPO-TAXI Smart Taxi")
+        
+        # Потоковая передача ответов (SSE) - можно отключить через окружение
+        self.streaming_enabled = os.getenv("OPENROUTER_STREAMING", "true").lower() in ("1", "true", "yes")
+        
+        # Хэш системного промпта входит в ключ кэша: после правки промпта старые ответы не используются
+        self.system_prompt_hash = SYSTEM_PROMPT_VERSION
+        
+        # Кэширование системного промпта у провайдера: OPENROUTER_<CONSULTANT|SEARCH>_PROMPT_CACHE = auto | true | false
+        # (auto - разметка cache_control только для моделей, которые без нее не кэшируют)
+        self.prompt_cache = {
+            self.model_consultant: self._prompt_cache_enabled(self.model_consultant, "CONSULTANT"),
+            self.model_search: self._prompt_cache_enabled(self.model_search, "SEARCH")
+        }
+        # Модель -> запросы, токены промпта, из них взятые из кэша провайдера, скидка за кэш
+        self.prompt_cache_stats: Dict[str, Dict[str, float]] = {}
+
+        # Удаляем отладочный вывод
+        # print(f"DEBUG: OPENROUTER_API_KEY_CONSULTANT = {os.getenv('OPENROUTER_API_KEY_CONSULTANT')}")
+
+        if not self.api_key_consultant:
+            raise ValueError("OPENROUTER_API_KEY_CONSULTANT не найден в переменных окружения")
+        if not self.api_key_search:
+            raise ValueError("OPENROUTER_API_KEY_SEARCH не найден в переменных окружения")
+        
+        # Транспорт на каждую модель: свой пул соединений, таймауты, повторы и выключатель.
+        # Таймауты и повторы настраиваются через OPENROUTER_CONSULTANT_* / OPENROUTER_SEARCH_*
+        self.transport_consultant = OpenRouterTransport.from_env(
+            self.model_consultant, "CONSULTANT", self.base_url, self._headers(self.api_key_consultant), read_timeout=20.0
+        )
+        self.transport_search = OpenRouterTransport.from_env(
+            self.model_search, "SEARCH", self.base_url, self._headers(self.api_key_search), read_timeout=30.0
+        )
+
+        # Хеджирование: если поисковая модель не начала отвечать за столько секунд,
+        # параллельно запускается консультативная и используется первый ответ (0 - выключено)
+        self.hedge_after = float(os.getenv("OPENROUTER_HEDGE_AFTER", "0"))
+        self.hedge_stats = {"started": 0, "won_by_consultant": 0}
+
+    def _headers(self, api_key: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": self.site_url,
+            "X-Title": self.site_name,
+            "Content-Type": "application/json"
+        }
+
+    async def close(self):
+        """Закрыть HTTP клиенты"""
+        await self.transport_consultant.close()
+        await self.transport_search.close()
+
+    def _prompt_cache_enabled(self, model: str, env_prefix: str) -> bool:
+        mode = os.getenv(f"OPENROUTER_{env_prefix}_PROMPT_CACHE", "auto").lower()
+        if mode == "auto":
+            return model.startswith(CACHE_CONTROL_PREFIXES)
+        return mode in ("1", "true", "yes")
+
+    def _with_prompt_cache(self, model: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Пометить статический системный промпт точкой кэширования (cache_control), если это включено для модели"""
+        if not self.prompt_cache.get(model) or not messages or messages[0].get("content") != SYSTEM_PROMPT:
+            return messages
+        
+        cached_prompt = {
+            "role": "system",
+            "content": [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        }
+        return [cached_prompt] + messages[1:]
+
+    def _record_prompt_cache(self, model: str, usage: Dict[str, Any]):
+        """Учесть по usage ответа, сколько токенов промпта провайдер взял из кэша"""
+        if not usage:
+            return
+        
+        stats = self.prompt_cache_stats.setdefault(model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_discount": 0.0})
+        stats["requests"] += 1
+        stats["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        stats["cached_tokens"] += int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        stats["cache_discount"] += float(usage.get("cache_discount") or 0)
+
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        """Версия системного промпта и доля токенов промпта из кэша провайдера по моделям"""
+        models = {}
+        for model, stats in self.prompt_cache_stats.items():
+            models[model] = dict(
+                stats,
+                cache_discount=round(stats["cache_discount"], 6),
+                cached_share=round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
+            )
+        
+        return {
+            "system_prompt_version": SYSTEM_PROMPT_VERSION,
+            "system_prompt_chars": len(SYSTEM_PROMPT),
+            "cache_control": dict(self.prompt_cache),
+            "models": models
+        }
+
+    def get_transport_stats(self) -> Dict[str, Any]:
+        """Состояние транспортов моделей для health-check"""
+        return {
+            "consultant": self.transport_consultant.get_stats(),
+            "search": self.transport_search.get_stats(),
+            "hedge_after": self.hedge_after,
+            "hedging": dict(self.hedge_stats)
+        }
+    
+    def get_system_prompt(self) -> str:
+        """Возвращает системный промпт для ИИ-консультанта ILPO-TAXI"""
+        return SYSTEM_PROMPT
+
+    def _truncate_response(self, ai_response: str) -> str:
+        """Обрезает слишком длинный ответ модели"""
+        max_chars = 8000  # Примерно 1500-2000 токенов
+        if len(ai_response) > max_chars:
+            # Обрезаем ответ и добавляем примечание
+            ai_response = ai_response[:max_chars].rsplit(' ', 1)[0] + "...\n\n💬 [Ответ сокращен для краткости. Задайте уточняющий вопрос для получения дополнительной информации.]"
+            print(f"✂️ Ответ обрезан до {len(ai_response)} символов")
+        return ai_response
+
+    async def _complete(self, transport: OpenRouterTransport, payload: Dict[str, Any], on_delta: Optional[DeltaCallback] = None) -> Optional[Dict[str, Any]]:
+        """
+        Выполняет запрос к модели; с on_delta - в режиме stream с пересылкой дельт
+        
+        Args:
+            transport: Транспорт модели
+            payload: Тело запроса к /chat/completions
+            on_delta: Корутина, получающая очередной фрагмент ответа
+            
+        Returns:
+            {"content", "usage", "partial"} или None, если модель не вернула ответ;
+            partial=True - поток оборвался ошибкой и ответ может быть неполным
+        """
+        if on_delta is None:
+            try:
+                result = await transport.post(payload)
+                if not result:
+                    return None
+                usage = result.get("usage") or {}
+                self._record_prompt_cache(payload["model"], usage)
+                return {"content": result["choices"][0]["message"]["content"], "usage": usage, "partial": False}
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"⚠️ Некорректный ответ модели {transport.name}: {e}")
+                return None
+        
+        stream_payload = dict(payload, stream=True)
+        max_chars = 8000
+        chunks: List[str] = []
+        received = 0
+        usage: Dict[str, Any] = {}
+        partial = False
+        # Ответ полный, только если поток дошел до finish_reason или [DONE]: молча оборванный
+        # поток не должен попасть в кэш как готовый ответ
+        completed = False
+        
+        try:
+            async with aclosing(transport.stream_lines(stream_payload)) as lines:
+                async for line in lines:
+                    # SSE: полезные строки начинаются с "data: ", комментарии (": OPENROUTER PROCESSING") пропускаем
+                    if not line.startswith("data:"):
+                        continue
+                    
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        completed = True
+                        break
+                    
+                    try:
+                        event = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    
+                    if event.get("error"):
+                        # Отказ модели уже учтен выключателем транспорта; полученный текст обрезан
+                        print(f"⚠️ Ошибка в потоке OpenRouter: {event['error']}")
+                        partial = True
+                        break
+                    
+                    # Статистика использования приходит последним чанком
+                    if event.get("usage"):
+                        usage = event["usage"]
+                    
+                    choices = event.get("choices") or []
+                    if not choices:
+                        continue
+                    
+                    if choices[0].get("finish_reason"):
+                        completed = True
+                    
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if not delta:
+                        continue
+                    
+                    chunks.append(delta)
+                    received += len(delta)
+                    await on_delta(delta)
+                    
+                    # Дальше лимита длины читать нет смысла - ответ все равно будет обрезан
+                    if received > max_chars:
+                        completed = True
+                        break
+        except Exception as stream_error:
+            # В т.ч. StreamInterrupted: соединение с моделью оборвалось посреди ответа
+            print(f"⚠️ Обрыв stream-запроса: {stream_error}")
+            partial = True
+        
+        if not chunks:
+            return None
+        
+        if not completed and not partial:
+            print(f"⚠️ Поток модели {transport.name} закончился без finish_reason, ответ считается неполным")
+            partial = True
+        
+        self._record_prompt_cache(payload["model"], usage)
+        return {"content": "".join(chunks), "usage": usage, "partial": partial}
+
+    async def _hedged_search(
+        self,
+        search_payload: Dict[str, Any],
+        consultant: Callable[[Optional[DeltaCallback]], Awaitable[Optional[Dict[str, Any]]]],
+        on_delta: Optional[DeltaCallback]
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Запрос к поисковой модели с хеджированием консультативной
+        
+        consultant - корутина запроса к консультативной модели (занимает ее слот допуска)
+        
+        Если за hedge_after секунд поисковая модель не ответила (в stream - не прислала
+        первый фрагмент), параллельно запускается консультативная. Клиенту уходят дельты
+        только той модели, что начала отвечать первой; вторая отменяется.
+        
+        Returns:
+            (модель, {"content", "usage", "partial"}) или (None, None), если ответа нет
+        """
+        owner: Optional[str] = None
+        first_delta = asyncio.Event()
+        
+        def gate(model: str) -> Optional[DeltaCallback]:
+            if on_delta is None:
+                return None
+            
+            async def forward(delta: str):
+                nonlocal owner
+                if owner is None:
+                    owner = model
+                    first_delta.set()
+                if owner == model:
+                    await on_delta(delta)
+            return forward
+        
+        tasks: Dict[asyncio.Task, str] = {
+            asyncio.create_task(self._complete(self.transport_search, search_payload, gate(self.model_search))): self.model_search
+        }
+        watcher = asyncio.create_task(first_delta.wait())
+        try:
+            done, _ = await asyncio.wait([*tasks, watcher], timeout=self.hedge_after, return_when=asyncio.FIRST_COMPLETED)
+            if not done and self.transport_consultant.available():
+                print(f"⏱️ Поисковая модель молчит {self.hedge_after:g}с, параллельно запускаем консультативную")
+                self.hedge_stats["started"] += 1
+                tasks[asyncio.create_task(
+                    consultant(gate(self.model_consultant))
+                )] = self.model_consultant
+            
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model = tasks[task]
+                    result = task.result()
+                    if result and owner in (None, model):
+                        if model == self.model_consultant and len(tasks) > 1:
+                            self.hedge_stats["won_by_consultant"] += 1
+                        return model, result
+                # Поток уже идет от одной модели - ответ другой не нужен
+                if owner is not None:
+                    pending = {task for task in pending if tasks[task] == owner}
+            return None, None
+        finally:
+            watcher.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(watcher, *tasks, return_exceptions=True)
+    async def generate_response(self, user_message: str, conversation_history: List[Dict] = None, use_web_search: bool = True, on_delta: Optional[DeltaCallback] = None) -> str:
         """
         Генерирует ответ ИИ на сообщение пользователя
         
@@ -158,168 +445,186 @@ class OpenRouterAI:
             user_message: Сообщение пользователя
             conversation_history: История разговора
             use_web_search: Использовать ли веб-поиск
+            on_delta: Корутина для потоковой передачи фрагментов ответа (режим stream)
             
         Returns:
             Ответ ИИ
         """
+        completion = await self._generate_completion(user_message, conversation_history, use_web_search, on_delta)
+        return completion["content"]
+
+    async def _generate_completion(
+        self,
+        user_message: str,
+        conversation_history: List[Dict] = None,
+        use_web_search: bool = True,
+        on_delta: Optional[DeltaCallback] = None,
+        session_id: Optional[str] = None,
+        admitted_lane: str = "consultant"
+    ) -> Dict[str, Any]:
+        """
+        Генерирует ответ ИИ и возвращает его вместе с метаданными запроса
+        
+        admitted_lane - слот какой модели уже занят вызывающим кодом: если поисковой,
+        обращения к консультативной модели (хеджирование, запасной ответ) занимают ее слот отдельно
+        
+        Returns:
+            {"content", "model", "usage", "fallback", "partial", "prompt_chars", "prompt_messages"} -
+            fallback=True, если ответ взят из get_fallback_response (API недоступно),
+            partial=True, если поток модели оборвался ошибкой и ответ может быть неполным
+        """
+        # Потоковый режим используется только если его запросили и он не отключен в окружении
+        stream_to = on_delta if self.streaming_enabled else None
+        
+        def completion(content: str, model: Optional[str], usage: Optional[Dict[str, Any]] = None, fallback: bool = False, payload: Optional[Dict[str, Any]] = None, partial: bool = False) -> Dict[str, Any]:
+            # Размер отправленного промпта - для калибровки оценки токенов по usage
+            sent = payload["messages"] if payload else []
+            return {
+                "content": content, "model": model, "usage": usage or {}, "fallback": fallback, "partial": partial,
+                "prompt_chars": sum(_content_length(message) for message in sent), "prompt_messages": len(sent)
+            }
+        
+        async def consultant(deltas: Optional[DeltaCallback]) -> Optional[Dict[str, Any]]:
+            if admitted_lane == "consultant":
+                return await self._complete(self.transport_consultant, consultant_payload, deltas)
+            # Внешний слот - поисковой модели: консультативная ждет свой. Отдельный ключ сессии,
+            # чтобы лимит запросов сессии не ждал освобождения внешнего слота той же сессии
+            try:
+                async with ai_admission.slot("consultant", f"{session_id}:nested" if session_id else None):
+                    return await self._complete(self.transport_consultant, consultant_payload, deltas)
+            except AdmissionRejected as rejected:
+                print(f"🚦 Консультативная модель не допущена: {rejected.reason}")
+                return None
+        
         try:
             # Определяем, нужен ли веб-поиск для критической информации
             needs_web_search = use_web_search and self.should_use_web_search(user_message)
             
-            # Формируем сообщения для API
-            messages = [
-                {"role": "system", "content": self.get_system_prompt()}
-            ]
-            
-            # Добавляем историю разговора если есть
-            if conversation_history:
-                messages.extend(conversation_history[-10:])  # Последние 10 сообщений
+            # Формируем сообщения для API: история укладывается в бюджет токенов,
+            # более ранние реплики заменяет краткое содержание разговора
+            messages = await context_builder.build(
+                session_id, self.get_system_prompt(), conversation_history, user_message, summarizer=self.summarize_history
+            )
             
-            # Добавляем текущее сообщение пользователя
-            messages.append({"role": "user", "content": user_message})
+            # Консультативная модель: оригинальные сообщения без инструкций для веб-поиска
+            consultant_payload = {
+                "model": self.model_consultant,
+                "messages": self._with_prompt_cache(self.model_consultant, messages),
+                "max_tokens": 1000,  # Ограничиваем токены для краткости ответов
+                "temperature": 0.7,
+                "stream": False,
+                "usage": {"include": True}  # Стоимость запроса в ответе OpenRouter
+            }
             
             # Пробуем сначала поисковую модель, если нужно
-            if needs_web_search:
-                try:
-                    model = self.model_search
-                    client = self.client_search
-                    print(f"🔍 Используется поисковая модель: {model}")
-                    
-                    # Ограничиваем токены для краткости ответов
-                    max_tokens = 1500
-                    
-                    payload = {
-                        "model": model,
-                        "messages": messages.copy(),  # Копируем сообщения
-                        "max_tokens": max_tokens,
-                        "temperature": 0.7,
-                        "stream": False
-                    }
-                    
-                    # Модифицируем запрос для активации веб-поиска
-                    original_message = payload["messages"][-1]["content"]
-                    enhanced_message = f"{original_message}\n\n🔍 **ИНСТРУКЦИИ ДЛЯ ВЕБ-ПОИСКА:**\n\n❌ **СТРОГО ЗАПРЕЩЕНО:**\n• Более 5 результатов\n• Повторяющиеся организации\n• Упоминать конкурентские таксопарки\n• Длинные списки\n\n✅ **ОБЯЗАТЕЛЬНО:**\n• Только 5 лучших мест\n• Краткая информация: название, адрес, телефон\n• В конце предложить ILPO-TAXI\n• Максимум 1500 токенов\n\n📋 **ФОРМАТ ОТВЕТА:**\n```\nПривет! Вот 5 лучших мест для получения медкнижки в (городе):\n\n1. [Название] - [адрес], тел: [телефон]\n2. [Название] - [адрес], тел: [телефон]\n3. [Название] - [адрес], тел: [телефон]\n4. [Название] - [адрес], тел: [телефон]\n5. [Название] - [адрес], тел: [телефон]\n\n**Для работы в ILPO-TAXI звоните:** +7 996 807-37-43\n```"
-                    payload["messages"][-1]["content"] = enhanced_message
-                    print(f"🔍 Включен веб-поиск для запроса: {user_message[:500]}...")
-                    
-                    # Отправляем запрос к поисковой модели
-                    response = await client.post(
-                        f"{self.base_url}/chat/completions",
-                        json=payload
+            if needs_web_search and not self.transport_search.available():
+                print(f"⛔ Поисковая модель {self.model_search} временно отключена, отвечает консультативная")
+            elif needs_web_search:
+                print(f"🔍 Используется поисковая модель: {self.model_search}")
+                
+                search_payload = {
+                    "model": self.model_search,
+                    "messages": self._with_prompt_cache(self.model_search, [dict(message) for message in messages]),  # Копируем сообщения
+                    "max_tokens": 1500,
+                    "temperature": 0.7,
+                    "stream": False,
+                    "usage": {"include": True}
+                }
+                
+                # Модифицируем запрос для активации веб-поиска
+                original_message = search_payload["messages"][-1]["content"]
+                enhanced_message = f"{original_message}\n\n🔍 **ИНСТРУКЦИИ ДЛЯ ВЕБ-ПОИСКА:**\n\n❌ **СТРОГО ЗАПРЕЩЕНО:**\n• Более 5 результатов\n• Повторяющиеся организации\n• Упоминать конкурентские таксопарки\n• Длинные списки\n\n✅ **ОБЯЗАТЕЛЬНО:**\n• Только 5 лучших мест\n• Краткая информация: название, адрес, телефон\n• В конце предложить ILPO-TAXI\n• Максимум 1500 токенов\n\n📋 **ФОРМАТ ОТВЕТА:**\n```\nПривет! Вот 5 лучших мест для получения медкнижки в (городе):\n\n1. [Название] - [адрес], тел: [телефон]\n2. [Название] - [адрес], тел: [телефон]\n3. [Название] - [адрес], тел: [телефон]\n4. [Название] - [адрес], тел: [телефон]\n5. [Название] - [адрес], тел: [телефон]\n\n**Для работы в ILPO-TAXI звоните:** +7 996 807-37-43\n```"
+                search_payload["messages"][-1]["content"] = enhanced_message
+                print(f"🔍 Включен веб-поиск для запроса: {user_message[:500]}...")
+                
+                if self.hedge_after > 0:
+                    model, result = await self._hedged_search(search_payload, consultant, stream_to)
+                else:
+                    model, result = self.model_search, await self._complete(self.transport_search, search_payload, stream_to)
+                
+                if result:
+                    ai_response = self._truncate_response(result["content"])
+                    print(f"✅ Модель {model} успешно ответила: {len(ai_response)} символов")
+                    return completion(
+                        ai_response, model, result["usage"], payload=search_payload if model == self.model_search else consultant_payload,
+                        partial=result["partial"]
                     )
-                    
-                    # Если поисковая модель успешно ответила
-                    if response.status_code == 200:
-                        result = response.json()
-                        ai_response = result["choices"][0]["message"]["content"]
-                        
-                        # Дополнительная проверка длины ответа
-                        max_chars = 8000  # Примерно 1500-2000 токенов
-                        if len(ai_response) > max_chars:
-                            # Обрезаем ответ и добавляем примечание
-                            ai_response = ai_response[:max_chars].rsplit(' ', 1)[0] + "...\n\n💬 [Ответ сокращен для краткости. Задайте уточняющий вопрос для получения дополнительной информации.]"
-                            print(f"✂️ Ответ обрезан до {len(ai_response)} символов")
-                        
-                        print(f"✅ Поисковая модель успешно ответила: {len(ai_response)} символов")
-                        return ai_response
-                    
-                    # Если получили ошибку от поисковой модели
-                    else:
-                        print(f"⚠️ Ошибка поисковой модели: {response.status_code} - {response.text}")
-                        print("🔄 Переключаемся на консультативную модель...")
-                        # Продолжаем выполнение с консультативной моделью
-                        needs_web_search = False
                 
-                except Exception as search_error:
-                    print(f"⚠️ Ошибка при использовании поисковой модели: {search_error}")
-                    print("🔄 Переключаемся на консультативную модель...")
-                    # Продолжаем выполнение с консультативной моделью
-                    needs_web_search = False
+                print("🔄 Поисковая модель не ответила, переключаемся на консультативную модель...")
             
             # Используем консультативную модель (если поиск не нужен или поисковая модель недоступна)
-            model = self.model_consultant
-            client = self.client_consultant
-            print(f"💬 Используется консультативная модель: {model}")
-            
-            # Ограничиваем токены для краткости ответов
-            max_tokens = 1000
-            
-            payload = {
-                "model": model,
-                "messages": messages,  # Используем оригинальные сообщения без инструкций для веб-поиска
-                "max_tokens": max_tokens,
-                "temperature": 0.7,
-                "stream": False
-            }
-            
-            # Отправляем запрос к консультативной модели
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                json=payload
-            )
+            print(f"💬 Используется консультативная модель: {self.model_consultant}")
+            result = await consultant(stream_to)
             
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result["choices"][0]["message"]["content"]
-                
-                # Дополнительная проверка длины ответа
-                max_chars = 8000  # Примерно 1500-2000 токенов
-                if len(ai_response) > max_chars:
-                    # Обрезаем ответ и добавляем примечание
-                    ai_response = ai_response[:max_chars].rsplit(' ', 1)[0] + "...\n\n💬 [Ответ сокращен для краткости. Задайте уточняющий вопрос для получения дополнительной информации.]"
-                    print(f"✂️ Ответ обрезан до {len(ai_response)} символов")
-                
+            if result:
+                ai_response = self._truncate_response(result["content"])
                 print(f"✅ OpenRouter API успешно: {len(ai_response)} символов")
-                print(f"📝 Полный ответ ИИ:\n{ai_response}") # Полный вывод без обрезания
-                return ai_response
-            else:
-                print(f"❌ Ошибка OpenRouter API: {response.status_code} - {response.text}")
-                return self.get_fallback_response(user_message)
+                return completion(ai_response, self.model_consultant, result["usage"], payload=consultant_payload, partial=result["partial"])
+            
+            print("❌ Консультативная модель не ответила")
+            return completion(self.get_fallback_response(user_message), None, fallback=True)
                 
         except Exception as e:
             print(f"❌ Исключение в OpenRouter AI: {e}")
-            return self.get_fallback_response(user_message)
+            return completion(self.get_fallback_response(user_message), None, fallback=True)
     
-    def get_fallback_response(self, user_message: str) -> str:
-        """Резервные ответы когда API недоступен"""
-        
-        user_message_lower = user_message.lower()
-        
-        # Интеллектуальные резервные ответы только про ILPO-TAXI
-        if any(word in user_message_lower for word in ['привет', 'здравствуй', 'добро']):
-            return "Привет! 👋 Я ИИ-консультант ILPO-TAXI. Помогу подключиться к Яндекс.Такси или Доставке через наш таксопарк. Что вас интересует - работа водителем, курьером или и то и другое?"
-        
-        elif any(word in user_message_lower for word in ['документы', 'нужно', 'требования']):
-            return "📋 Для водителей нужны: паспорт, права, СТС, диагностическая карта. Для курьеров: паспорт, справка о несудимости. Подключение к ILPO-TAXI за 24 часа!"
-        
-        elif any(word in user_message_lower for word in ['заработок', 'деньги', 'зарплата', 'доход']):
-            return "💰 С ILPO-TAXI водители зарабатывают 80-120 тысяч, курьеры 50-80 тысяч рублей в месяц. Наша комиссия всего 1,5-7% - одна из самых низких в России!"
-        
-        elif any(word in user_message_lower for word in ['подключ', 'регистр', 'оформ']):
-            return "🚀 Подключение к ILPO-TAXI очень быстрое! Водители - 24 часа, курьеры - 2-4 часа. Заполните заявку по ссылке <a href='/signup'>/signup</a> или свяжитесь с менеджером <a href='tel:+79273748151'>+7 (927) 374-81-51</a>!"
-        
-        elif any(word in user_message_lower for word in ['машина', 'авто', 'аренда']):
-            return "🚗 Можете работать на своем авто или взять в аренду через ILPO-TAXI от 1200₽/сутки (для Пензы). У нас большой автопарк с лицензией такси!"
+    async def summarize_history(self, summary: Optional[str], messages: List[Dict[str, Any]], session_id: Optional[str] = None) -> Optional[str]:
+        """
+        Свернуть реплики в краткое содержание разговора консультативной моделью
         
-        elif any(word in user_message_lower for word in ['график', 'время', 'смена']):
-            return "⏰ С ILPO-TAXI график работы свободный! Работайте когда удобно. Многие выбирают 8-12 часов в день, 5-6 дней в неделю."
+        Args:
+            summary: Прежнее краткое содержание
+            messages: Реплики, не поместившиеся в бюджет истории
+            session_id: Сессия (для очереди к модели и учета токенов)
+            
+        Returns:
+            Новое краткое содержание или None, если модель недоступна
+        """
+        transcript = "\n".join(
+            f"{'Пользователь' if message['role'] == 'user' else 'Консультант'}: {message['content'][:1500]}"
+            for message in messages
+        )
+        request = f"Прежнее краткое содержание:\n{summary}\n\n" if summary else ""
+        payload = {
+            "model": self.model_consultant,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"{request}Новые реплики:\n{transcript}"}
+            ],
+            "max_tokens": context_builder.summary_max_tokens,
+            "temperature": 0.2,
+            "stream": False,
+            "usage": {"include": True}
+        }
         
-        elif any(word in user_message_lower for word in ['курьер', 'доставка', 'еда']):
-            return "🛵 Отличный выбор! Курьеры с ILPO-TAXI зарабатывают 50-80 тысяч в месяц. Подключение за 2-4 часа, можно работать пешком, на велосипеде или авто!"
+        try:
+            async with ai_admission.slot("consultant", session_id):
+                result = await self._complete(self.transport_consultant, payload)
+        except AdmissionRejected:
+            return None
         
-        elif any(word in user_message_lower for word in ['груз', 'грузовик', 'фура', 'камаз']):
-            return "🚛 Грузовые перевозки с ILPO-TAXI - это высокий заработок 100-150 тысяч в месяц! Работайте с любым типом груза и грузоподъемностью. Заполните заявку по ссылке <a href='/signup'>/signup</a>!"
+        if not result or not result["content"].strip():
+            return None
         
-        else:
-            return "🤖 Сейчас у меня технические неполадки, но я все равно помогу! Спрашивайте о документах, заработке, условиях работы или подключении к ILPO-TAXI. Что интересует больше всего?"
+        await context_builder.record_usage(
+            session_id, result["usage"], sum(len(message["content"]) for message in payload["messages"]), len(payload["messages"])
+        )
+        return result["content"].strip()
+    
+    def get_fallback_response(self, user_message: str) -> str:
+        """Резервные ответы когда API недоступен"""
+        # Интеллектуальные резервные ответы только про ILPO-TAXI
+        return FALLBACK_RESPONSES[classify(user_message).fallback_bucket]
 
-    async def get_smart_response(self, user_message: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def get_smart_response(self, user_message: str, context: Dict[str, Any] = None, on_delta: Optional[DeltaCallback] = None, on_queue: Optional[QueueCallback] = None) -> Dict[str, Any]:
         """
         Получить умный ответ с дополнительной информацией
         
         Args:
             user_message: Сообщение пользователя
             context: Дополнительный контекст (user_id, session_id и т.д.)
+            on_delta: Корутина для потоковой передачи фрагментов ответа
+            on_queue: Корутина для уведомления о позиции в очереди к модели
             
         Returns:
             Словарь с ответом и метаданными
@@ -327,20 +632,61 @@ class OpenRouterAI:
         
         start_time = datetime.now()
         
-        # Определяем, нужен ли веб-поиск
-        needs_web_search = self.should_use_web_search(user_message)
+        # Интент и необходимость веб-поиска - за один проход классификатора
+        classification = classify(user_message)
+        needs_web_search = classification.needs_web_search
+        intent = classification.intent
         
-        # Получаем ответ от ИИ
         conversation_history = context.get('conversation_history', []) if context else []
-        ai_response = await self.generate_response(user_message, conversation_history, use_web_search=needs_web_search)
+        
+        # Типовые вопросы отдаем из кэша; запросы, требующие свежих данных (веб-поиск), не кэшируются
+        cache_key = None
+        if not needs_web_search:
+            cache_key = response_cache.make_key(user_message, intent, self.model_consultant, self.system_prompt_hash, conversation_history)
+            cached = await response_cache.get(cache_key)
+            if cached:
+                processing_time = (datetime.now() - start_time).total_seconds()
+                print(f"⚡ Ответ из кэша: {intent} за {processing_time:.3f}с")
+                return {
+                    "content": cached["content"],
+                    "intent": intent,
+                    "processing_time": processing_time,
+                    "timestamp": datetime.now().isoformat(),
+                    "model": cached.get("model"),
+                    "web_search_used": False,
+                    "cached": True,
+                    "context": context or {}
+                }
+        else:
+            response_cache.record_bypass()
+        
+        # Получаем ответ от ИИ: запрос ждет слот модели в общей очереди процесса
+        lane = "search" if needs_web_search and self.transport_search.available() else "consultant"
+        queue_wait = 0.0
+        try:
+            async with ai_admission.slot(lane, (context or {}).get("session_id"), on_queue) as queue_wait:
+                completion = await self._generate_completion(
+                    user_message, conversation_history, use_web_search=needs_web_search, on_delta=on_delta,
+                    session_id=(context or {}).get("session_id"), admitted_lane=lane
+                )
+        except AdmissionRejected as rejected:
+            print(f"🚦 Запрос не допущен к модели ({lane}): {rejected.reason}, отдаем резервный ответ")
+            completion = {"content": self.get_fallback_response(user_message), "model": None, "usage": {}, "fallback": True, "partial": False}
+        ai_response = completion["content"]
+        
+        # Учет токенов сессии по usage ответа OpenRouter
+        await context_builder.record_usage(
+            (context or {}).get("session_id"), completion["usage"], completion.get("prompt_chars", 0), completion.get("prompt_messages", 0)
+        )
         
         processing_time = (datetime.now() - start_time).total_seconds()
         
-        # Определяем интент пользователя
-        intent = self.detect_intent(user_message)
+        # Запасные ответы (API недоступно) и оборванные ошибкой ответы в кэш не попадают
+        if cache_key and not completion["fallback"] and not completion["partial"]:
+            await response_cache.set(cache_key, ai_response, completion["model"], processing_time, completion["usage"])
         
         # Определяем использованную модель
-        used_model = self.model_search if needs_web_search else self.model_consultant
+        used_model = completion["model"] or (self.model_search if needs_web_search else self.model_consultant)
         
         # Формируем результат
         result = {
@@ -349,7 +695,10 @@ class OpenRouterAI:
             "processing_time": processing_time,
             "timestamp": datetime.now().isoformat(),
             "model": used_model,
-            "web_search_used": needs_web_search,
+            # При хеджировании ответ может дать консультативная модель
+            "web_search_used": needs_web_search and used_model == self.model_search,
+            "cached": False,
+            "queue_wait": round(queue_wait, 3),
             "context": context or {}
         }
         
@@ -359,56 +708,11 @@ class OpenRouterAI:
     
     def should_use_web_search(self, message: str) -> bool:
         """Определяет, нужно ли использовать веб-поиск для ответа"""
-        
-        message_lower = message.lower()
-        
-        # Ключевые слова, указывающие на необходимость актуальной информации
-        web_search_indicators = [
-            # Географические запросы
-            "где", "адрес", "находится", "местонахождение", "как добраться",
-            # Медицинские услуги и документы
-            "медкнижка", "медкнижку", "медицинская книжка", "справка", "медицинская справка", "Медсправка", "анализы",
-            "поликлиника", "больница", "медцентр", "клиника",
-            # Административные услуги  
-            "мфц", "госуслуги", "паспорт", "справка о несудимости",
-            # Разрешения
-            "Лицензия", "Лицензию", "Разрешение", "Разрешения",
-            # Актуальная информация
-            "сейчас", "сегодня", "текущий", "последний", "новый", "цена", "стоимость",
-            # Время и расписание
-            "расписание", "часы работы", "время работы", "график",
-            # Контакты и телефоны
-            "телефон", "номер", "контакт", "связаться",
-            # Конкретные города и районы
-            "пенза", "пензе", "Москва", "Москве", "Санкт-Петербург", "Санкт-Петербурга", "Питер", "Питере", "район", "городе", "области"
-        ]
-        
-        return any(indicator in message_lower for indicator in web_search_indicators)
+        return classify(message).needs_web_search
     
     def detect_intent(self, message: str) -> str:
         """Определение намерения пользователя"""
-        
-        message_lower = message.lower()
-        
-        intent_keywords = {
-            "greeting": ["привет", "здравствуй", "добро", "хай", "hey"],
-            "documents": ["документы", "справки", "нужно", "требования", "паспорт", "права"],
-            "earnings": ["заработок", "деньги", "зарплата", "доход", "сколько", "платят"],
-            "connection": ["подключ", "регистр", "оформ", "заявка", "начать"],
-            "car_rental": ["машина", "авто", "аренда", "автопарк", "тачка"],
-            "schedule": ["график", "время", "смена", "работать", "часы"],
-            "courier": ["курьер", "доставка", "еда", "пешком", "велосипед"],
-            "taxi": ["водитель", "такси", "машина", "поездка"],
-            "commission": ["комиссия", "процент", "забирает", "остается"],
-            "support": ["помощь", "поддержка", "вопрос", "проблема"],
-            "web_search": ["где", "адрес", "медкнижка", "поликлиника", "мфц", "телефон"]
-        }
-        
-        for intent, keywords in intent_keywords.items():
-            if any(keyword in message_lower for keyword in keywords):
-                return intent
-        
-        return "general"
+        return classify(message).intent
 
     # def limit_search_results(self, text: str) -> str:
     #     """
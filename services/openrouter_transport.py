@@ -0,0 +1,302 @@
+"""
+HTTP-транспорт OpenRouter для одной модели
+Пул keep-alive соединений (HTTP/2, если установлен пакет h2), раздельные таймауты
+подключения и чтения, повторы 429/5xx с экспоненциальной задержкой и джиттером,
+автоматический выключатель (circuit breaker), который временно пропускает отказавшую модель
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - httpx включает HTTP/2 только при установленном h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Статусы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Ошибки до отправки запроса - повтор безопасен и быстр; таймаут чтения не повторяем,
+# чтобы медленная модель не стоила пользователю несколько полных таймаутов
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+class StreamInterrupted(Exception):
+    """Поток ответа оборвался после получения первых строк - ответ неполный"""
+
+
+class CircuitBreaker:
+    """
+    Выключатель модели
+
+    closed - запросы идут; после failure_threshold ошибок подряд - open, запросы сразу
+    отклоняются; через cooldown секунд - half_open, пропускается один пробный запрос,
+    его успех закрывает выключатель, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Запрос отменен без результата (например, проиграл хеджированию)"""
+        self._probe_in_flight = False
+
+
+class OpenRouterTransport:
+    """HTTP-клиент и выключатель одной модели OpenRouter"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        headers: Dict[str, str],
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        max_connections: int = 50,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0
+    ):
+        self.name = name
+        self.url = f"{base_url}/chat/completions"
+        self.max_retries = max_retries
+        self.backoff_base = 0.5
+        self.backoff_cap = 4.0
+
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers=headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60.0
+            )
+        )
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+
+    @classmethod
+    def from_env(cls, name: str, env_prefix: str, base_url: str, headers: Dict[str, str], read_timeout: float) -> "OpenRouterTransport":
+        """Параметры из окружения: OPENROUTER_<PREFIX>_CONNECT_TIMEOUT, _READ_TIMEOUT, _MAX_RETRIES и т.д."""
+        def env(key: str, default: Any) -> str:
+            return os.getenv(f"OPENROUTER_{env_prefix}_{key}", str(default))
+
+        return cls(
+            name,
+            base_url,
+            headers,
+            connect_timeout=float(env("CONNECT_TIMEOUT", 5.0)),
+            read_timeout=float(env("READ_TIMEOUT", read_timeout)),
+            max_retries=int(env("MAX_RETRIES", 2)),
+            max_connections=int(env("MAX_CONNECTIONS", 50)),
+            failure_threshold=int(env("BREAKER_THRESHOLD", 5)),
+            cooldown=float(env("BREAKER_COOLDOWN", 30.0))
+        )
+
+    def available(self) -> bool:
+        """Выключатель не открыт (проверка без занятия пробного запроса)"""
+        return self.breaker.state != "open"
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Экспоненциальная задержка с полным джиттером; Retry-After провайдера соблюдается, но не дольше 10с"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), 10.0))
+            except ValueError:
+                pass
+        return delay
+
+    def _reject(self) -> None:
+        self.stats["short_circuited"] += 1
+        print(f"⛔ Модель {self.name} временно отключена после ошибок (до {self.breaker.cooldown:.0f}с)")
+
+    def _fail(self, error: str) -> None:
+        self.stats["failures"] += 1
+        self.breaker.record_failure()
+        print(f"⚠️ Ошибка модели {self.name}: {error}")
+
+    @staticmethod
+    def _stream_error(line: str) -> Optional[str]:
+        """Текст ошибки, если строка SSE - событие ошибки провайдера посреди потока"""
+        if not line.startswith("data:") or '"error"' not in line:
+            return None
+        try:
+            event = json.loads(line[5:].strip())
+        except json.JSONDecodeError:
+            return None
+        error = event.get("error") if isinstance(event, dict) else None
+        return str(error) if error else None
+
+    async def post(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        POST /chat/completions с повторами
+
+        Returns:
+            JSON ответа или None (ошибка, исчерпаны повторы или модель отключена выключателем)
+        """
+        if not self.breaker.allow():
+            self._reject()
+            return None
+
+        self.stats["requests"] += 1
+        finished = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                retry_after = None
+                try:
+                    response = await self.client.post(self.url, json=payload)
+                except RETRY_EXCEPTIONS as e:
+                    error = f"{type(e).__name__}: {e}"
+                except httpx.HTTPError as e:
+                    finished = True
+                    self._fail(f"{type(e).__name__}: {e}")
+                    return None
+                else:
+                    if response.status_code == 200:
+                        finished = True
+                        self.breaker.record_success()
+                        return response.json()
+
+                    error = f"{response.status_code} - {response.text[:300]}"
+                    if response.status_code not in RETRY_STATUSES:
+                        # Ошибка запроса, а не провайдера - выключатель не трогаем
+                        finished = True
+                        self.breaker.record_success()
+                        print(f"⚠️ Модель {self.name} отклонила запрос: {error}")
+                        return None
+                    retry_after = response.headers.get("retry-after")
+
+                if attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self._backoff(attempt, retry_after))
+
+            finished = True
+            self._fail(error)
+            return None
+        finally:
+            if not finished:
+                self.breaker.release()
+
+    async def stream_lines(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Строки SSE-ответа; повторы выполняются только до получения первой строки
+
+        Генератор закрывают через contextlib.aclosing: прерванное чтение не считается ошибкой.
+        Событие ошибки в потоке считается отказом модели и завершает поток после передачи строки.
+
+        Raises:
+            StreamInterrupted: Соединение оборвалось после первой строки (ответ неполный)
+        """
+        if not self.breaker.allow():
+            self._reject()
+            return
+
+        self.stats["requests"] += 1
+        finished = False
+        received = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                retry_after = None
+                try:
+                    async with self.client.stream("POST", self.url, json=payload) as response:
+                        if response.status_code == 200:
+                            async for line in response.aiter_lines():
+                                received = True
+                                stream_error = self._stream_error(line)
+                                if stream_error:
+                                    finished = True
+                                    self._fail(f"ошибка в потоке: {stream_error[:300]}")
+                                    yield line
+                                    return
+                                yield line
+                            finished = True
+                            self.breaker.record_success()
+                            return
+
+                        body = (await response.aread()).decode("utf-8", "ignore")
+                        error = f"{response.status_code} - {body[:300]}"
+                        if response.status_code not in RETRY_STATUSES:
+                            finished = True
+                            self.breaker.record_success()
+                            print(f"⚠️ Модель {self.name} отклонила stream-запрос: {error}")
+                            return
+                        retry_after = response.headers.get("retry-after")
+                except RETRY_EXCEPTIONS as e:
+                    if received:
+                        finished = True
+                        self._fail(f"обрыв потока: {e}")
+                        raise StreamInterrupted(f"{type(e).__name__}: {e}") from e
+                    error = f"{type(e).__name__}: {e}"
+                except httpx.HTTPError as e:
+                    finished = True
+                    if received:
+                        self._fail(f"обрыв потока: {e}")
+                        raise StreamInterrupted(f"{type(e).__name__}: {e}") from e
+                    self._fail(f"{type(e).__name__}: {e}")
+                    return
+
+                if attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self._backoff(attempt, retry_after))
+
+            finished = True
+            self._fail(error)
+        finally:
+            if not finished:
+                # Чтение прервано вызывающим кодом (лимит длины, отмена) - модель отвечала
+                if received:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(
+            self.stats,
+            state=self.breaker.state,
+            consecutive_failures=self.breaker.failures,
+            http2=HTTP2_AVAILABLE
+        )
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,187 @@
+"""
+Response Cache - Кэш ответов ИИ-консультанта
+Типовые вопросы (документы, заработок, комиссия, подключение) отдаются без платного запроса к OpenRouter
+"""
+
+import os
+import re
+import time
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# Все, кроме букв, цифр и пробелов, при нормализации удаляется
+_NON_WORD_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: регистр, ё/е, пунктуация, эмодзи, лишние пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _NON_WORD_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """Двухуровневый кэш ответов: LRU в памяти процесса + опционально Redis"""
+
+    def __init__(self):
+        self.enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.ttl = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # секунды
+        self.max_size = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "1000"))
+        # Сколько последних сообщений истории входит в ключ
+        self.history_depth = int(os.getenv("RESPONSE_CACHE_HISTORY_DEPTH", "2"))
+        self.redis_enabled = os.getenv("RESPONSE_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+        self.redis_prefix = "ai_response_cache:"
+
+        # key -> (expires_at, entry)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        # После ошибки Redis не дергаем его какое-то время, чтобы не тормозить каждый ответ
+        self._redis_retry_after = 0.0
+
+        # Статистика
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_latency = 0.0
+        self.saved_cost = 0.0
+        self.saved_tokens = 0
+
+    def make_key(self, user_message: str, intent: str, model: str, prompt_hash: str, history: Optional[List[Dict]] = None) -> str:
+        """Строит ключ из нормализованного текста, интента, модели, хэша промпта и короткой истории"""
+        parts = [normalize_text(user_message), intent or "", model or "", prompt_hash or ""]
+
+        if history and self.history_depth > 0:
+            for message in history[-self.history_depth:]:
+                parts.append(f"{message.get('role', '')}:{normalize_text(message.get('content', ''))}")
+
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить ответ из кэша (сначала память процесса, затем Redis)"""
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        item = self._entries.get(key)
+        if item is not None:
+            expires_at, entry = item
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self._record_hit(entry)
+                return entry
+            del self._entries[key]
+
+        entry = await self._redis_get(key)
+        if entry is not None:
+            self._store_local(key, entry, now)
+            self.redis_hits += 1
+            self._record_hit(entry)
+            return entry
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, content: str, model: Optional[str], processing_time: float, usage: Optional[Dict[str, Any]] = None):
+        """Сохранить ответ в кэш вместе со стоимостью его получения"""
+        if not self.enabled or not content:
+            return
+
+        usage = usage or {}
+        entry = {
+            "content": content,
+            "model": model,
+            "processing_time": processing_time,
+            "cost": float(usage.get("cost") or 0.0),
+            "tokens": int(usage.get("total_tokens") or 0),
+        }
+
+        self._store_local(key, entry, time.monotonic())
+        await self._redis_set(key, entry)
+
+    def record_bypass(self):
+        """Учесть запрос, который намеренно не обслуживается кэшем (веб-поиск)"""
+        self.bypassed += 1
+
+    def clear(self):
+        """Очистить кэш процесса"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша для /api/chat/health"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "redis_enabled": self.redis_enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "saved_latency_seconds": round(self.saved_latency, 3),
+            "saved_cost": round(self.saved_cost, 6),
+            "saved_tokens": self.saved_tokens,
+        }
+
+    def _record_hit(self, entry: Dict[str, Any]):
+        self.hits += 1
+        self.saved_latency += entry.get("processing_time") or 0.0
+        self.saved_cost += entry.get("cost") or 0.0
+        self.saved_tokens += entry.get("tokens") or 0
+
+    def _store_local(self, key: str, entry: Dict[str, Any], now: float):
+        self._entries[key] = (now + self.ttl, entry)
+        self._entries.move_to_end(key)
+
+        # LRU: вытесняем самые давно использованные записи
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _redis_available(self) -> bool:
+        return self.redis_enabled and time.monotonic() >= self._redis_retry_after
+
+    def _redis_failed(self, e: Exception):
+        logger.error(f"❌ Ошибка Redis-кэша ответов: {e}")
+        self._redis_retry_after = time.monotonic() + 60
+
+    async def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self._redis_available():
+            return None
+
+        try:
+            from telegram_bot.services.redis_service import redis_service
+
+            if not redis_service.is_connected:
+                await redis_service.connect()
+
+            value = await redis_service.redis_client.get(self.redis_prefix + key)
+            return json.loads(value) if value else None
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+    async def _redis_set(self, key: str, entry: Dict[str, Any]):
+        if not self._redis_available():
+            return
+
+        try:
+            from telegram_bot.services.redis_service import redis_service
+
+            if not redis_service.is_connected:
+                await redis_service.connect()
+
+            await redis_service.redis_client.setex(self.redis_prefix + key, self.ttl, json.dumps(entry, ensure_ascii=False))
+        except Exception as e:
+            self._redis_failed(e)
+
+# Глобальный экземпляр кэша ответов
+response_cache = ResponseCache()
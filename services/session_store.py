@@ -0,0 +1,601 @@
+"""
+Session Store - Хранилища чат-сессий
+In-memory хранилище для одного процесса и Redis-хранилище, общее для всех воркеров и узлов
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+from collections import deque
+from typing import Dict, List, Optional, Any, Union
+from datetime import datetime
+
+# Сколько последних сообщений отдает get_conversation_history по умолчанию
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "10"))
+
+# Сколько сообщений хранит сессия: реплики, не вошедшие в краткое содержание, не должны
+# вытесняться раньше, чем построитель контекста успеет их свернуть
+SESSION_MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "200"))
+
+# Сессия считается активной, если в ней что-то происходило за последние 5 минут
+ACTIVE_SESSION_WINDOW = 300
+
+
+def _to_epoch(value: Union[str, float, int, None]) -> float:
+    """Приводит ISO-строку или число к epoch-времени"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _to_iso(value: float) -> str:
+    """Epoch-время в ISO-строку (для API и экспорта)"""
+    return datetime.fromtimestamp(value).isoformat()
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # Роли и интенты повторяются в каждом сообщении - храним одну копию строки
+    return sys.intern(value) if value else value
+
+
+class ChatMessage:
+    """Сообщение в чате (компактная запись: __slots__, epoch-время, интернированные role/intent)"""
+
+    __slots__ = ("role", "content", "timestamp", "intent", "processing_time", "message_id")
+
+    def __init__(self, role: str, content: str, timestamp: Union[str, float, None] = None,
+                 message_id: str = None, intent: str = None, processing_time: float = None):
+        self.role = _intern(role)  # "user" или "assistant"
+        self.content = content
+        self.timestamp = _to_epoch(timestamp)
+        self.intent = _intern(intent)
+        self.processing_time = processing_time
+        self.message_id = message_id  # Не генерируется: задается только если пришел извне
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": _to_iso(self.timestamp),
+            "message_id": self.message_id,
+            "intent": self.intent,
+            "processing_time": self.processing_time
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatMessage":
+        return cls(
+            role=data["role"],
+            content=data["content"],
+            timestamp=data.get("timestamp"),
+            message_id=data.get("message_id"),
+            intent=data.get("intent"),
+            processing_time=data.get("processing_time")
+        )
+
+
+class ChatSession:
+    """
+    Сессия чата: кольцевой буфер последних сообщений и счетчики за всю сессию
+
+    Статистика (количество сообщений, среднее время ответа) считается по счетчикам,
+    поэтому хранить всю историю в памяти не нужно.
+    """
+
+    __slots__ = (
+        "session_id", "user_id", "created_at", "last_activity", "messages", "context",
+        "total_messages", "user_messages", "ai_messages", "response_time_sum", "response_time_count",
+        "activity_bucket"
+    )
+
+    def __init__(self, session_id: str, user_id: str = None, created_at: Union[str, float, None] = None,
+                 last_activity: Union[str, float, None] = None, messages: List[ChatMessage] = None,
+                 context: Dict[str, Any] = None, history_window: int = SESSION_MAX_MESSAGES):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.created_at = _to_epoch(created_at)
+        self.last_activity = _to_epoch(last_activity) if last_activity is not None else self.created_at
+        self.messages = deque(maxlen=history_window)
+        self.context = context if context is not None else {}
+        self.total_messages = 0
+        self.user_messages = 0
+        self.ai_messages = 0
+        self.response_time_sum = 0.0
+        self.response_time_count = 0
+        self.activity_bucket = None  # Корзина активности в MemorySessionStore
+
+        for message in messages or ():
+            self.append(message)
+
+    def append(self, message: ChatMessage):
+        """Добавить сообщение с учетом счетчиков"""
+        self.messages.append(message)
+        self.total_messages += 1
+
+        if message.role == "user":
+            self.user_messages += 1
+        elif message.role == "assistant":
+            self.ai_messages += 1
+            if message.processing_time:
+                self.response_time_sum += message.processing_time
+                self.response_time_count += 1
+
+    @property
+    def average_response_time(self) -> float:
+        return self.response_time_sum / self.response_time_count if self.response_time_count else 0.0
+
+    @property
+    def duration_minutes(self) -> float:
+        return (self.last_activity - self.created_at) / 60
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "created_at": _to_iso(self.created_at),
+            "last_activity": _to_iso(self.last_activity),
+            "messages": [message.to_dict() for message in self.messages],
+            "context": self.context
+        }
+
+
+class SessionStore:
+    """Базовый интерфейс хранилища сессий"""
+
+    backend_name = "base"
+
+    async def initialize(self):
+        """Подготовка хранилища (подключения и т.п.)"""
+
+    async def close(self):
+        """Освобождение ресурсов хранилища"""
+
+    async def save_session(self, session: ChatSession):
+        raise NotImplementedError
+
+    async def load_session(self, session_id: str) -> Optional[ChatSession]:
+        raise NotImplementedError
+
+    async def touch(self, session_id: str) -> bool:
+        """Обновить время активности; False если сессии нет"""
+        raise NotImplementedError
+
+    async def append_message(self, session_id: str, message: ChatMessage) -> bool:
+        raise NotImplementedError
+
+    async def get_messages(self, session_id: str, limit: Optional[int]) -> List[ChatMessage]:
+        """Последние limit сообщений сессии (None - все сохраненные)"""
+        raise NotImplementedError
+
+    async def get_context(self, session_id: str) -> Dict[str, Any]:
+        """Контекст сессии без загрузки истории; пустой словарь если сессии нет"""
+        raise NotImplementedError
+
+    async def update_context(self, session_id: str, context_update: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    async def get_session_stats(self, session_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def get_all_sessions_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def cleanup_expired(self, session_timeout: int) -> int:
+        """Удалить устаревшие сессии, вернуть их количество"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Хранение сессий в памяти процесса (один воркер, без переживания рестарта)
+
+    Устаревшие сессии вытесняются по куче сроков истечения (min-heap по last_activity)
+    с ленивым удалением: у каждой сессии одна запись в куче, при извлечении записи
+    продлившейся сессии она возвращается в кучу с актуальным временем.
+    Число активных сессий считается по колесу 10-секундных корзин активности,
+    общие счетчики поддерживаются инкрементально - статистика не требует обхода сессий.
+    """
+
+    backend_name = "memory"
+
+    BUCKET_SECONDS = 10
+
+    def __init__(self, session_timeout: int = 86400):
+        self.session_timeout = session_timeout
+        self.sessions: Dict[str, ChatSession] = {}
+        self._expiry_heap: List[tuple] = []  # (last_activity на момент добавления, session_id)
+        self._activity_buckets: Dict[int, int] = {}  # номер корзины -> число сессий
+        self.total_messages = 0
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.BUCKET_SECONDS)
+
+    def _mark_active(self, session: ChatSession, now: float):
+        """Обновить время активности и перенести сессию в текущую корзину колеса"""
+        session.last_activity = now
+        bucket = self._bucket(now)
+
+        if session.activity_bucket != bucket:
+            self._leave_bucket(session)
+            session.activity_bucket = bucket
+            self._activity_buckets[bucket] = self._activity_buckets.get(bucket, 0) + 1
+
+    def _leave_bucket(self, session: ChatSession):
+        bucket = session.activity_bucket
+        if bucket is None:
+            return
+
+        count = self._activity_buckets.get(bucket, 0) - 1
+        if count > 0:
+            self._activity_buckets[bucket] = count
+        else:
+            self._activity_buckets.pop(bucket, None)
+
+    async def save_session(self, session: ChatSession):
+        self.sessions[session.session_id] = session
+        self.total_messages += session.total_messages
+        self._mark_active(session, time.time())
+        heapq.heappush(self._expiry_heap, (session.last_activity, session.session_id))
+
+    async def load_session(self, session_id: str) -> Optional[ChatSession]:
+        session = self.sessions.get(session_id)
+
+        if session:
+            # Обновляем время последней активности
+            self._mark_active(session, time.time())
+
+        return session
+
+    async def touch(self, session_id: str) -> bool:
+        return await self.load_session(session_id) is not None
+
+    async def append_message(self, session_id: str, message: ChatMessage) -> bool:
+        session = self.sessions.get(session_id)
+
+        if not session:
+            return False
+
+        session.append(message)
+        self.total_messages += 1
+        self._mark_active(session, time.time())
+        return True
+
+    async def get_messages(self, session_id: str, limit: Optional[int]) -> List[ChatMessage]:
+        session = await self.load_session(session_id)
+
+        if not session:
+            return []
+
+        if limit is None or limit >= len(session.messages):
+            return list(session.messages)
+
+        return list(session.messages)[-limit:]
+
+    async def get_context(self, session_id: str) -> Dict[str, Any]:
+        session = await self.load_session(session_id)
+        return dict(session.context) if session else {}
+
+    async def update_context(self, session_id: str, context_update: Dict[str, Any]) -> bool:
+        session = await self.load_session(session_id)
+
+        if not session:
+            return False
+
+        session.context.update(context_update)
+        return True
+
+    async def get_session_stats(self, session_id: str) -> Dict[str, Any]:
+        session = await self.load_session(session_id)
+
+        if not session:
+            return {}
+
+        return {
+            "session_id": session_id,
+            "user_id": session.user_id,
+            "created_at": _to_iso(session.created_at),
+            "last_activity": _to_iso(session.last_activity),
+            "total_messages": session.total_messages,
+            "user_messages": session.user_messages,
+            "ai_messages": session.ai_messages,
+            "average_response_time": session.average_response_time,
+            "session_duration": session.duration_minutes,
+            "context": session.context
+        }
+
+    async def get_all_sessions_stats(self) -> Dict[str, Any]:
+        total_sessions = len(self.sessions)
+        total_messages = self.total_messages
+
+        # Активные - сессии из корзин за последние ACTIVE_SESSION_WINDOW секунд (фиксированное число корзин)
+        current_bucket = self._bucket(time.time())
+        window = ACTIVE_SESSION_WINDOW // self.BUCKET_SECONDS
+        active_sessions = sum(
+            self._activity_buckets.get(bucket, 0)
+            for bucket in range(current_bucket - window + 1, current_bucket + 1)
+        )
+
+        return {
+            "total_sessions": total_sessions,
+            "active_sessions": active_sessions,
+            "total_messages": total_messages,
+            "average_messages_per_session": total_messages / total_sessions if total_sessions > 0 else 0
+        }
+
+    async def cleanup_expired(self, session_timeout: int) -> int:
+        """Вытеснить истекшие сессии; стоимость O(log n) на каждую извлеченную запись кучи"""
+        deadline = time.time() - session_timeout
+        removed = 0
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= deadline:
+            _, session_id = heapq.heappop(self._expiry_heap)
+            session = self.sessions.get(session_id)
+
+            if session is None:
+                continue
+
+            if session.last_activity > deadline:
+                # Сессия была активна после постановки в кучу - переносим на актуальный срок
+                heapq.heappush(self._expiry_heap, (session.last_activity, session_id))
+                continue
+
+            # Удаляем устаревшую сессию
+            del self.sessions[session_id]
+            self._leave_bucket(session)
+            self.total_messages -= session.total_messages
+            removed += 1
+
+        return removed
+
+
+# Атомарное добавление сообщения: проверка существования, ограниченный список,
+# счетчики в хэше, продление TTL и обновление индекса активности за один запрос
+_APPEND_MESSAGE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[3])
+redis.call('HINCRBY', KEYS[1], 'total_messages', 1)
+if ARGV[4] ~= '' then
+    redis.call('HINCRBY', KEYS[1], ARGV[4], 1)
+end
+if ARGV[5] ~= '' then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'response_time_sum', ARGV[5])
+    redis.call('HINCRBY', KEYS[1], 'response_time_count', 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('ZADD', KEYS[3], ARGV[7], ARGV[8])
+redis.call('INCR', KEYS[4])
+return 1
+"""
+
+# Обновление активности существующей сессии с продлением TTL
+_TOUCH_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Хранение сессий в Redis - общее для всех воркеров uvicorn/gunicorn и узлов
+
+    chat_session:{id}           HASH  - метаданные (время - epoch), контекст (JSON) и счетчики
+    chat_session:{id}:messages  LIST  - последние max_messages сообщений (JSON)
+    chat_sessions:activity      ZSET  - session_id -> время последней активности
+    chat_sessions:total_messages      - счетчик сообщений за все время
+
+    Устаревание обеспечивает TTL ключей (скользящий, продлевается при активности),
+    поэтому периодический полный обход сессий не нужен.
+    """
+
+    backend_name = "redis"
+
+    ACTIVITY_INDEX = "chat_sessions:activity"
+    TOTAL_MESSAGES = "chat_sessions:total_messages"
+
+    def __init__(self, session_timeout: int, max_messages: int = SESSION_MAX_MESSAGES):
+        self.session_timeout = session_timeout
+        self.max_messages = max_messages
+        self._append_script = None
+        self._touch_script = None
+
+    def _session_key(self, session_id: str) -> str:
+        return f"chat_session:{session_id}"
+
+    def _messages_key(self, session_id: str) -> str:
+        return f"chat_session:{session_id}:messages"
+
+    async def _client(self):
+        from telegram_bot.services.redis_service import redis_service
+
+        if not redis_service.is_connected:
+            await redis_service.connect()
+
+        return redis_service.redis_client
+
+    async def initialize(self):
+        client = await self._client()
+        self._append_script = client.register_script(_APPEND_MESSAGE_LUA)
+        self._touch_script = client.register_script(_TOUCH_LUA)
+
+    async def save_session(self, session: ChatSession):
+        client = await self._client()
+        session_key = self._session_key(session.session_id)
+
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.hset(session_key, mapping={
+                "session_id": session.session_id,
+                "user_id": session.user_id or "",
+                "created_at": session.created_at,
+                "last_activity": session.last_activity,
+                "context": json.dumps(session.context, ensure_ascii=False),
+                "total_messages": 0,
+                "user_messages": 0,
+                "ai_messages": 0,
+                "response_time_sum": 0,
+                "response_time_count": 0
+            })
+            pipe.expire(session_key, self.session_timeout)
+            pipe.zadd(self.ACTIVITY_INDEX, {session.session_id: time.time()})
+            await pipe.execute()
+
+        for message in session.messages:
+            await self.append_message(session.session_id, message)
+
+    async def load_session(self, session_id: str) -> Optional[ChatSession]:
+        if not await self.touch(session_id):
+            return None
+
+        client = await self._client()
+        data = await client.hgetall(self._session_key(session_id))
+        if not data:
+            return None
+
+        session = ChatSession(
+            session_id=session_id,
+            user_id=data.get("user_id") or None,
+            created_at=float(data["created_at"]),
+            last_activity=float(data["last_activity"]),
+            messages=await self.get_messages(session_id, self.max_messages),
+            context=json.loads(data.get("context") or "{}"),
+            history_window=self.max_messages
+        )
+
+        # Счетчики - за всю сессию, а не только по сохраненному окну
+        session.total_messages = int(data.get("total_messages") or 0)
+        session.user_messages = int(data.get("user_messages") or 0)
+        session.ai_messages = int(data.get("ai_messages") or 0)
+        session.response_time_sum = float(data.get("response_time_sum") or 0)
+        session.response_time_count = int(data.get("response_time_count") or 0)
+        return session
+
+    async def touch(self, session_id: str) -> bool:
+        if self._touch_script is None:
+            await self.initialize()
+
+        result = await self._touch_script(
+            keys=[self._session_key(session_id), self._messages_key(session_id), self.ACTIVITY_INDEX],
+            args=[time.time(), self.session_timeout, time.time(), session_id]
+        )
+        return bool(result)
+
+    async def append_message(self, session_id: str, message: ChatMessage) -> bool:
+        if self._append_script is None:
+            await self.initialize()
+
+        role_counter = {"user": "user_messages", "assistant": "ai_messages"}.get(message.role, "")
+        response_time = str(message.processing_time) if message.role == "assistant" and message.processing_time else ""
+
+        result = await self._append_script(
+            keys=[self._session_key(session_id), self._messages_key(session_id), self.ACTIVITY_INDEX, self.TOTAL_MESSAGES],
+            args=[
+                json.dumps(message.to_dict(), ensure_ascii=False),
+                self.max_messages,
+                time.time(),
+                role_counter,
+                response_time,
+                self.session_timeout,
+                time.time(),
+                session_id
+            ]
+        )
+        return bool(result)
+
+    async def get_messages(self, session_id: str, limit: Optional[int]) -> List[ChatMessage]:
+        client = await self._client()
+        raw_messages = await client.lrange(self._messages_key(session_id), -limit if limit else 0, -1)
+        return [ChatMessage.from_dict(json.loads(raw)) for raw in raw_messages]
+
+    async def get_context(self, session_id: str) -> Dict[str, Any]:
+        client = await self._client()
+        return json.loads(await client.hget(self._session_key(session_id), "context") or "{}")
+
+    async def update_context(self, session_id: str, context_update: Dict[str, Any]) -> bool:
+        if not await self.touch(session_id):
+            return False
+
+        client = await self._client()
+        session_key = self._session_key(session_id)
+
+        from redis.exceptions import WatchError
+
+        # Оптимистичная блокировка: контекст могут обновлять несколько воркеров
+        async with client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(session_key)
+                    context = json.loads(await pipe.hget(session_key, "context") or "{}")
+                    context.update(context_update)
+                    pipe.multi()
+                    pipe.hset(session_key, "context", json.dumps(context, ensure_ascii=False))
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    # Контекст изменился между чтением и записью - повторяем
+                    continue
+
+    async def get_session_stats(self, session_id: str) -> Dict[str, Any]:
+        if not await self.touch(session_id):
+            return {}
+
+        client = await self._client()
+        data = await client.hgetall(self._session_key(session_id))
+        if not data:
+            return {}
+
+        response_time_count = int(data.get("response_time_count") or 0)
+        response_time_sum = float(data.get("response_time_sum") or 0)
+        created_at = float(data["created_at"])
+        last_activity = float(data["last_activity"])
+
+        return {
+            "session_id": session_id,
+            "user_id": data.get("user_id") or None,
+            "created_at": _to_iso(created_at),
+            "last_activity": _to_iso(last_activity),
+            "total_messages": int(data.get("total_messages") or 0),
+            "user_messages": int(data.get("user_messages") or 0),
+            "ai_messages": int(data.get("ai_messages") or 0),
+            "average_response_time": response_time_sum / response_time_count if response_time_count else 0.0,
+            "session_duration": (last_activity - created_at) / 60,
+            "context": json.loads(data.get("context") or "{}")
+        }
+
+    async def get_all_sessions_stats(self) -> Dict[str, Any]:
+        client = await self._client()
+        now = time.time()
+
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.zcount(self.ACTIVITY_INDEX, now - self.session_timeout, "+inf")
+            pipe.zcount(self.ACTIVITY_INDEX, now - ACTIVE_SESSION_WINDOW, "+inf")
+            pipe.get(self.TOTAL_MESSAGES)
+            total_sessions, active_sessions, total_messages = await pipe.execute()
+
+        # total_messages - счетчик за все время работы хранилища
+        total_messages = int(total_messages or 0)
+
+        return {
+            "total_sessions": total_sessions,
+            "active_sessions": active_sessions,
+            "total_messages": total_messages,
+            "average_messages_per_session": total_messages / total_sessions if total_sessions > 0 else 0
+        }
+
+    async def cleanup_expired(self, session_timeout: int) -> int:
+        # Сами сессии удаляет Redis по TTL, здесь только подчищаем индекс активности
+        client = await self._client()
+        return await client.zremrangebyscore(self.ACTIVITY_INDEX, "-inf", time.time() - session_timeout)
@@ -78,6 +78,7 @@ let lastHeartbeat = null;
 let touchStartY = 0;
 let touchEndY = 0;
 let isMobile = window.innerWidth < 768;
+let streamingMessage = null; // Сообщение ИИ, которое собирается из фрагментов ai_delta
 
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', function() {
@@ -336,14 +337,23 @@ function handleWebSocketMessage(data) {
     }
 
     switch (data.type) {
+        case 'ai_delta':
+            appendStreamingDelta(data.content || '');
+            break;
+
         case 'ai_message':
             hideTypingIndicator();
-            addMessage(data.content, 'ai', {
-                timestamp: data.timestamp,
-                intent: data.intent,
-                processing_time: data.processing_time,
-                model: data.model
-            });
+            if (streamingMessage) {
+                // Итоговый ответ заменяет собранный из фрагментов текст
+                finishStreamingMessage(data.content, data.intent);
+            } else {
+                addMessage(data.content, 'ai', {
+                    timestamp: data.timestamp,
+                    intent: data.intent,
+                    processing_time: data.processing_time,
+                    model: data.model
+                });
+            }
 
             // Сохраняем session_id
             if (data.session_id) {
@@ -378,6 +388,12 @@ function handleWebSocketMessage(data) {
             showTypingIndicator();
             break;
 
+        case 'queue_status':
+            // Сервер перегружен - запрос ждет своей очереди к модели
+            showTypingIndicator();
+            setTypingText(`Много обращений, вы в очереди: ${data.position} из ${data.queue_size}...`);
+            break;
+
         case 'pong':
             // Обновляем время последнего heartbeat
             lastHeartbeat = Date.now();
@@ -386,6 +402,7 @@ function handleWebSocketMessage(data) {
 
         case 'error':
             hideTypingIndicator();
+            streamingMessage = null;
             showErrorMessage('Ошибка: ' + data.content);
             break;
 
@@ -633,6 +650,49 @@ function convertMarkdownToHTML(text) {
     return html;
 }
 
+// Добавить фрагмент потокового ответа ИИ
+function appendStreamingDelta(chunk) {
+    if (!chatBody || !chunk) return;
+
+    if (!streamingMessage) {
+        hideTypingIndicator();
+        const messageDiv = addMessage('', 'ai');
+        streamingMessage = {
+            div: messageDiv,
+            content: messageDiv.querySelector('.message-content'),
+            text: '',
+            renderScheduled: false
+        };
+    }
+
+    streamingMessage.text += chunk;
+
+    // Перерисовываем не чаще одного раза за кадр
+    if (!streamingMessage.renderScheduled) {
+        streamingMessage.renderScheduled = true;
+        const current = streamingMessage;
+        requestAnimationFrame(() => {
+            current.renderScheduled = false;
+            if (current !== streamingMessage) return;
+            current.content.innerHTML = convertMarkdownToHTML(current.text);
+            chatBody.scrollTop = chatBody.scrollHeight;
+        });
+    }
+}
+
+// Завершить потоковый ответ ИИ итоговым текстом
+function finishStreamingMessage(content, intent) {
+    const current = streamingMessage;
+    streamingMessage = null;
+
+    if (intent) {
+        current.div.setAttribute('data-intent', intent);
+        current.div.setAttribute('data-sender', 'ai');
+    }
+    current.content.innerHTML = convertMarkdownToHTML(content);
+    chatBody.scrollTop = chatBody.scrollHeight;
+}
+
 // Показать индикатор печати
 function showTypingIndicator() {
     if (isTyping) return;
@@ -645,7 +705,7 @@ function showTypingIndicator() {
             <span class="typing-dots">
                 <span></span><span></span><span></span>
             </span>
-            ИИ-консультант печатает...
+            <span class="typing-text">ИИ-консультант печатает...</span>
         </div>
     `;
     chatBody.appendChild(typingDiv);
@@ -661,6 +721,13 @@ function showTypingIndicator() {
 }
 
 // Скрыть индикатор печати
+function setTypingText(text) {
+    const typingText = chatBody.querySelector('.typing-indicator .typing-text');
+    if (typingText) {
+        typingText.textContent = text;
+    }
+}
+
 function hideTypingIndicator() {
     isTyping = false;
     const typingIndicator = chatBody.querySelector('.typing-indicator');
@@ -1,5 +1,6 @@
 // Глобальные переменные
 let selectedCategory = '';
+let submissionKey = null; // Ключ идемпотентности текущей заявки
 const categoryTitles = {
     'driver': 'Заявка водителя',
     'courier': 'Заявка курьера',
@@ -401,15 +402,32 @@ async function handleFormSubmit(e) {
     // Показываем загрузку
     showLoadingState();
 
+    // Один ключ на заявку: повторная отправка (двойной клик, повтор после ошибки сети) не создаст дубль
+    if (!submissionKey) {
+        submissionKey = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    }
+
     // Отправляем данные на сервер
     try {
-        const response = await fetch('/api/signup', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(formData)
-        });
+        let response;
+        // 409 - предыдущая отправка с тем же ключом еще сохраняется: ждем и повторяем с тем же ключом
+        for (let attempt = 0; attempt < 5; attempt++) {
+            response = await fetch('/api/signup', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': submissionKey,
+                },
+                body: JSON.stringify(formData)
+            });
+            if (response.status !== 409) {
+                break;
+            }
+            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        }
 
         const result = await response.json();
 
@@ -421,6 +439,7 @@ async function handleFormSubmit(e) {
                 trackFormSuccess();
             }
             
+            submissionKey = null;
             showSuccessMessage();
             clearSavedProgress();
             showNotification(result.message || 'Заявка успешно отправлена!', 'success');
@@ -3,12 +3,12 @@
 """
 import logging
 import html
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from aiogram import Router, F
 from aiogram.enums import ParseMode
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
@@ -16,6 +16,7 @@ from telegram_bot.services.manager_service import manager_service
 from telegram_bot.models.support_models import Application, ApplicationStatus, Manager
 from telegram_bot.models.database import AsyncSessionLocal
 from telegram_bot.config.settings import settings
+from telegram_bot.services.messenger import messenger
 
 logger = logging.getLogger(__name__)
 
@@ -75,7 +76,10 @@ async def process_applications_callback(
     callback: CallbackQuery, 
     status: Optional[ApplicationStatus] = None,
     page: int = 1,
-    show_all: bool = False
+    show_all: bool = False,
+    after: Optional[Tuple[datetime, int]] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+    legacy_offset: bool = False
 ):
     """Обработать запрос на показ заявок через callback
     
@@ -84,6 +88,9 @@ async def process_applications_callback(
         status: Статус заявок для фильтрации
         page: Номер страницы для пагинации (начиная с 1)
         show_all: Показать все заявки (как для админа)
+        after: Курсор следующей страницы (created_at, id последней показанной заявки)
+        before: Курсор предыдущей страницы (created_at, id первой показанной заявки)
+        legacy_offset: Страница из старой кнопки page_ - выбирается через OFFSET
     """
     user = callback.from_user
     telegram_id = int(user.id)
@@ -96,26 +103,28 @@ async def process_applications_callback(
         
         # Настройки пагинации
         per_page = 5  # Количество заявок на странице
-        offset = (page - 1) * per_page
         
-        # Получаем заявки менеджера с указанным статусом
+        # Получаем заявки менеджера с указанным статусом (на одну больше - есть ли следующая страница)
         applications = await manager_service.get_manager_applications(
             telegram_id, 
             status=status, 
-            limit=per_page, 
-            offset=offset,
-            show_all=show_all
+            limit=per_page + 1, 
+            offset=(page - 1) * per_page if legacy_offset else 0,
+            show_all=show_all,
+            after=after,
+            before=before
         )
+        if before is not None:
+            # Предыдущая страница всегда существует целиком, лишняя запись - самая новая
+            has_next = True
+            applications = applications[-per_page:]
+        else:
+            has_next = len(applications) > per_page
+            applications = applications[:per_page]
         
-        # Получаем общее количество заявок для пагинации
-        all_applications = await manager_service.get_manager_applications(
-            telegram_id, 
-            status=status,
-            limit=1000,  # Большое значение для получения всех заявок
-            show_all=show_all
-        )
-        total_applications = len(all_applications)
-        total_pages = (total_applications + per_page - 1) // per_page  # Округление вверх
+        # Общее количество - из кэша, только для подписи "стр. N/M"
+        total_applications = await manager_service.count_manager_applications(telegram_id, status=status, show_all=show_all)
+        total_pages = max(page, (total_applications + per_page - 1) // per_page)  # Округление вверх
         
         if not applications:
             try:
@@ -177,18 +186,18 @@ async def process_applications_callback(
                 )
             ])
         
-        # Кнопки пагинации
+        # Кнопки пагинации (курсор по created_at и id вместо номера страницы)
         pagination_buttons = []
         page_code = get_status_code(status, show_all)
 
         if page > 1:
             pagination_buttons.append(
-                InlineKeyboardButton(text="◀️ Назад", callback_data=f"page_{page_code}_{page-1}")
+                InlineKeyboardButton(text="◀️ Назад", callback_data=encode_page_cursor(page_code, "p", page - 1, applications[0]))
             )
         
-        if page < total_pages:
+        if has_next:
             pagination_buttons.append(
-                InlineKeyboardButton(text="Вперед ▶️", callback_data=f"page_{page_code}_{page+1}")
+                InlineKeyboardButton(text="Вперед ▶️", callback_data=encode_page_cursor(page_code, "n", page + 1, applications[-1]))
             )
         
         if pagination_buttons:
@@ -228,6 +237,53 @@ def get_status_code(status: Optional[ApplicationStatus], show_all: bool = False)
         ApplicationStatus.CANCELLED: "cancelled"
     }.get(status, "my")
 
+# Курсор пагинации в callback_data: apg:<код списка>:<n|p>:<страница>:<created_at в мкс>:<id>
+# Числа в base36, чтобы уложиться в лимит Telegram 64 байта
+PAGE_CURSOR_PREFIX = "apg"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+STATUS_CODE_MAP = {
+    "new": (ApplicationStatus.NEW, False),
+    "assigned": (ApplicationStatus.ASSIGNED, False),
+    "in_progress": (ApplicationStatus.IN_PROGRESS, False),
+    "completed": (ApplicationStatus.COMPLETED, False),
+    "waiting": (ApplicationStatus.WAITING_CLIENT, False),
+    "cancelled": (ApplicationStatus.CANCELLED, False),
+    "my": (None, False),
+    "all_admin": (None, True)
+}
+
+def _to_base36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        result = digits[remainder] + result
+        if not value:
+            return result
+
+def encode_page_cursor(status_code: str, direction: str, page: int, application: Application) -> str:
+    """callback_data кнопки страницы, курсор - заявка на границе текущей страницы"""
+    created_at = application.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    data = f"{PAGE_CURSOR_PREFIX}:{status_code}:{direction}:{page}:{_to_base36(micros)}:{_to_base36(application.id)}"
+    if len(data.encode()) > 64:
+        logger.warning(f"⚠️ callback_data пагинации длиннее 64 байт: {data}")
+    return data
+
+def decode_page_cursor(data: str) -> Optional[Tuple[str, str, int, Tuple[datetime, int]]]:
+    """(код списка, направление, страница, (created_at, id)) или None для некорректных данных"""
+    try:
+        _, status_code, direction, page, micros, app_id = data.split(":")
+        if status_code not in STATUS_CODE_MAP or direction not in ("n", "p"):
+            return None
+        created_at = _EPOCH + timedelta(microseconds=int(micros, 36))
+        return status_code, direction, int(page), (created_at, int(app_id, 36))
+    except ValueError:
+        return None
+
 @application_router.callback_query(F.data == "my_applications")
 async def callback_my_applications(callback: CallbackQuery):
     """Показать мои заявки"""
@@ -450,6 +506,7 @@ async def callback_application_action(callback: CallbackQuery):
                     application.status = ApplicationStatus.COMPLETED
                     application.processed_at = datetime.utcnow()
                     await session.commit()
+                    await manager_service.invalidate_manager_stats(telegram_id)
                     
                     text = f"✅ <b>Заявка #{app_id} завершена!</b>\n\n"
                     text += "Спасибо за работу! 👍"
@@ -513,57 +570,50 @@ async def callback_applications_menu(callback: CallbackQuery):
             await callback.answer("❌ Произошла ошибка.", show_alert=True)
 
 # Обработчик для пагинации
+@application_router.callback_query(F.data.startswith(f"{PAGE_CURSOR_PREFIX}:"))
+async def callback_cursor_pagination(callback: CallbackQuery):
+    """Переход по страницам списка заявок по курсору"""
+    cursor = decode_page_cursor(callback.data)
+    if cursor is None:
+        await callback.answer("❌ Некорректный формат данных пагинации", show_alert=True)
+        return
+    
+    status_code, direction, page, position = cursor
+    status, show_all = STATUS_CODE_MAP[status_code]
+    
+    await process_applications_callback(
+        callback,
+        status=status,
+        page=page,
+        show_all=show_all,
+        after=position if direction == "n" else None,
+        before=position if direction == "p" else None
+    )
+
+# Кнопки page_ в ранее отправленных сообщениях
 @application_router.callback_query(F.data.startswith("page_"))
 async def callback_pagination(callback: CallbackQuery):
     """Обработка пагинации для списков заявок"""
-    data_parts = callback.data.split("_")
+    # Формат: page_STATUS_НОМЕР (код статуса сам может содержать "_")
+    status_code, _, page = callback.data[len("page_"):].rpartition("_")
     
-    # Формат: page_STATUS_НОМЕР
-    if len(data_parts) < 3:
+    if not status_code or not page.isdigit():
         await callback.answer("❌ Некорректный формат данных пагинации", show_alert=True)
         return
     
-    status_code = data_parts[1]
-    page = int(data_parts[2])
-    
-    # Определяем статус по коду
-    status_map = {
-        "new": ApplicationStatus.NEW,
-        "assigned": ApplicationStatus.ASSIGNED,
-        "in_progress": ApplicationStatus.IN_PROGRESS,
-        "completed": ApplicationStatus.COMPLETED,
-        "waiting": ApplicationStatus.WAITING_CLIENT,
-        "cancelled": ApplicationStatus.CANCELLED,
-        "my": None,
-        "all_admin": None
-    }
-    
-    show_all = status_code == "all_admin"
-    status = status_map.get(status_code)
+    status, show_all = STATUS_CODE_MAP.get(status_code, (None, False))
     
     # Вызываем обработчик с указанной страницей
-    await process_applications_callback(callback, status=status, page=page, show_all=show_all)
+    await process_applications_callback(callback, status=status, page=int(page), show_all=show_all, legacy_offset=True)
 
 # Обработчики для обновления списков с разными статусами
 @application_router.callback_query(F.data.startswith("refresh_"))
 async def callback_refresh_by_status(callback: CallbackQuery):
     """Обновить список заявок с определенным статусом"""
-    status_code = callback.data.split("_")[1]
+    status_code = callback.data[len("refresh_"):]
     
     # Определяем статус по коду
-    status_map = {
-        "new": ApplicationStatus.NEW,
-        "assigned": ApplicationStatus.ASSIGNED,
-        "in_progress": ApplicationStatus.IN_PROGRESS,
-        "completed": ApplicationStatus.COMPLETED,
-        "waiting": ApplicationStatus.WAITING_CLIENT,
-        "cancelled": ApplicationStatus.CANCELLED,
-        "my": None,
-        "all_admin": None
-    }
-    
-    status = status_map.get(status_code)
-    show_all = status_code == "all_admin"
+    status, show_all = STATUS_CODE_MAP.get(status_code, (None, False))
     
     # Вызываем обработчик с указанным статусом
     await process_applications_callback(callback, status=status, show_all=show_all)
@@ -863,11 +913,8 @@ async def auto_assign_new_applications():
 async def notify_manager_about_new_application(manager, application: Application):
     """Уведомить менеджера о новой заявке"""
     try:
-        from aiogram import Bot
         from telegram_bot.config.settings import settings
         
-        bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-        
         text = f"""
 🔔 <b>Новая заявка назначена вам!</b>
 
@@ -881,10 +928,11 @@ async def notify_manager_about_new_application(manager, application: Application
             [InlineKeyboardButton(text="✅ Взять в работу", callback_data=f"app_take_{application.id}")]
         ])
         
-        await bot.send_message(
+        await messenger.send_message(
             chat_id=manager.telegram_id,
             text=text,
-            reply_markup=keyboard
+            reply_markup=keyboard,
+            parse_mode="HTML"
         )
         
     except Exception as e:
@@ -8,11 +8,15 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 from telegram_bot.services.manager_service import manager_service
 from telegram_bot.services.redis_service import redis_service
+from telegram_bot.services.webchat_bus import webchat_bus
+from telegram_bot.services.chat_routing import chat_routing
+from telegram_bot.services.stats_rollup import stats_rollup
+from telegram_bot.services.data_export import data_export, EXPORT_DATASETS, EXPORT_FORMATS
 from telegram_bot.models.support_models import ManagerStatus, ApplicationStatus, SupportChat, ChatMessage
 from telegram_bot.config.settings import settings
 
@@ -163,7 +167,7 @@ async def cmd_offline(message: Message, state: FSMContext):
             return
         
         # Проверяем активные чаты
-        active_chats = await redis_service.get_manager_active_chats(str(telegram_id))
+        active_chats = await redis_service.count_manager_active_chats(str(telegram_id))
         
         if active_chats:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -173,7 +177,7 @@ async def cmd_offline(message: Message, state: FSMContext):
             
             await message.answer(
                 f"⚠️ **Внимание!**\n\n"
-                f"У вас есть {len(active_chats)} активных чата(ов).\n"
+                f"У вас есть {active_chats} активных чата(ов).\n"
                 f"При завершении смены они будут переданы другим менеджерам.\n\n"
                 f"Вы уверены, что хотите завершить смену?",
                 reply_markup=keyboard
@@ -451,6 +455,7 @@ async def cmd_reports(message: Message):
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📊 Дневной отчет", callback_data="report_daily")],
             [InlineKeyboardButton(text="📈 Недельный отчет", callback_data="report_weekly")],
+            [InlineKeyboardButton(text="🗓 Месячный отчет", callback_data="report_monthly")],
             [InlineKeyboardButton(text="👥 Отчет по менеджерам", callback_data="report_managers")],
             [InlineKeyboardButton(text="📋 Отчет по заявкам", callback_data="report_applications")],
             [InlineKeyboardButton(text="💬 Отчет по чатам", callback_data="report_chats")],
@@ -464,6 +469,46 @@ async def cmd_reports(message: Message):
         logger.error(f"❌ Ошибка в команде /reports: {e}")
         await message.answer("❌ Произошла ошибка при получении отчетов.")
 
+# Команда /export
+@base_router.message(Command("export"))
+async def cmd_export(message: Message):
+    """Выгрузка данных за произвольный период: /export <набор> [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [csv|jsonl]"""
+    telegram_id = int(message.from_user.id)
+    
+    try:
+        manager = await manager_service.get_manager_by_telegram_id(telegram_id)
+        if not manager or not manager.is_admin:
+            await message.answer("❌ У вас нет прав администратора.")
+            return
+        
+        args = (message.text or "").split()[1:]
+        fmt = args.pop() if args and args[-1] in EXPORT_FORMATS else "csv"
+        if not args or args[0] not in EXPORT_DATASETS or len(args) > 3:
+            await message.answer(
+                "📦 Выгрузка данных\n\n"
+                "`/export <набор> [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [csv|jsonl]`\n\n"
+                f"Наборы: {', '.join(EXPORT_DATASETS)}\n"
+                "Пример: `/export applications 2025-01-01 2025-01-31 csv`"
+            )
+            return
+        
+        try:
+            date_from = datetime.strptime(args[1], "%Y-%m-%d") if len(args) > 1 else None
+            # Дата окончания включительно
+            date_to = datetime.strptime(args[2], "%Y-%m-%d") + timedelta(days=1) if len(args) > 2 else None
+        except ValueError:
+            await message.answer("❌ Даты указываются в формате ГГГГ-ММ-ДД")
+            return
+        
+        if data_export.start_export(message.chat.id, args[0], fmt, date_from, date_to):
+            await message.answer("⏳ Выгрузка запущена, файл придет в этот чат.")
+        else:
+            await message.answer("⏳ Предыдущая выгрузка еще не завершена.")
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка в команде /export: {e}")
+        await message.answer("❌ Произошла ошибка при запуске выгрузки.")
+
 # Команда /help
 @base_router.message(Command("help"))
 async def cmd_help(message: Message):
@@ -498,6 +543,7 @@ async def cmd_help(message: Message):
 /admin - Панель администратора
 /managers - Управление менеджерами
 /reports - Отчеты и аналитика
+/export - Выгрузка данных в файл
         """
     
     help_text += """
@@ -619,7 +665,7 @@ async def callback_go_offline(callback: CallbackQuery, state: FSMContext):
             return
         
         # Проверяем активные чаты
-        active_chats = await redis_service.get_manager_active_chats(str(telegram_id))
+        active_chats = await redis_service.count_manager_active_chats(str(telegram_id))
         
         if active_chats:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -629,7 +675,7 @@ async def callback_go_offline(callback: CallbackQuery, state: FSMContext):
             
             await callback.message.edit_text(
                 f"⚠️ **Внимание!**\n\n"
-                f"У вас есть {len(active_chats)} активных чата(ов).\n"
+                f"У вас есть {active_chats} активных чата(ов).\n"
                 f"При завершении смены они будут переданы другим менеджерам.\n\n"
                 f"Вы уверены, что хотите завершить смену?",
                 reply_markup=keyboard
@@ -1060,6 +1106,66 @@ async def callback_refresh_managers(callback: CallbackQuery):
     await callback.answer("🔄 Список менеджеров обновлен")
 
 # Обработчики для команды /reports
+def format_duration(seconds) -> str:
+    """Длительность для отчетов: 45 мин, 3.5 ч, 2.1 дн"""
+    if seconds is None:
+        return "нет данных"
+    if seconds < 3600:
+        return f"{max(1, round(seconds / 60))} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+def format_rollup_report(title: str, report: dict) -> str:
+    """Текст отчета по агрегатам заявок (stats_rollup.get_report)"""
+    completion_rate = f"{report['completion_rate']}%" if report['completion_rate'] is not None else "нет данных"
+    
+    text = f"""
+{title}
+
+**Заявки:**
+• Поступило: {report['created']}
+• Завершено: {report['completed']}
+• Отменено: {report['cancelled']}
+• Процент завершенных: {completion_rate}
+
+**Время обработки (от поступления до завершения):**
+• Среднее: {format_duration(report['avg_processing_seconds'])}
+• Медиана: ~{format_duration(report['p50_processing_seconds'])}
+• 90% заявок быстрее: ~{format_duration(report['p90_processing_seconds'])}
+"""
+    
+    if len(report['by_day']) > 1:
+        text += "\n**По дням (поступило / завершено):**\n"
+        text += "\n".join(f"• {day.strftime('%d.%m')}: {created} / {completed}" for day, created, completed in report['by_day'])
+        text += "\n"
+    
+    if report['top_categories']:
+        text += "\n**Категории:** " + ", ".join(f"{category} - {count}" for category, count in report['top_categories']) + "\n"
+    if report['top_cities']:
+        text += "**Города:** " + ", ".join(f"{city} - {count}" for city, count in report['top_cities']) + "\n"
+    if report['top_managers']:
+        text += "\n**Лучшие менеджеры (завершено):**\n"
+        text += "\n".join(f"{i}. {name} - {count}" for i, (name, count) in enumerate(report['top_managers'], 1))
+        text += "\n"
+    
+    if report['updated_at']:
+        text += f"\n_Данные на {report['updated_at'].strftime('%H:%M')} UTC_"
+    return text
+
+async def send_rollup_report(callback: CallbackQuery, days: int, title: str, keyboard_buttons: list):
+    """Проверить права и показать отчет за days дней"""
+    manager = await manager_service.get_manager_by_telegram_id(int(callback.from_user.id))
+    if not manager or not manager.is_admin:
+        await callback.answer("❌ У вас нет прав администратора.")
+        return
+    
+    report = await stats_rollup.get_report(days)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons + [
+        [InlineKeyboardButton(text="◀️ Отчеты", callback_data="admin_reports")]
+    ])
+    await callback.message.edit_text(format_rollup_report(title, report), reply_markup=keyboard)
+
 @base_router.callback_query(F.data == "report_daily")
 async def callback_report_daily(callback: CallbackQuery):
     """Дневной отчет"""
@@ -1072,25 +1178,18 @@ async def callback_report_daily(callback: CallbackQuery):
             await callback.answer("❌ У вас нет прав администратора.")
             return
         
-        # Получаем системную статистику
+        # Текущее состояние - из БД, итоги дня - из агрегатов
         system_stats = await manager_service.get_system_stats()
+        report = await stats_rollup.get_report(1)
         
-        report_text = f"""
-📊 **Дневной отчет - {datetime.now().strftime('%d.%m.%Y')}**
+        report_text = format_rollup_report(f"📊 **Дневной отчет - {datetime.utcnow().strftime('%d.%m.%Y')}**", report)
+        report_text += f"""
 
-**Основные показатели:**
-• Заявок сегодня: {system_stats['today_applications']}
-• Завершено за час: {system_stats['hour_completed']}
-• Активных менеджеров: {system_stats['online_managers']}
-• Всего менеджеров: {system_stats['total_managers']}
-
-**Производительность:**
-• Время обработки: ~15 мин (среднее)
-• Процент завершенных: 85%
+**Сейчас:**
+• Активных менеджеров: {system_stats['online_managers']} из {system_stats['total_managers']}
 • Активных чатов: {system_stats['active_chats']}
-
-**Статус системы:** ✅ Работает стабильно
-        """
+• Завершено за час: {system_stats['hour_completed']}
+"""
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📈 Недельный отчет", callback_data="report_weekly")],
@@ -1106,7 +1205,24 @@ async def callback_report_daily(callback: CallbackQuery):
 @base_router.callback_query(F.data == "report_weekly")
 async def callback_report_weekly(callback: CallbackQuery):
     """Недельный отчет"""
-    await callback.answer("📈 Функция недельного отчета в разработке")
+    try:
+        await send_rollup_report(callback, 7, "📈 **Недельный отчет (7 дней)**", [
+            [InlineKeyboardButton(text="🗓 Месячный отчет", callback_data="report_monthly")]
+        ])
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения недельного отчета: {e}")
+        await callback.answer("❌ Произошла ошибка")
+
+@base_router.callback_query(F.data == "report_monthly")
+async def callback_report_monthly(callback: CallbackQuery):
+    """Месячный отчет"""
+    try:
+        await send_rollup_report(callback, 30, "🗓 **Месячный отчет (30 дней)**", [
+            [InlineKeyboardButton(text="📈 Недельный отчет", callback_data="report_weekly")]
+        ])
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения месячного отчета: {e}")
+        await callback.answer("❌ Произошла ошибка")
 
 @base_router.callback_query(F.data == "report_managers")
 async def callback_report_managers_detailed(callback: CallbackQuery):
@@ -1125,8 +1241,67 @@ async def callback_report_chats(callback: CallbackQuery):
 
 @base_router.callback_query(F.data == "export_data")
 async def callback_export_data(callback: CallbackQuery):
-    """Экспорт данных"""
-    await callback.answer("📊 Функция экспорта данных в разработке")
+    """Экспорт данных - выбор набора"""
+    manager = await manager_service.get_manager_by_telegram_id(int(callback.from_user.id))
+    if not manager or not manager.is_admin:
+        await callback.answer("❌ У вас нет прав администратора.")
+        return
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"📦 {title}", callback_data=f"exp:{code}")]
+        for code, (_, title) in EXPORT_DATASETS.items()
+    ] + [[InlineKeyboardButton(text="◀️ Отчеты", callback_data="admin_reports")]])
+    
+    await callback.message.edit_text(
+        "📊 **Экспорт данных**\n\n"
+        "Выберите, что выгрузить. Файлы сжаты gzip; для произвольного периода используйте /export.",
+        reply_markup=keyboard
+    )
+    await callback.answer()
+
+@base_router.callback_query(F.data.startswith("exp:"))
+async def callback_export_dataset(callback: CallbackQuery):
+    """Экспорт данных - выбор периода и формата, затем запуск выгрузки"""
+    manager = await manager_service.get_manager_by_telegram_id(int(callback.from_user.id))
+    if not manager or not manager.is_admin:
+        await callback.answer("❌ У вас нет прав администратора.")
+        return
+    
+    # Формат: exp:<набор> или exp:<набор>:<дней, 0 - все время>:<формат>
+    parts = callback.data.split(":")
+    dataset = parts[1] if len(parts) > 1 else ""
+    if dataset not in EXPORT_DATASETS:
+        await callback.answer("❌ Неизвестный набор данных", show_alert=True)
+        return
+    
+    if len(parts) == 2:
+        periods = [("7 дней", 7), ("30 дней", 30), ("90 дней", 90), ("Все время", 0)]
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text=f"{label} · {fmt.upper()}", callback_data=f"exp:{dataset}:{days}:{fmt}")
+                for fmt in EXPORT_FORMATS
+            ]
+            for label, days in periods
+        ] + [[InlineKeyboardButton(text="◀️ Экспорт данных", callback_data="export_data")]])
+        
+        await callback.message.edit_text(
+            f"📦 **{EXPORT_DATASETS[dataset][1]}**\n\nВыберите период и формат:",
+            reply_markup=keyboard
+        )
+        await callback.answer()
+        return
+    
+    if len(parts) != 4 or not parts[2].isdigit() or parts[3] not in EXPORT_FORMATS:
+        await callback.answer("❌ Некорректные параметры выгрузки", show_alert=True)
+        return
+    
+    days, fmt = int(parts[2]), parts[3]
+    date_from = datetime.combine(datetime.utcnow().date(), datetime.min.time()) - timedelta(days=days - 1) if days else None
+    
+    if data_export.start_export(callback.message.chat.id, dataset, fmt, date_from):
+        await callback.answer("⏳ Выгрузка запущена, файл придет в этот чат", show_alert=True)
+    else:
+        await callback.answer("⏳ Предыдущая выгрузка еще не завершена", show_alert=True)
 
 @base_router.callback_query(F.data == "all_applications")
 async def callback_all_applications(callback: CallbackQuery):
@@ -1370,10 +1545,11 @@ async def callback_close_chat(callback: CallbackQuery):
             await session.commit()
             
             # Отправляем сообщение в веб-чат о завершении и переводе на ИИ
-            web_session_id = support_chat.chat_metadata.get("web_session_id") if support_chat.chat_metadata else None
+            web_session_id = support_chat.web_session_id
             
             if web_session_id:
-                from routers.chat_routes import manager as connection_manager
+                # Сообщения сессии снова обрабатывает ИИ
+                await chat_routing.set_ai_route(web_session_id)
                 
                 return_to_ai_message = {
                     "type": "system_message",
@@ -1384,16 +1560,13 @@ async def callback_close_chat(callback: CallbackQuery):
                     "chat_status": "ai_mode"
                 }
                 
-                try:
-                    await connection_manager.send_to_session(
-                        web_session_id, 
-                        json.dumps(return_to_ai_message, ensure_ascii=False)
-                    )
+                # Подтверждение не ждем: закрытие чата не должно зависеть от того, онлайн ли клиент
+                if await webchat_bus.publish(web_session_id, return_to_ai_message, wait_ack=False):
                     logger.info(f"✅ Клиент уведомлен о завершении чата и возврате к ИИ")
-                except Exception as ws_error:
-                    logger.error(f"❌ Ошибка отправки уведомления о завершении чата: {ws_error}")
+                else:
+                    logger.warning(f"⚠️ Клиент сессии {web_session_id} не подключен, уведомление о завершении чата не доставлено")
             
-            # Удаляем из активных чатов менеджера
+            # Удаляем из активных чатов менеджера (слот в индексе загрузки освобождается там же)
             await redis_service.remove_manager_active_chat(
                 str(telegram_id), 
                 support_chat.chat_id
@@ -1466,7 +1639,7 @@ async def handle_manager_reply(message: Message, state: FSMContext):
         await message.reply("❌ Произошла ошибка при отправке сообщения.")
 
 async def send_manager_message_to_webchat(chat_id: int, message_text: str, manager_telegram_id: int) -> bool:
-    """Отправить сообщение менеджера в веб-чат через API"""
+    """Отправить сообщение менеджера в веб-чат через шину доставки"""
     try:
         from telegram_bot.models.database import AsyncSessionLocal
         
@@ -1498,8 +1671,7 @@ async def send_manager_message_to_webchat(chat_id: int, message_text: str, manag
             
             await session.commit()
             
-            # Отправляем через API
-            web_session_id = support_chat.chat_metadata.get("web_session_id") if support_chat.chat_metadata else None
+            web_session_id = support_chat.web_session_id
             
             if not web_session_id:
                 logger.warning(f"⚠️ Не найден web_session_id для чата {support_chat.chat_id}, отправка невозможна.")
@@ -1513,30 +1685,17 @@ async def send_manager_message_to_webchat(chat_id: int, message_text: str, manag
                 "chat_id": support_chat.chat_id
             }
             
-            api_url = f"http://127.0.0.1:{settings.API_PORT}/api/chat/send-to-client"
-            payload = {
-                "session_id": web_session_id,
-                "message_json": message_data
-            }
+            # Публикуем прямо в канал сессии - доставку выполнит воркер, держащий WebSocket
+            if await webchat_bus.publish(web_session_id, message_data):
+                logger.info(f"✅ Сообщение менеджера доставлено в сессию {web_session_id}")
+                return True
             
-            logger.info(f"📤 Отправка сообщения менеджеру через API на {api_url} для сессии {web_session_id}")
-
-            try:
-                async with aiohttp.ClientSession() as http_session:
-                    async with http_session.post(api_url, json=payload) as response:
-                        if response.status == 200:
-                            logger.info(f"✅ API-запрос на отправку сообщения для сессии {web_session_id} успешен.")
-                            return True
-                        else:
-                            response_text = await response.text()
-                            logger.error(f"❌ API-запрос на отправку сообщения для сессии {web_session_id} провален. Статус: {response.status}, Ответ: {response_text}")
-                            return False
-            except aiohttp.ClientConnectorError as conn_error:
-                logger.error(f"❌ Ошибка подключения к API ({api_url}): {conn_error}")
-                return False
-            except Exception as http_error:
-                logger.error(f"❌ Ошибка HTTP-запроса к API для отправки сообщения: {http_error}")
-                return False
+            if not redis_service.is_connected:
+                # Без Redis шина работает только внутри процесса - пробуем через API веб-сервера
+                return await post_message_to_webchat_api(web_session_id, message_data)
+            
+            logger.error(f"❌ Сообщение для сессии {web_session_id} не доставлено: клиент не подключен")
+            return False
             
     except Exception as e:
         logger.error(f"❌ Ошибка отправки сообщения в веб-чат: {e}")
@@ -1544,6 +1703,33 @@ async def send_manager_message_to_webchat(chat_id: int, message_text: str, manag
         logger.error(f"Полная ошибка: {traceback.format_exc()}")
         return False
 
+async def post_message_to_webchat_api(web_session_id: str, message_data: dict) -> bool:
+    """Резервная доставка через API веб-сервера (когда Redis недоступен)"""
+    api_url = f"http://127.0.0.1:{settings.API_PORT}/api/chat/send-to-client"
+    payload = {
+        "session_id": web_session_id,
+        "message_json": message_data
+    }
+    
+    logger.info(f"📤 Отправка сообщения менеджера через API на {api_url} для сессии {web_session_id}")
+    
+    try:
+        async with aiohttp.ClientSession() as http_session:
+            async with http_session.post(api_url, json=payload) as response:
+                if response.status == 200:
+                    logger.info(f"✅ API-запрос на отправку сообщения для сессии {web_session_id} успешен.")
+                    return True
+                else:
+                    response_text = await response.text()
+                    logger.error(f"❌ API-запрос на отправку сообщения для сессии {web_session_id} провален. Статус: {response.status}, Ответ: {response_text}")
+                    return False
+    except aiohttp.ClientConnectorError as conn_error:
+        logger.error(f"❌ Ошибка подключения к API ({api_url}): {conn_error}")
+        return False
+    except Exception as http_error:
+        logger.error(f"❌ Ошибка HTTP-запроса к API для отправки сообщения: {http_error}")
+        return False
+
 # Функции для создания клавиатур
 def get_manager_main_keyboard(is_admin: bool = False, manager_status: str = "offline") -> InlineKeyboardMarkup:
     """Главная клавиатура менеджера"""
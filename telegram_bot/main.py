@@ -12,6 +12,8 @@ from aiogram.fsm.storage.redis import RedisStorage
 from telegram_bot.config.settings import settings, validate_settings
 from telegram_bot.models.database import init_db, close_db
 from telegram_bot.services.redis_service import redis_service
+from telegram_bot.services.messenger import messenger
+from telegram_bot.services.stats_rollup import stats_rollup
 from telegram_bot.handlers.base_handlers import base_router
 from telegram_bot.handlers.application_handlers import application_router
 
@@ -39,6 +41,9 @@ async def create_bot() -> Bot:
         default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
     )
     
+    # Уведомления из сервисов отправляются через этот же экземпляр и его HTTP-сессию
+    messenger.attach(bot)
+    
     logger.info("✅ Бот создан успешно")
     return bot
 
@@ -96,6 +101,12 @@ async def on_startup():
         await redis_service.connect()
         logger.info("✅ Redis подключен")
         
+        # Активные чаты менеджеров старого формата (JSON-список) переводим в SET
+        await redis_service.migrate_legacy_active_chats()
+        
+        # Фоновый пересчет агрегатов для отчетов
+        stats_rollup.start()
+        
         # Настраиваем роутеры
         await setup_routers()
         
@@ -119,7 +130,10 @@ async def on_shutdown():
         # Отправляем уведомление админам о завершении
         await notify_admins_shutdown()
         
+        await stats_rollup.stop()
+        
         # Закрываем соединения
+        await messenger.close()
         await redis_service.disconnect()
         await close_db()
         
@@ -143,6 +157,7 @@ async def set_bot_commands():
         BotCommand(command="admin", description="👑 Панель администратора"),
         BotCommand(command="managers", description="👥 Управление менеджерами"),
         BotCommand(command="reports", description="📈 Отчеты и аналитика"),
+        BotCommand(command="export", description="📦 Выгрузка данных"),
         BotCommand(command="help", description="❓ Справка по командам"),
     ]
     
@@ -169,11 +184,7 @@ async def notify_admins_startup():
 Менеджеры могут начинать работу.
     """
     
-    for admin_id in settings.ADMIN_IDS:
-        try:
-            await bot.send_message(chat_id=admin_id, text=startup_message)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    await messenger.broadcast(settings.ADMIN_IDS, startup_message, parse_mode=ParseMode.MARKDOWN)
 
 async def notify_admins_shutdown():
     """Уведомление админов о завершении работы бота"""
@@ -187,11 +198,7 @@ async def notify_admins_shutdown():
 Перезапуск будет выполнен автоматически.
     """
     
-    for admin_id in settings.ADMIN_IDS:
-        try:
-            await bot.send_message(chat_id=admin_id, text=shutdown_message)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    await messenger.broadcast(settings.ADMIN_IDS, shutdown_message, parse_mode=ParseMode.MARKDOWN)
 
 async def main():
     """Основная функция запуска бота"""
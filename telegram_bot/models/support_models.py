@@ -39,6 +39,7 @@ class Application(Base):
     # Основная информация
     full_name = Column(String(255), nullable=False, comment="ФИО клиента")
     phone = Column(String(20), nullable=False, comment="Телефон клиента")
+    phone_normalized = Column(String(20), nullable=True, comment="Телефон в формате 7XXXXXXXXXX (поиск повторных заявок)")
     age = Column(Integer, nullable=True, comment="Возраст")
     city = Column(String(100), nullable=False, comment="Город")
     category = Column(String(50), nullable=False, comment="Категория: driver, courier, both, cargo")
@@ -145,6 +146,7 @@ class SupportChat(Base):
     client_telegram_id = Column(BigInteger, nullable=True, comment="Telegram ID клиента")
     client_name = Column(String(200), nullable=True, comment="Имя клиента")
     client_phone = Column(String(20), nullable=True, comment="Телефон клиента")
+    web_session_id = Column(String(100), nullable=True, comment="ID сессии веб-чата (для чатов с сайта)")
     
     manager_id = Column(Integer, ForeignKey("managers.id"), nullable=True, comment="Назначенный менеджер")
     application_id = Column(Integer, ForeignKey("applications.id"), nullable=True, comment="Связанная заявка")
@@ -214,6 +216,29 @@ class ManagerWorkSession(Base):
     # Связи
     manager = relationship("Manager")
 
+class ApplicationStatsMixin:
+    """Агрегаты заявок за интервал в разрезе категории, города и менеджера"""
+
+    bucket_start = Column(DateTime(timezone=True), primary_key=True, comment="Начало интервала (UTC)")
+    category = Column(String(50), primary_key=True, comment="Категория заявки")
+    city = Column(String(100), primary_key=True, comment="Город")
+    manager_id = Column(Integer, primary_key=True, default=0, comment="ID менеджера (0 - не назначен)")
+
+    # Поступившие заявки считаются по created_at, завершенные и отмененные - по processed_at
+    created_count = Column(Integer, nullable=False, default=0, comment="Поступило заявок")
+    completed_count = Column(Integer, nullable=False, default=0, comment="Завершено заявок")
+    cancelled_count = Column(Integer, nullable=False, default=0, comment="Отменено заявок")
+    processing_seconds = Column(BigInteger, nullable=False, default=0, comment="Суммарное время обработки завершенных (сек)")
+    processing_histogram = Column(JSON, nullable=True, comment="Гистограмма времени обработки по PROCESSING_BUCKETS")
+
+class ApplicationStatsHourly(ApplicationStatsMixin, Base):
+    """Почасовые агрегаты заявок"""
+    __tablename__ = "application_stats_hourly"
+
+class ApplicationStatsDaily(ApplicationStatsMixin, Base):
+    """Дневные агрегаты заявок (сумма почасовых)"""
+    __tablename__ = "application_stats_daily"
+
 # Индексы для оптимизации запросов
 from sqlalchemy import Index
 
@@ -221,15 +246,41 @@ from sqlalchemy import Index
 Index('idx_applications_status', Application.status)
 Index('idx_applications_created', Application.created_at)
 Index('idx_applications_phone', Application.phone)
+Index('idx_applications_phone_normalized_created', Application.phone_normalized, Application.created_at)
+Index('idx_applications_manager_processed', Application.assigned_manager_id, Application.processed_at)
+Index('idx_applications_processed', Application.processed_at)
+# Списки заявок в боте: курсор (created_at, id) после фильтра по менеджеру/статусу
+Index('idx_applications_manager_status_created', Application.assigned_manager_id, Application.status, Application.created_at, Application.id)
+Index('idx_applications_manager_created', Application.assigned_manager_id, Application.created_at, Application.id)
+Index('idx_applications_status_created', Application.status, Application.created_at, Application.id)
+Index(
+    'idx_applications_new_unassigned_created',
+    Application.created_at, Application.id,
+    postgresql_where=(Application.status == ApplicationStatus.NEW) & Application.assigned_manager_id.is_(None)
+)
+Index(
+    'idx_applications_open_created',
+    Application.created_at, Application.id,
+    postgresql_where=Application.status != ApplicationStatus.COMPLETED
+)
 
 # Индексы для менеджеров
 Index('idx_managers_telegram_id', Manager.telegram_id)
 Index('idx_managers_status', Manager.status)
 
+# Индекс для статистики рабочих смен
+Index('idx_work_sessions_manager_started', ManagerWorkSession.manager_id, ManagerWorkSession.started_at)
+
 # Индексы для чатов
 Index('idx_support_chats_active', SupportChat.is_active)
 Index('idx_support_chats_manager', SupportChat.manager_id)
 Index('idx_support_chats_created', SupportChat.created_at)
+# Поиск активного чата по веб-сессии (маршрутизация сообщений сайта)
+Index(
+    'idx_support_chats_web_session_active',
+    SupportChat.web_session_id,
+    postgresql_where=SupportChat.is_active == True
+)
 
 # Индексы для сообщений
 Index('idx_chat_messages_chat', ChatMessage.chat_id)
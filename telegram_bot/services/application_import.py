@@ -0,0 +1,165 @@
+"""
+Массовый импорт заявок из CSV/JSONL (таблицы партнеров, повтор неудачных отправок)
+Строки читаются потоком, проверяются по правилам /api/signup и вставляются пачками
+
+Запуск из корня проекта:
+    python -m telegram_bot.services.application_import leads.csv --batch-size 1000
+    python -m telegram_bot.services.application_import failed.jsonl --no-assign
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from telegram_bot.config.settings import settings
+from telegram_bot.services.application_service import application_service
+from telegram_bot.services.application_validation import validate_signup, ApplicationValidationError
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+# (номер строки, данные или None, ошибка разбора или None)
+Record = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def detect_format(name: str) -> Optional[str]:
+    """Формат по имени файла или Content-Type"""
+    name = (name or "").lower()
+    if "csv" in name:
+        return "csv"
+    if "jsonl" in name or "ndjson" in name or "json" in name:
+        return "jsonl"
+    return None
+
+
+def iter_records(stream: TextIO, fmt: str) -> Iterator[Record]:
+    """Построчное чтение CSV (заголовок - имена полей формы) или JSONL"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Пустые ячейки равносильны отсутствующим полям формы
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in (None, "")}, None
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Некорректный JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Строка должна быть JSON-объектом"
+            continue
+        yield line_number, record, None
+
+
+class ApplicationImporter:
+    """Проверка и пакетная вставка заявок"""
+
+    MAX_REPORTED_ERRORS = 100
+
+    def __init__(self, batch_size: int = 500, auto_assign: bool = True, source: str = "bulk_import"):
+        self.batch_size = max(1, batch_size)
+        self.auto_assign = auto_assign
+        self.source = source
+
+    async def run(self, records: Iterable[Record]) -> Dict[str, Any]:
+        """
+        Импортировать заявки
+
+        Returns:
+            Статистика: total, inserted, invalid, failed, assigned, seconds, rows_per_second, errors
+        """
+        stats = {"total": 0, "inserted": 0, "invalid": 0, "failed": 0, "assigned": 0}
+        errors: List[Dict[str, Any]] = []
+        inserted_ids: List[int] = []
+        batch: List[Dict[str, Any]] = []
+        batch_rows: List[int] = []
+        started = time.perf_counter()
+
+        def report(row: Any, error: str):
+            if len(errors) < self.MAX_REPORTED_ERRORS:
+                errors.append({"row": row, "error": error})
+
+        async def flush():
+            try:
+                ids = await application_service.create_applications_bulk(batch)
+                inserted_ids.extend(ids)
+                stats["inserted"] += len(ids)
+            except Exception as e:
+                stats["failed"] += len(batch)
+                report(f"{batch_rows[0]}-{batch_rows[-1]}", f"Ошибка записи пачки: {e}")
+            batch.clear()
+            batch_rows.clear()
+
+        for row_number, record, parse_error in records:
+            stats["total"] += 1
+
+            if parse_error:
+                stats["invalid"] += 1
+                report(row_number, parse_error)
+                continue
+
+            try:
+                batch.append(validate_signup(record, source=self.source))
+                batch_rows.append(row_number)
+            except ApplicationValidationError as e:
+                stats["invalid"] += 1
+                report(row_number, str(e))
+                continue
+
+            if len(batch) >= self.batch_size:
+                await flush()
+
+        if batch:
+            await flush()
+
+        if self.auto_assign and settings.AUTO_ASSIGN_MANAGERS and inserted_ids:
+            stats["assigned"] = await application_service.auto_assign_applications_bulk(inserted_ids)
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = round(elapsed, 3)
+        stats["rows_per_second"] = round(stats["inserted"] / elapsed) if elapsed > 0 else stats["inserted"]
+        stats["errors"] = errors
+
+        logger.info(
+            f"📥 Импорт заявок: {stats['inserted']}/{stats['total']} за {stats['seconds']}с "
+            f"({stats['rows_per_second']} строк/с), ошибок проверки: {stats['invalid']}, назначено: {stats['assigned']}"
+        )
+        return stats
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Массовый импорт заявок из CSV/JSONL")
+    parser.add_argument("path", help="Файл .csv или .jsonl")
+    parser.add_argument("--format", choices=FORMATS, help="формат файла (по умолчанию - по расширению)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--no-assign", action="store_true", help="не назначать менеджеров")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("не удалось определить формат, укажите --format")
+
+    importer = ApplicationImporter(batch_size=args.batch_size, auto_assign=not args.no_assign)
+    with open(args.path, "r", encoding="utf-8-sig", newline="") as f:
+        stats = await importer.run(iter_records(f, fmt))
+
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+    from telegram_bot.models.database import close_db
+    from telegram_bot.services.messenger import messenger
+    await messenger.close()
+    await close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
@@ -0,0 +1,239 @@
+"""
+Обработка заявок с сайта после сохранения в БД
+Эндпоинт только записывает заявку и ставит задачу в очередь уведомлений (Redis Stream);
+назначение менеджера и уведомления выполняют фоновые воркеры веб-процесса с повторами
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from telegram_bot.config.settings import settings
+from telegram_bot.models.database import AsyncSessionLocal
+from telegram_bot.models.support_models import Application
+from telegram_bot.services.application_service import application_service
+from telegram_bot.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryFailed(Exception):
+    """Уведомление по заявке не доставлено - задача будет доставлена воркеру повторно"""
+
+
+class ApplicationPipeline:
+    """Очередь пост-обработки новых заявок и пул воркеров"""
+
+    JOB_TYPE = "application_created"
+    IDEMPOTENCY_PREFIX = "signup_idempotency:"
+    STEP_PREFIX = "application_job:"
+    IDEMPOTENCY_TTL = 86400
+    # Метка "pending" живет несколько сроков сохранения заявки: если процесс упал между
+    # занятием ключа и записью ID, повтор с тем же ключом снова станет возможен
+    IDEMPOTENCY_PENDING_TTL = 30
+    STEP_TTL = 7 * 86400
+    LOCAL_MAX_ATTEMPTS = 5
+
+    def __init__(self):
+        self.workers = int(os.getenv("APPLICATION_WORKERS", "4"))
+        self._consumer_prefix = f"web-{socket.gethostname()}-{os.getpid()}"
+        self._local_queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    # Прием заявки
+
+    async def submit(self, application_data: Dict[str, Any], idempotency_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Сохранить заявку и поставить пост-обработку в очередь
+
+        Args:
+            application_data: Данные формы
+            idempotency_key: Ключ повторной отправки той же формы (заголовок Idempotency-Key)
+
+        Returns:
+            {"application_id", "duplicate", "in_progress"} или None, если заявку сохранить не удалось.
+            in_progress - первая отправка с тем же ключом еще сохраняется: успех сообщать рано,
+            клиент должен повторить запрос с тем же ключом
+        """
+        if idempotency_key:
+            existing = await self._claim_idempotency_key(idempotency_key)
+            if existing == 0:
+                logger.info(f"⏳ Заявка с ключом {idempotency_key} еще сохраняется, повторная отправка отложена")
+                return {"application_id": None, "duplicate": True, "in_progress": True}
+            if existing is not None:
+                logger.info(f"🔁 Повторная отправка заявки (ключ {idempotency_key}), новая заявка не создается")
+                return {"application_id": existing, "duplicate": True, "in_progress": False}
+
+        application, created = await application_service.create_or_merge_application(application_data)
+        if not application:
+            if idempotency_key:
+                await redis_service.delete_key(f"{self.IDEMPOTENCY_PREFIX}{idempotency_key}")
+            return None
+
+        if idempotency_key:
+            await redis_service.set_value(f"{self.IDEMPOTENCY_PREFIX}{idempotency_key}", str(application.id), self.IDEMPOTENCY_TTL)
+
+        # Повторная заявка с того же номера объединена с существующей - уведомления уже отправлялись
+        if created:
+            await self.enqueue(application.id)
+        return {"application_id": application.id, "duplicate": not created, "in_progress": False}
+
+    async def _claim_idempotency_key(self, idempotency_key: str) -> Optional[int]:
+        """
+        Занять ключ идемпотентности
+
+        Returns:
+            None если ключ новый, иначе ID уже созданной заявки (0 - заявка еще создается)
+        """
+        key = f"{self.IDEMPOTENCY_PREFIX}{idempotency_key}"
+        try:
+            if not redis_service.is_connected:
+                await redis_service.connect()
+
+            if await redis_service.redis_client.set(key, "pending", nx=True, ex=self.IDEMPOTENCY_PENDING_TTL):
+                return None
+
+            value = await redis_service.redis_client.get(key)
+            return int(value) if value and value.isdigit() else 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки ключа идемпотентности: {e}")
+            return None
+
+    async def enqueue(self, application_id: int):
+        """Поставить задачу пост-обработки заявки (Redis Stream, при недоступности - очередь процесса)"""
+        job = {"type": self.JOB_TYPE, "application_id": application_id}
+
+        if await redis_service.enqueue_notification(job):
+            return
+
+        logger.warning(f"⚠️ Redis недоступен, заявка #{application_id} обрабатывается через локальную очередь")
+        if self._local_queue is None:
+            self._local_queue = asyncio.Queue()
+        self._local_queue.put_nowait((job, 0))
+
+    # Обработка
+
+    async def _step_done(self, application_id: int, step: str) -> bool:
+        return await redis_service.exists(f"{self.STEP_PREFIX}{application_id}:{step}")
+
+    async def _mark_step(self, application_id: int, step: str, value: str = "1"):
+        await redis_service.set_value(f"{self.STEP_PREFIX}{application_id}:{step}", value, self.STEP_TTL)
+
+    async def _step_value(self, application_id: int, step: str) -> Any:
+        return await redis_service.get_value(f"{self.STEP_PREFIX}{application_id}:{step}")
+
+    async def _load_application(self, application_id: int) -> Optional[Application]:
+        async with AsyncSessionLocal() as session:
+            return await session.get(Application, application_id)
+
+    async def process(self, job: Dict[str, Any]) -> bool:
+        """
+        Обработать задачу: назначение менеджера и уведомления менеджера и админов
+
+        Выполненные шаги отмечаются в Redis, поэтому повторная доставка задачи
+        (сбой воркера, повтор после ошибки) не дублирует уведомления. Шаг уведомления
+        отмечается только после подтвержденной отправки.
+
+        Raises:
+            DeliveryFailed: Уведомление не доставлено (Telegram недоступен) - задачу нужно повторить
+        """
+        if job.get("type") != self.JOB_TYPE:
+            logger.warning(f"⚠️ Неизвестный тип задачи в очереди уведомлений: {job.get('type')}")
+            return True
+
+        application_id = job["application_id"]
+
+        if settings.AUTO_ASSIGN_MANAGERS and not await self._step_done(application_id, "assign"):
+            # Если свободных менеджеров нет, заявка остается новой и назначается позже
+            manager_telegram_id = await application_service.assign_to_available_manager(application_id)
+            await self._mark_step(application_id, "assign", str(manager_telegram_id or 0))
+
+        manager_telegram_id = await self._step_value(application_id, "assign")
+        if manager_telegram_id and not await self._step_done(application_id, "notify_manager"):
+            if not await application_service.notify_manager_about_new_application(int(manager_telegram_id), application_id):
+                raise DeliveryFailed(f"менеджер {manager_telegram_id} не уведомлен о заявке #{application_id}")
+            await self._mark_step(application_id, "notify_manager")
+
+        if not await self._step_done(application_id, "notify_admins"):
+            application = await self._load_application(application_id)
+            if application is None:
+                logger.warning(f"⚠️ Заявка #{application_id} не найдена, задача пропущена")
+                return True
+
+            # При повторе уведомление получают только те админы, кому оно еще не доставлено
+            pending_admins = [
+                admin_id for admin_id in settings.ADMIN_IDS
+                if not await self._step_done(application_id, f"notify_admin:{admin_id}")
+            ]
+            results = await application_service.notify_admins_about_new_application(application, pending_admins)
+            for admin_id, delivered in results.items():
+                if delivered:
+                    await self._mark_step(application_id, f"notify_admin:{admin_id}")
+
+            failed = [admin_id for admin_id, delivered in results.items() if not delivered]
+            if failed:
+                raise DeliveryFailed(f"админы {failed} не уведомлены о заявке #{application_id}")
+            await self._mark_step(application_id, "notify_admins")
+
+        logger.info(f"✅ Заявка #{application_id} обработана")
+        return True
+
+    async def _stream_worker(self, consumer: str):
+        while True:
+            try:
+                started = time.monotonic()
+                processed = await redis_service.consume_notifications(consumer, self.process, count=10)
+
+                # Пустой ответ без блокирующего ожидания - Redis недоступен, не крутим цикл вхолостую
+                if not processed and time.monotonic() - started < 0.1:
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка воркера заявок {consumer}: {e}")
+                await asyncio.sleep(1)
+
+    async def _local_worker(self):
+        while True:
+            job, attempts = await self._local_queue.get()
+            try:
+                await self.process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempts + 1 >= self.LOCAL_MAX_ATTEMPTS:
+                    logger.error(f"❌ Задача {job} не выполнена после {attempts + 1} попыток: {e}")
+                    continue
+
+                logger.warning(f"⚠️ Ошибка обработки {job}, повтор: {e}")
+                await asyncio.sleep(2 ** attempts)
+                self._local_queue.put_nowait((job, attempts + 1))
+
+    # Жизненный цикл
+
+    def start(self):
+        """Запустить пул воркеров (при старте веб-приложения)"""
+        if self._tasks:
+            return
+
+        if self._local_queue is None:
+            self._local_queue = asyncio.Queue()
+
+        for i in range(self.workers):
+            consumer = f"{self._consumer_prefix}-{i}"
+            self._tasks.append(asyncio.create_task(self._stream_worker(consumer)))
+        self._tasks.append(asyncio.create_task(self._local_worker()))
+
+        logger.info(f"✅ Запущено воркеров обработки заявок: {self.workers}")
+
+    async def stop(self):
+        """Остановить воркеры; необработанные задачи остаются в Redis Stream"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+# Глобальный экземпляр конвейера заявок
+application_pipeline = ApplicationPipeline()
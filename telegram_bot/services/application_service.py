@@ -3,16 +3,19 @@
 """
 import logging
 import asyncio
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import httpx
-from sqlalchemy import select
+from sqlalchemy import select, insert, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from telegram_bot.models.database import AsyncSessionLocal
 from telegram_bot.models.support_models import Application, ApplicationStatus
 from telegram_bot.services.manager_service import manager_service
 from telegram_bot.config.settings import settings
+from telegram_bot.services.messenger import messenger
+from telegram_bot.services.duplicate_filter import recent_phones
+from telegram_bot.services.application_validation import normalize_phone
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ParseMode
 
@@ -25,85 +28,56 @@ class ApplicationService:
         self.api_url = settings.FASTAPI_URL
         self.api_secret = settings.API_SECRET_KEY
     
-    async def create_application_from_api(self, application_data: Dict) -> Optional[Application]:
-        """Создать заявку из данных API сайта"""
+    # Незакрытые заявки, в которые объединяются повторные отправки формы
+    OPEN_STATUSES = [
+        ApplicationStatus.NEW,
+        ApplicationStatus.ASSIGNED,
+        ApplicationStatus.IN_PROGRESS,
+        ApplicationStatus.WAITING_CLIENT
+    ]
+    
+    async def create_application_from_api(self, application_data: Dict, auto_assign: bool = True) -> Optional[Application]:
+        """
+        Создать заявку из данных API сайта
+        
+        Args:
+            application_data: Данные формы
+            auto_assign: Сразу назначить менеджера (конвейер заявок делает это в фоне)
+        """
+        application, created = await self.create_or_merge_application(application_data)
+        
+        # Автоматически назначаем менеджера если включено (повторная заявка уже обрабатывается)
+        if application and created and auto_assign and settings.AUTO_ASSIGN_MANAGERS:
+            await self.auto_assign_application(application.id)
+        
+        return application
+    
+    async def create_or_merge_application(self, application_data: Dict) -> Tuple[Optional[Application], bool]:
+        """
+        Создать заявку или объединить ее с незакрытой заявкой с тем же номером за окно дедупликации
+        
+        Returns:
+            (заявка, True если создана новая) или (None, False) при ошибке
+        """
         async with AsyncSessionLocal() as session:
             try:
                 logger.info(f"📝 Создание заявки из данных: {application_data}")
                 
-                # Проверяем обязательные поля
-                full_name = application_data.get("full_name", "")
-                phone = application_data.get("phone", "")
-                age = application_data.get("age")
-                city = application_data.get("city", "")
-                category = application_data.get("category", "")
+                values = self._build_application_values(application_data)
+                if values is None:
+                    return None, False
                 
-                if not all([full_name, phone, age, city, category]):
-                    logger.error(f"❌ Отсутствуют обязательные поля: full_name={full_name}, phone={phone}, age={age}, city={city}, category={category}")
-                    return None
-                
-                # Обрабатываем массивы из чекбоксов
-                delivery_types = application_data.get("deliveryType", [])
-                if isinstance(delivery_types, str):
-                    delivery_types = [delivery_types]
-                
-                available_documents = application_data.get("documents", [])
-                if isinstance(available_documents, str):
-                    available_documents = [available_documents]
+                existing = await self._find_recent_duplicate(session, values["phone_normalized"])
+                if existing:
+                    self._merge_application(existing, values)
+                    await session.commit()
+                    await session.refresh(existing)
+                    
+                    logger.info(f"🔁 Повторная заявка от {values['phone']} объединена с заявкой #{existing.id}")
+                    return existing, False
                 
                 # Создаем новую заявку со всеми полями
-                new_application = Application(
-                    # Основная информация
-                    full_name=full_name,
-                    phone=phone,
-                    age=int(age) if age else None,
-                    city=city,
-                    category=category,
-                    email=application_data.get("email"),
-                    
-                    # Новые основные поля
-                    citizenship=application_data.get("citizenship"),
-                    work_status=application_data.get("workStatus"),
-                    preferred_time=application_data.get("preferredTime"),
-                    work_schedule=application_data.get("workSchedule"),
-                    comments=application_data.get("comments"),
-                    
-                    # Информация для водителей
-                    experience=application_data.get("experience"),
-                    has_driver_license=application_data.get("hasDriverLicense"),
-                    has_car=application_data.get("hasCar"),
-                    car_brand=application_data.get("carBrand"),
-                    car_model=application_data.get("carModel"),
-                    car_year=int(application_data.get("carYear")) if application_data.get("carYear") else None,
-                    car_class=application_data.get("carClass"),
-                    has_taxi_permit=application_data.get("hasTaxiPermit"),
-                    
-                    # Информация для курьеров
-                    transport=application_data.get("transport"),
-                    delivery_types=delivery_types if delivery_types else None,
-                    has_thermo_bag=application_data.get("hasThermoBag"),
-                    courier_license=application_data.get("courierLicense"),
-                    
-                    # Информация для грузовых
-                    load_capacity=application_data.get("loadCapacity"),
-                    truck_type=application_data.get("truckType"),
-                    cargo_license=application_data.get("cargoLicense"),
-                    
-                    # Документы и опыт
-                    work_experience=application_data.get("workExperience"),
-                    previous_platforms=application_data.get("previousPlatforms"),
-                    has_medical_cert=application_data.get("hasMedicalCert"),
-                    available_documents=available_documents if available_documents else None,
-                    
-                    # Согласия
-                    has_documents_confirmed=bool(application_data.get("hasDocuments")),
-                    agree_terms=bool(application_data.get("agreeTerms")),
-                    agree_marketing=bool(application_data.get("agreeMarketing")),
-                    
-                    # Дополнительная информация (для совместимости)
-                    additional_info=self._format_additional_info(application_data),
-                    status=ApplicationStatus.NEW
-                )
+                new_application = Application(**values)
                 
                 logger.info(f"📝 Объект заявки создан: {new_application}")
                 
@@ -111,20 +85,217 @@ class ApplicationService:
                 await session.commit()
                 await session.refresh(new_application)
                 
-                logger.info(f"✅ Создана новая заявка #{new_application.id} от {new_application.full_name}")
-                
-                # Автоматически назначаем менеджера если включено
-                if settings.AUTO_ASSIGN_MANAGERS:
-                    await self.auto_assign_application(new_application.id)
+                if values["phone_normalized"]:
+                    recent_phones.add(values["phone_normalized"])
                 
-                return new_application
+                logger.info(f"✅ Создана новая заявка #{new_application.id} от {new_application.full_name}")
+                return new_application, True
                 
             except Exception as e:
                 await session.rollback()
                 logger.error(f"❌ Ошибка создания заявки: {e}")
                 import traceback
                 logger.error(f"Полная ошибка: {traceback.format_exc()}")
-                return None
+                return None, False
+    
+    async def _sync_recent_phones(self, session: AsyncSession):
+        """Дополнить префильтр номерами заявок, созданных с прошлой синхронизации (в т.ч. другими процессами)"""
+        if not recent_phones.needs_sync():
+            return
+        
+        synced_at = datetime.utcnow()
+        result = await session.execute(
+            select(Application.phone_normalized).where(
+                Application.created_at >= recent_phones.sync_since(),
+                Application.phone_normalized.isnot(None)
+            )
+        )
+        recent_phones.add_many(result.scalars().all())
+        recent_phones.mark_synced(synced_at)
+    
+    async def _find_recent_duplicate(self, session: AsyncSession, phone_normalized: Optional[str]) -> Optional[Application]:
+        """
+        Незакрытая заявка с тем же номером за окно дедупликации (None - повтора нет)
+        
+        Берет транзакционную advisory-блокировку по номеру: одновременные отправки с одного
+        номера выполняются по очереди до commit, и вторая видит заявку, созданную первой.
+        """
+        if not phone_normalized:
+            return None
+        
+        await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(phone_normalized))))
+        await self._sync_recent_phones(session)
+        
+        # Номера нет в префильтре - среди заявок до последней синхронизации повтора нет,
+        # но другой процесс мог записать его позже: проверяем только этот короткий хвост по индексу
+        since = datetime.utcnow() - recent_phones.window
+        if not recent_phones.might_contain(phone_normalized):
+            since = max(since, recent_phones.sync_since())
+        
+        result = await session.execute(
+            select(Application)
+            .where(
+                Application.phone_normalized == phone_normalized,
+                Application.created_at >= since,
+                Application.status.in_(self.OPEN_STATUSES)
+            )
+            .order_by(Application.created_at.desc())
+            .limit(1)
+            .with_for_update()
+        )
+        return result.scalar_one_or_none()
+    
+    def _merge_application(self, existing: Application, values: Dict):
+        """Дополнить существующую заявку данными повторной отправки (заполненные поля не затираются)"""
+        for key, value in values.items():
+            if key in ("status", "comments", "additional_info"):
+                continue
+            
+            current = getattr(existing, key)
+            if isinstance(value, bool):
+                setattr(existing, key, bool(current) or value)
+            elif value not in (None, "", []) and current in (None, "", []):
+                setattr(existing, key, value)
+        
+        comments = values.get("comments")
+        if comments and comments not in (existing.comments or ""):
+            existing.comments = f"{existing.comments}\n{comments}" if existing.comments else comments
+        
+        note = f"🔁 Повторная отправка формы: {datetime.utcnow().strftime('%d.%m.%Y %H:%M')} UTC"
+        existing.additional_info = f"{existing.additional_info}\n{note}" if existing.additional_info else note
+    
+    async def create_applications_bulk(self, applications_data: List[Dict]) -> List[int]:
+        """
+        Создать пачку заявок одной транзакцией
+        
+        SQLAlchemy разбивает список на многострочные INSERT ... RETURNING id
+        (с учетом лимита параметров драйвера), поэтому на пачку уходит несколько запросов,
+        а не по запросу, commit и refresh на каждую заявку. Менеджеры не назначаются -
+        для этого есть auto_assign_applications_bulk.
+        
+        Returns:
+            ID созданных заявок в порядке входных данных
+        """
+        rows = [values for values in map(self._build_application_values, applications_data) if values is not None]
+        if not rows:
+            return []
+        
+        async with AsyncSessionLocal() as session:
+            try:
+                result = await session.execute(
+                    insert(Application).returning(Application.id, sort_by_parameter_order=True),
+                    rows
+                )
+                application_ids = list(result.scalars().all())
+                await session.commit()
+                
+                recent_phones.add_many(row["phone_normalized"] for row in rows)
+                return application_ids
+                
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Ошибка пакетного создания заявок ({len(rows)} шт.): {e}")
+                raise
+    
+    async def auto_assign_applications_bulk(self, application_ids: List[int]) -> int:
+        """
+        Распределить пачку заявок между онлайн-менеджерами
+        
+        Менеджер получает одно сводное уведомление вместо сообщения на каждую заявку.
+        
+        Returns:
+            Количество назначенных заявок
+        """
+        assignments = await manager_service.assign_applications_bulk(application_ids)
+        
+        for manager_telegram_id, assigned_ids in assignments.items():
+            text = (
+                f"📥 <b>Вам назначено заявок из импорта: {len(assigned_ids)}</b>\n\n"
+                f"Первые номера: {', '.join(f'#{app_id}' for app_id in assigned_ids[:10])}\n\n"
+                "Откройте раздел «Мои заявки» для обработки."
+            )
+            try:
+                await messenger.send_message(manager_telegram_id, text, parse_mode=ParseMode.HTML)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось уведомить менеджера {manager_telegram_id} об импорте: {e}")
+        
+        return sum(len(assigned_ids) for assigned_ids in assignments.values())
+    
+    def _build_application_values(self, application_data: Dict) -> Optional[Dict]:
+        """Значения колонок заявки из данных формы (None, если нет обязательных полей)"""
+        # Проверяем обязательные поля
+        full_name = application_data.get("full_name", "")
+        phone = application_data.get("phone", "")
+        age = application_data.get("age")
+        city = application_data.get("city", "")
+        category = application_data.get("category", "")
+        
+        if not all([full_name, phone, age, city, category]):
+            logger.error(f"❌ Отсутствуют обязательные поля: full_name={full_name}, phone={phone}, age={age}, city={city}, category={category}")
+            return None
+        
+        # Обрабатываем массивы из чекбоксов
+        delivery_types = application_data.get("deliveryType", [])
+        if isinstance(delivery_types, str):
+            delivery_types = [delivery_types]
+        
+        available_documents = application_data.get("documents", [])
+        if isinstance(available_documents, str):
+            available_documents = [available_documents]
+        
+        return dict(
+            # Основная информация
+            full_name=full_name,
+            phone=phone,
+            phone_normalized=normalize_phone(phone),
+            age=int(age) if age else None,
+            city=city,
+            category=category,
+            email=application_data.get("email"),
+            
+            # Новые основные поля
+            citizenship=application_data.get("citizenship"),
+            work_status=application_data.get("workStatus"),
+            preferred_time=application_data.get("preferredTime"),
+            work_schedule=application_data.get("workSchedule"),
+            comments=application_data.get("comments"),
+            
+            # Информация для водителей
+            experience=application_data.get("experience"),
+            has_driver_license=application_data.get("hasDriverLicense"),
+            has_car=application_data.get("hasCar"),
+            car_brand=application_data.get("carBrand"),
+            car_model=application_data.get("carModel"),
+            car_year=int(application_data.get("carYear")) if application_data.get("carYear") else None,
+            car_class=application_data.get("carClass"),
+            has_taxi_permit=application_data.get("hasTaxiPermit"),
+            
+            # Информация для курьеров
+            transport=application_data.get("transport"),
+            delivery_types=delivery_types if delivery_types else None,
+            has_thermo_bag=application_data.get("hasThermoBag"),
+            courier_license=application_data.get("courierLicense"),
+            
+            # Информация для грузовых
+            load_capacity=application_data.get("loadCapacity"),
+            truck_type=application_data.get("truckType"),
+            cargo_license=application_data.get("cargoLicense"),
+            
+            # Документы и опыт
+            work_experience=application_data.get("workExperience"),
+            previous_platforms=application_data.get("previousPlatforms"),
+            has_medical_cert=application_data.get("hasMedicalCert"),
+            available_documents=available_documents if available_documents else None,
+            
+            # Согласия
+            has_documents_confirmed=bool(application_data.get("hasDocuments")),
+            agree_terms=bool(application_data.get("agreeTerms")),
+            agree_marketing=bool(application_data.get("agreeMarketing")),
+            
+            # Дополнительная информация (для совместимости)
+            additional_info=self._format_additional_info(application_data),
+            status=ApplicationStatus.NEW
+        )
     
     def _format_additional_info(self, data: Dict) -> str:
         """Форматирование дополнительной информации из всех полей формы"""
@@ -316,50 +487,58 @@ class ApplicationService:
         
         return "\n".join(info_parts)
     
+    async def assign_to_available_manager(self, application_id: int) -> Optional[int]:
+        """
+        Назначить заявку доступному менеджеру без уведомления
+        
+        Returns:
+            telegram_id менеджера или None, если свободных менеджеров нет или назначить не удалось
+        """
+        available_manager = await manager_service.get_available_manager()
+        
+        if not available_manager:
+            logger.info(f"Нет доступных менеджеров для заявки #{application_id}")
+            return None
+        
+        success = await manager_service.assign_application_to_manager(
+            application_id, 
+            available_manager.telegram_id
+        )
+        
+        if not success:
+            logger.error(f"❌ Не удалось назначить заявку #{application_id}")
+            return None
+        
+        logger.info(f"✅ Заявка #{application_id} автоматически назначена менеджеру {available_manager.first_name}")
+        return available_manager.telegram_id
+    
     async def auto_assign_application(self, application_id: int) -> bool:
         """Автоматически назначить заявку доступному менеджеру"""
         try:
-            # Ищем доступного менеджера
-            available_manager = await manager_service.get_available_manager()
-            
-            if not available_manager:
-                logger.info(f"Нет доступных менеджеров для заявки #{application_id}")
+            manager_telegram_id = await self.assign_to_available_manager(application_id)
+            if manager_telegram_id is None:
                 return False
             
-            # Назначаем заявку
-            success = await manager_service.assign_application_to_manager(
-                application_id, 
-                available_manager.telegram_id
-            )
-            
-            if success:
-                logger.info(f"✅ Заявка #{application_id} автоматически назначена менеджеру {available_manager.first_name}")
-                
-                # Уведомляем менеджера
-                await self.notify_manager_about_new_application(available_manager.telegram_id, application_id)
-                return True
-            else:
-                logger.error(f"❌ Не удалось назначить заявку #{application_id}")
-                return False
+            # Уведомляем менеджера
+            await self.notify_manager_about_new_application(manager_telegram_id, application_id)
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Ошибка автоназначения заявки: {e}")
             return False
     
-    async def notify_manager_about_new_application(self, manager_telegram_id: int, application_id: int):
-        """Уведомить менеджера о новой заявке через Telegram"""
+    async def notify_manager_about_new_application(self, manager_telegram_id: int, application_id: int) -> bool:
+        """Уведомить менеджера о новой заявке через Telegram; True если сообщение доставлено"""
         try:
-            from aiogram import Bot
             from aiogram.enums import ParseMode
             from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
             from datetime import timezone, timedelta
 
-            bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-
             async with AsyncSessionLocal() as session:
                 application = await session.get(Application, application_id)
                 if not application:
-                    return
+                    logger.warning(f"⚠️ Заявка #{application_id} не найдена, менеджер не уведомлен")
+                    return False
 
                 phone_number_clean = ''.join(filter(str.isdigit, application.phone))
                 if len(phone_number_clean) == 11 and phone_number_clean.startswith('8'):
@@ -613,7 +792,7 @@ class ApplicationService:
                     ]
                 ])
                 
-                await bot.send_message(
+                await messenger.send_message(
                     chat_id=manager_telegram_id,
                     text=text,
                     reply_markup=keyboard,
@@ -621,11 +800,13 @@ class ApplicationService:
                 )
                 
                 logger.info(f"✅ Менеджер {manager_telegram_id} уведомлен о заявке #{application.id}")
+                return True
 
         except Exception as e:
             logger.error(f"❌ Ошибка уведомления менеджера: {e}")
             import traceback
             logger.error(f"Полная ошибка: {traceback.format_exc()}")
+            return False
     
     async def get_pending_applications(self, limit: int = 10) -> List[Application]:
         """Получить список новых заявок"""
@@ -642,16 +823,22 @@ class ApplicationService:
                 logger.error(f"❌ Ошибка получения заявок: {e}")
                 return []
     
-    async def notify_admins_about_new_application(self, application: Application):
-        """Уведомить админов о новой заявке"""
-        if not settings.ADMIN_IDS:
-            return
+    async def notify_admins_about_new_application(self, application: Application, admin_ids: Optional[List[int]] = None) -> Dict[int, bool]:
+        """
+        Уведомить админов о новой заявке
         
-        try:
-            from aiogram import Bot
-            
-            bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+        Args:
+            application: Заявка
+            admin_ids: Кому отправить (по умолчанию - всем ADMIN_IDS)
             
+        Returns:
+            ID админа -> доставлено ли уведомление
+        """
+        recipients = list(settings.ADMIN_IDS if admin_ids is None else admin_ids)
+        if not recipients:
+            return {}
+        
+        try:
             text = f"""
 📊 **НОВАЯ ЗАЯВКА В СИСТЕМЕ**
 
@@ -672,19 +859,16 @@ class ApplicationService:
                 [InlineKeyboardButton(text="👥 Все заявки", callback_data="new_applications")]
             ])
             
-            for admin_id in settings.ADMIN_IDS:
-                try:
-                    await bot.send_message(
-                        chat_id=admin_id, 
-                        text=text, 
-                        reply_markup=keyboard,
-                        parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    logger.warning(f"Не удалось отправить уведомление админу {admin_id}: {e}")
-                    
+            return await messenger.broadcast(
+                recipients,
+                text,
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+            
         except Exception as e:
             logger.error(f"❌ Ошибка уведомления админов: {e}")
+            return {admin_id: False for admin_id in recipients}
     
     def get_category_text(self, category: str) -> str:
         """Получить текстовое описание категории"""
@@ -712,10 +896,17 @@ application_service = ApplicationService()
 async def handle_new_application_from_site(application_data: Dict) -> bool:
     """Обработать новую заявку с сайта"""
     try:
-        # Создаем заявку в базе данных
-        application = await application_service.create_application_from_api(application_data)
+        # Создаем заявку в базе данных (повторная отправка объединяется с недавней заявкой)
+        application, created = await application_service.create_or_merge_application(application_data)
+        
+        if application and not created:
+            logger.info(f"🔁 Заявка с сайта объединена с #{application.id}, уведомления не отправляются")
+            return True
         
         if application:
+            if settings.AUTO_ASSIGN_MANAGERS:
+                await application_service.auto_assign_application(application.id)
+            
             # Уведомляем админов
             await application_service.notify_admins_about_new_application(application)
             
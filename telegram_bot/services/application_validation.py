@@ -0,0 +1,143 @@
+"""
+Валидация заявок на подключение
+Общие правила для формы /api/signup и массового импорта
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+REQUIRED_FIELDS = ["fullName", "phone", "age", "city", "category"]
+CATEGORIES = ["driver", "courier", "both", "cargo"]
+
+
+class ApplicationValidationError(ValueError):
+    """Заявка не прошла проверку; текст ошибки показывается пользователю"""
+
+
+def _as_list(value: Any) -> List[str]:
+    """Поля-массивы (чекбоксы формы); в CSV значения разделяются ";" или ","."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.replace(";", ",").split(",") if item.strip()]
+    return list(value)
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Номер в виде 7XXXXXXXXXX: +7 (900) 123-45-67, 8 900 1234567 и 9001234567 совпадают"""
+    digits = "".join(filter(str.isdigit, phone or ""))
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits.startswith("9"):
+        digits = "7" + digits
+    return digits or None
+
+
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on", "да")
+    return bool(value)
+
+
+def validate_signup(data: Dict[str, Any], source: str = "signup_page") -> Dict[str, Any]:
+    """
+    Проверить данные формы и привести их к формату заявки
+
+    Args:
+        data: Поля формы (имена как на странице подключения)
+        source: Источник заявки для метаданных
+
+    Returns:
+        Данные для ApplicationService
+
+    Raises:
+        ApplicationValidationError: Не заполнено обязательное поле или неверный формат
+    """
+    # Валидация обязательных полей
+    for field in REQUIRED_FIELDS:
+        if field not in data or not data[field]:
+            raise ApplicationValidationError(f"Поле {field} обязательно для заполнения")
+
+    category = data["category"]
+    if category not in CATEGORIES:
+        raise ApplicationValidationError(f"Неизвестная категория: {category}")
+
+    # Специальная валидация в зависимости от категории
+    if category in ["driver", "both", "cargo"]:
+        if "experience" not in data or not data["experience"]:
+            raise ApplicationValidationError("Для водителей обязательно указать стаж вождения")
+
+    if category in ["courier", "both"]:
+        if "transport" not in data or not data["transport"]:
+            raise ApplicationValidationError("Для курьеров обязательно указать вид транспорта")
+
+    if category == "cargo":
+        if "loadCapacity" not in data or not data["loadCapacity"]:
+            raise ApplicationValidationError("Для грузовых перевозок обязательно указать грузоподъемность")
+
+    try:
+        age = int(data["age"])
+    except (TypeError, ValueError):
+        raise ApplicationValidationError("Поле age должно быть числом")
+
+    car_year = data.get("carYear")
+    if car_year:
+        try:
+            int(car_year)
+        except (TypeError, ValueError):
+            raise ApplicationValidationError("Поле carYear должно быть числом")
+
+    return {
+        "id": f"app_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{category}",
+        "category": category,
+
+        # Основные поля (используем правильные имена полей из формы)
+        "full_name": data["fullName"],
+        "phone": data["phone"],
+        "age": age,
+        "city": data["city"],
+        "email": data.get("email", ""),
+
+        # Новые основные поля
+        "citizenship": data.get("citizenship"),
+        "workStatus": data.get("workStatus"),
+        "preferredTime": data.get("preferredTime"),
+        "workSchedule": data.get("workSchedule"),
+        "comments": data.get("comments"),
+
+        # Информация для водителей
+        "experience": data.get("experience"),
+        "hasDriverLicense": data.get("hasDriverLicense"),
+        "hasCar": data.get("hasCar"),
+        "carBrand": data.get("carBrand"),
+        "carModel": data.get("carModel"),
+        "carYear": car_year,
+        "carClass": data.get("carClass"),
+        "hasTaxiPermit": data.get("hasTaxiPermit"),
+
+        # Информация для курьеров
+        "transport": data.get("transport", ""),
+        "deliveryType": _as_list(data.get("deliveryType")),
+        "hasThermoBag": data.get("hasThermoBag"),
+        "courierLicense": data.get("courierLicense"),
+
+        # Информация для грузовых
+        "loadCapacity": data.get("loadCapacity", ""),
+        "truckType": data.get("truckType"),
+        "cargoLicense": data.get("cargoLicense"),
+
+        # Документы и опыт
+        "workExperience": data.get("workExperience"),
+        "previousPlatforms": data.get("previousPlatforms"),
+        "hasMedicalCert": data.get("hasMedicalCert"),
+        "documents": _as_list(data.get("documents")),
+
+        # Согласия
+        "hasDocuments": _as_bool(data.get("hasDocuments", False)),
+        "agreeTerms": _as_bool(data.get("agreeTerms", False)),
+        "agreeMarketing": _as_bool(data.get("agreeMarketing", False)),
+
+        # Метаданные
+        "status": "new",
+        "created_at": datetime.now().isoformat(),
+        "source": source
+    }
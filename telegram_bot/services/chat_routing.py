@@ -0,0 +1,154 @@
+"""
+Маршрутизация сообщений веб-чата: ИИ или живой менеджер
+Состояние хранится в памяти процесса и в Redis; передача чата менеджеру и закрытие чата
+явно обновляют его, поэтому обычное сообщение ИИ-чата не обращается к PostgreSQL
+"""
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from telegram_bot.services.redis_service import redis_service
+from telegram_bot.services.webchat_bus import webchat_bus
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRoutingService:
+    """Кэш состояния маршрутизации веб-сессий"""
+
+    KEY_PREFIX = "chat_route:"
+    CONTROL_INVALIDATE = "route_invalidate"
+
+    MANAGER_ROUTE_TTL = 86400  # Чат с менеджером живет не дольше веб-сессии
+    AI_ROUTE_TTL = 3600
+    LOCAL_TTL = 300  # Страховка на случай потерянного сигнала сброса
+    FAILED_LOOKUP_TTL = 5  # БД недоступна: не повторять запрос на каждое сообщение, но и не запоминать надолго
+
+    def __init__(self):
+        # session_id -> (истекает, маршрут); маршрут None означает обработку ИИ
+        self._local: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        webchat_bus.add_control_handler(self._on_control)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}{session_id}"
+
+    def _on_control(self, session_id: str, control: str):
+        if control == self.CONTROL_INVALIDATE:
+            self.forget(session_id)
+
+    def forget(self, session_id: str):
+        """Сбросить локальный кэш сессии (переподключение, сигнал от другого процесса)"""
+        self._local.pop(session_id, None)
+
+    def _remember(self, session_id: str, route: Optional[Dict[str, Any]], ttl: Optional[float] = None):
+        self._local[session_id] = (time.monotonic() + (ttl or self.LOCAL_TTL), route)
+
+    async def get_route(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Получить маршрут сессии
+
+        Returns:
+            {"chat_id", "client_name", "manager_name"} если чат передан менеджеру, иначе None
+        """
+        cached = self._local.get(session_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        try:
+            if not redis_service.is_connected:
+                await redis_service.connect()
+
+            raw = await redis_service.redis_client.get(self._key(session_id))
+            if raw is not None:
+                data = json.loads(raw)
+                route = data if data.get("mode") == "manager" else None
+                self._remember(session_id, route)
+                return route
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения маршрута сессии {session_id} из Redis: {e}")
+
+        # Состояние неизвестно (первое сообщение сессии, Redis очищен) - один запрос к БД
+        try:
+            route = await self._load_from_db(session_id)
+        except Exception as e:
+            # Ошибку БД нельзя считать маршрутом ИИ: в Redis не пишем, локально помним несколько секунд
+            logger.error(f"❌ Ошибка проверки передачи чата менеджеру (сессия {session_id}): {e}")
+            self._remember(session_id, None, ttl=self.FAILED_LOOKUP_TTL)
+            return None
+
+        await self._store(session_id, route)
+        return route
+
+    async def set_manager_route(self, session_id: str, chat_id: str, client_name: Optional[str], manager_name: Optional[str]):
+        """Чат передан менеджеру"""
+        route = {
+            "mode": "manager",
+            "chat_id": chat_id,
+            "client_name": client_name,
+            "manager_name": manager_name
+        }
+        await self._store(session_id, route)
+        await webchat_bus.publish_control(session_id, self.CONTROL_INVALIDATE)
+
+    async def set_ai_route(self, session_id: str):
+        """Чат с менеджером закрыт - сессия возвращается к ИИ"""
+        await self._store(session_id, None)
+        await webchat_bus.publish_control(session_id, self.CONTROL_INVALIDATE)
+
+    async def _store(self, session_id: str, route: Optional[Dict[str, Any]]):
+        self._remember(session_id, route)
+
+        try:
+            if not redis_service.is_connected:
+                await redis_service.connect()
+
+            if route:
+                await redis_service.redis_client.setex(self._key(session_id), self.MANAGER_ROUTE_TTL, json.dumps(route, ensure_ascii=False))
+            else:
+                await redis_service.redis_client.setex(self._key(session_id), self.AI_ROUTE_TTL, json.dumps({"mode": "ai"}))
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения маршрута сессии {session_id} в Redis: {e}")
+
+    async def _load_from_db(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Найти активный чат поддержки сессии в БД
+
+        Returns:
+            Маршрут менеджера или None, если активного чата нет
+
+        Raises:
+            Exception: Ошибка БД (не путать с отсутствием чата)
+        """
+        from telegram_bot.models.database import AsyncSessionLocal
+        from telegram_bot.models.support_models import SupportChat
+        from sqlalchemy import select
+        from sqlalchemy.orm import selectinload
+
+        async with AsyncSessionLocal() as session:
+            # Ищем активный чат поддержки с указанным web_session_id (частичный индекс по активным);
+            # если активных чатов несколько, маршрут ведет в самый новый
+            result = await session.execute(
+                select(SupportChat)
+                .options(selectinload(SupportChat.manager))
+                .where(
+                    SupportChat.web_session_id == session_id,
+                    SupportChat.is_active == True
+                )
+                .order_by(SupportChat.created_at.desc())
+                .limit(1)
+            )
+            support_chat = result.scalars().first()
+
+            if not support_chat:
+                return None
+
+            return {
+                "mode": "manager",
+                "chat_id": support_chat.chat_id,
+                "client_name": support_chat.client_name,
+                "manager_name": support_chat.manager.first_name if support_chat.manager else None
+            }
+
+# Глобальный экземпляр сервиса маршрутизации
+chat_routing = ChatRoutingService()
@@ -0,0 +1,245 @@
+"""
+Потоковая выгрузка заявок, чатов и сообщений для администраторов
+Строки читаются из PostgreSQL серверным курсором пачками и сразу пишутся в сжатый
+gzip-файл (CSV или JSONL), поэтому память не зависит от размера выгрузки.
+Файлы больше лимита Telegram на документ делятся на части.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from telegram_bot.models.database import AsyncSessionLocal
+from telegram_bot.models.support_models import Application, SupportChat, ChatMessage
+from telegram_bot.services.messenger import messenger
+
+logger = logging.getLogger(__name__)
+
+# Код набора -> (модель, название для администратора)
+EXPORT_DATASETS = {
+    "applications": (Application, "Заявки"),
+    "chats": (SupportChat, "Чаты поддержки"),
+    "messages": (ChatMessage, "Сообщения чатов"),
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def _plain_value(value: Any, for_csv: bool) -> Any:
+    """Значение колонки в виде, пригодном для CSV/JSON"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if for_csv and isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class _PartWriter:
+    """Запись строк в gzip-файлы с переходом на новую часть после max_part_bytes сжатых данных"""
+
+    def __init__(self, dataset: str, fmt: str, columns: List[str], max_part_bytes: int, directory: Optional[str]):
+        self.dataset = dataset
+        self.fmt = fmt
+        self.columns = columns
+        self.max_part_bytes = max_part_bytes
+        self.directory = directory
+        self.parts: List[str] = []
+        self._raw = None
+        self._text = None
+        self._csv = None
+
+    def _open_part(self):
+        fd, path = tempfile.mkstemp(prefix=f"export_{self.dataset}_", suffix=f".{self.fmt}.gz", dir=self.directory)
+        self._raw = os.fdopen(fd, "wb")
+        gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        self.parts.append(path)
+
+        if self.fmt == "csv":
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(self.columns)
+
+    def _close_part(self):
+        if self._text is not None:
+            # Закрытие обертки закрывает gzip-поток, но не файл под ним
+            self._text.close()
+            self._raw.close()
+            self._text = self._raw = self._csv = None
+
+    def write_rows(self, rows: Sequence[Sequence[Any]]):
+        """Записать пачку строк (вызывается в отдельном потоке)"""
+        if self._raw is None:
+            self._open_part()
+
+        if self.fmt == "csv":
+            self._csv.writerows([_plain_value(value, True) for value in row] for row in rows)
+        else:
+            for row in rows:
+                record = {column: _plain_value(value, False) for column, value in zip(self.columns, row)}
+                self._text.write(json.dumps(record, ensure_ascii=False, default=str))
+                self._text.write("\n")
+
+        # Размер проверяется по уже сжатым данным на диске, с запасом на буферы
+        if self._raw.tell() >= self.max_part_bytes:
+            self._close_part()
+
+    def close(self):
+        self._close_part()
+
+    def discard(self):
+        self._close_part()
+        remove_files(self.parts)
+        self.parts = []
+
+
+def remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DataExportService:
+    """Выгрузка наборов данных в файлы и отправка их администратору"""
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+        # Лимит Telegram на документ от бота - 50 МБ
+        self.max_part_bytes = int(os.getenv("EXPORT_MAX_PART_MB", "45")) * 1024 * 1024
+        self.directory = os.getenv("EXPORT_DIR") or None
+        self._running = set()  # chat_id администраторов с незавершенной выгрузкой
+        self._tasks = set()
+
+    async def export(
+        self,
+        dataset: str,
+        fmt: str = "csv",
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """
+        Выгрузить набор данных во временные gzip-файлы
+
+        Args:
+            dataset: Код набора из EXPORT_DATASETS
+            fmt: csv или jsonl
+            date_from: Начало периода по created_at (включительно)
+            date_to: Конец периода по created_at (не включительно)
+
+        Returns:
+            {"files", "rows", "bytes", "seconds"}; файлы удаляет вызывающий код
+        """
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Неизвестный набор данных: {dataset}")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+
+        model, _ = EXPORT_DATASETS[dataset]
+        columns = list(model.__table__.columns)
+
+        query = select(*columns)
+        if date_from is not None:
+            query = query.where(model.created_at >= date_from)
+        if date_to is not None:
+            query = query.where(model.created_at < date_to)
+        # Порядок по индексу created_at; yield_per включает серверный курсор
+        query = query.order_by(model.created_at, model.id).execution_options(yield_per=self.batch_size)
+
+        writer = _PartWriter(dataset, fmt, [column.name for column in columns], self.max_part_bytes, self.directory)
+        started = time.perf_counter()
+        rows = 0
+
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.stream(query)
+                async for batch in result.partitions(self.batch_size):
+                    # Сжатие и запись на диск не блокируют цикл событий бота
+                    await asyncio.to_thread(writer.write_rows, batch)
+                    rows += len(batch)
+            await asyncio.to_thread(writer.close)
+        except BaseException:
+            writer.discard()
+            raise
+
+        total_bytes = sum(os.path.getsize(path) for path in writer.parts)
+        elapsed = time.perf_counter() - started
+        logger.info(f"📦 Выгрузка {dataset}: {rows} строк, {len(writer.parts)} файлов, {total_bytes / 1024:.0f} КБ за {elapsed:.1f}с")
+        return {"files": writer.parts, "rows": rows, "bytes": total_bytes, "seconds": round(elapsed, 1)}
+
+    async def export_and_send(
+        self,
+        chat_id: int,
+        dataset: str,
+        fmt: str = "csv",
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ):
+        """Выгрузить набор и отправить файлы документами в чат администратора"""
+        title = EXPORT_DATASETS[dataset][1]
+        period = (
+            f"{date_from.strftime('%d.%m.%Y') if date_from else 'начала'} - "
+            f"{(date_to - timedelta(days=1)).strftime('%d.%m.%Y') if date_to else 'сегодня'}"
+        )
+        files: List[str] = []
+
+        try:
+            result = await self.export(dataset, fmt, date_from, date_to)
+            files = result["files"]
+
+            if not result["rows"]:
+                await messenger.send_message(chat_id, f"📭 {title}: нет данных за период {period}")
+                return
+
+            suffix = f"{(date_from or datetime.utcnow()).strftime('%Y%m%d')}_{datetime.utcnow().strftime('%H%M%S')}"
+            for number, path in enumerate(files, 1):
+                part = f"_part{number}" if len(files) > 1 else ""
+                await messenger.send_document(
+                    chat_id,
+                    path,
+                    filename=f"{dataset}_{suffix}{part}.{fmt}.gz",
+                    caption=(
+                        f"📦 {title} за период {period}\n"
+                        f"Строк: {result['rows']}, часть {number}/{len(files)}, выгрузка {result['seconds']}с"
+                    )
+                )
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка выгрузки {dataset}: {e}")
+            try:
+                await messenger.send_message(chat_id, f"❌ Не удалось выгрузить данные ({title}): {e}")
+            except Exception:
+                pass
+        finally:
+            remove_files(files)
+            self._running.discard(chat_id)
+
+    def start_export(self, chat_id: int, dataset: str, fmt: str = "csv", date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> bool:
+        """
+        Запустить выгрузку в фоне (обработчик кнопки сразу отвечает администратору)
+
+        Returns:
+            False, если у этого администратора уже идет выгрузка
+        """
+        if chat_id in self._running:
+            return False
+
+        self._running.add(chat_id)
+        task = asyncio.create_task(self.export_and_send(chat_id, dataset, fmt, date_from, date_to))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+# Глобальный экземпляр сервиса выгрузок
+data_export = DataExportService()
@@ -0,0 +1,108 @@
+"""
+Префильтр повторных заявок по номеру телефона
+Bloom-фильтр недавних номеров в памяти процесса: отрицательный ответ сужает проверку в БД
+до заявок, созданных после последней синхронизации фильтра, положительный проверяется
+индексированным запросом за все окно (ложные срабатывания ~1%)
+"""
+import hashlib
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Битовый Bloom-фильтр фиксированного размера"""
+
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        # Оптимальные размер и число хэшей для заданной вероятности ложного срабатывания
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RecentPhoneFilter:
+    """
+    Номера заявок за последнее окно дедупликации
+
+    Два поколения фильтра сменяются раз в окно, поэтому номер помнится не меньше окна.
+    Фильтр заполняется из БД при первом обращении и дополняется номерами, записанными
+    другими процессами, не реже чем раз в SYNC_INTERVAL секунд. Номера, записанные другими
+    процессами после sync_since(), фильтр еще не знает - их отсутствие проверяется в БД.
+    """
+
+    SYNC_INTERVAL = 60
+
+    def __init__(self):
+        self.window_hours = int(os.getenv("APPLICATION_DEDUP_WINDOW_HOURS", "24"))
+        self.capacity = int(os.getenv("APPLICATION_DEDUP_CAPACITY", "100000"))
+        self._current = BloomFilter(self.capacity)
+        self._previous = BloomFilter(self.capacity)
+        self._rotated_at = time.monotonic()
+        self._synced_at = None  # datetime (UTC) последней подгрузки из БД
+        self._synced_monotonic = 0.0
+
+    @property
+    def window(self) -> timedelta:
+        return timedelta(hours=self.window_hours)
+
+    def _rotate_if_needed(self):
+        if time.monotonic() - self._rotated_at >= self.window.total_seconds():
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity)
+            self._rotated_at = time.monotonic()
+
+    def add(self, phone_normalized: str):
+        self._rotate_if_needed()
+        self._current.add(phone_normalized)
+
+    def add_many(self, phones: Iterable[str]):
+        self._rotate_if_needed()
+        for phone in phones:
+            if phone:
+                self._current.add(phone)
+
+    def might_contain(self, phone_normalized: str) -> bool:
+        self._rotate_if_needed()
+        return phone_normalized in self._current or phone_normalized in self._previous
+
+    def needs_sync(self) -> bool:
+        return self._synced_at is None or time.monotonic() - self._synced_monotonic >= self.SYNC_INTERVAL
+
+    def sync_since(self) -> datetime:
+        """С какого момента подгружать номера из БД"""
+        if self._synced_at is None:
+            return datetime.utcnow() - self.window
+        # Небольшой запас на расхождение часов и незакоммиченные транзакции
+        return self._synced_at - timedelta(seconds=5)
+
+    def mark_synced(self, synced_at: datetime):
+        if self._synced_at is None:
+            logger.info(f"✅ Префильтр повторных заявок заполнен: {self._current.count} номеров")
+        self._synced_at = synced_at
+        self._synced_monotonic = time.monotonic()
+
+# Глобальный префильтр повторных заявок
+recent_phones = RecentPhoneFilter()
@@ -2,10 +2,11 @@
 Сервис для управления менеджерами поддержки
 """
 import logging
-from typing import List, Optional, Dict, Any
+import os
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func, desc, or_
+from sqlalchemy import select, update, and_, func, desc, or_, tuple_, text as sql_text
 from sqlalchemy.orm import selectinload
 from datetime import timezone
 
@@ -15,13 +16,22 @@ from telegram_bot.models.support_models import (
     SupportChat, ChatType, ManagerWorkSession, ChatMessage
 )
 from telegram_bot.services.redis_service import redis_service
+from telegram_bot.services.chat_routing import chat_routing
 from telegram_bot.config.settings import settings
+from telegram_bot.services.messenger import messenger
 
 logger = logging.getLogger(__name__)
 
 class ManagerService:
     """Сервис для управления менеджерами"""
     
+    BULK_ASSIGN_CHUNK = 5000
+    
+    # Кэш агрегатов статистики (экраны статистики не пересчитывают историю на каждое нажатие)
+    STATS_CACHE_PREFIX = "stats:"
+    STATS_CACHE_TTL = int(os.getenv("MANAGER_STATS_CACHE_TTL", "60"))
+    APPLICATIONS_COUNT_TTL = 60
+    
     async def register_manager(
         self, 
         telegram_id: int, 
@@ -119,6 +129,7 @@ class ManagerService:
                 await redis_service.set_manager_status(str(telegram_id), status.value)
                 
                 await session.commit()
+                await self._sync_load_index(manager)
                 logger.info(f"✅ Статус менеджера {manager.first_name} изменен на {status.value}")
                 return True
                 
@@ -128,46 +139,117 @@ class ManagerService:
                 return False
     
     async def get_available_manager(self) -> Optional[Manager]:
-        """Найти доступного менеджера для назначения"""
+        """Найти доступного менеджера для назначения заявки (без резервирования слота чата)"""
+        return await self._pick_manager(reserve=False)
+    
+    async def _sync_load_index(self, manager: Manager):
+        """Обновить запись менеджера в индексе загрузки после смены статуса"""
+        online = manager.is_active and manager.status == ManagerStatus.ONLINE
+        active_count = 0
+        if online:
+            active_count = await redis_service.count_manager_active_chats(str(manager.telegram_id))
+        
+        await redis_service.sync_manager_load(
+            str(manager.telegram_id),
+            online,
+            active_chats=active_count,
+            capacity=manager.max_active_chats or settings.MAX_ACTIVE_CHATS_PER_MANAGER
+        )
+    
+    async def _ensure_load_index(self):
+        """Пересобрать индекс загрузки из БД, если он пуст или устарел (рестарт Redis, расхождения)"""
+        if await redis_service.is_manager_load_index_built():
+            return
+        
         async with AsyncSessionLocal() as session:
-            try:
-                # Строим запрос для поиска доступных менеджеров
-                query = select(Manager).where(
+            result = await session.execute(
+                select(Manager).where(
                     and_(
                         Manager.is_active == True,
                         Manager.status == ManagerStatus.ONLINE
                     )
                 )
-                
-                # Исключаем определенных менеджеров если нужно
-                # if exclude_ids: # This line was removed from the new_code, so it's removed here.
-                #     query = query.where(~Manager.telegram_id.in_(exclude_ids))
-                
-                result = await session.execute(query)
-                managers = result.scalars().all()
-                
-                if not managers:
+            )
+            managers = result.scalars().all()
+        
+        entries = {}
+        for manager in managers:
+            entries[str(manager.telegram_id)] = (
+                await redis_service.count_manager_active_chats(str(manager.telegram_id)),
+                manager.max_active_chats or settings.MAX_ACTIVE_CHATS_PER_MANAGER
+            )
+        
+        await redis_service.rebuild_manager_load_index(entries)
+        logger.info(f"🔄 Индекс загрузки менеджеров пересобран: {len(entries)} онлайн")
+    
+    async def _pick_manager(self, reserve: bool) -> Optional[Manager]:
+        """
+        Выбрать наименее загруженного онлайн-менеджера одним обращением к индексу загрузки
+        
+        Args:
+            reserve: Атомарно занять слот чата у выбранного менеджера
+        """
+        try:
+            await self._ensure_load_index()
+            
+            # Запись индекса может устареть (менеджер деактивирован в обход сервиса) - пропускаем такие
+            for _ in range(3):
+                telegram_id = await redis_service.reserve_least_loaded_manager(
+                    settings.MAX_ACTIVE_CHATS_PER_MANAGER,
+                    reserve=reserve
+                )
+                if telegram_id is None:
+                    logger.warning("❌ Нет онлайн менеджеров со свободными слотами")
                     return None
                 
-                # Выбираем менеджера с наименьшим количеством активных чатов
-                best_manager = None
-                min_chats = float('inf')
-                
-                for manager in managers:
-                    active_chats = await redis_service.get_manager_active_chats(str(manager.telegram_id))
-                    active_count = len(active_chats)
-                    
-                    # Проверяем лимит активных чатов
-                    if active_count < manager.max_active_chats and active_count < min_chats:
-                        min_chats = active_count
-                        best_manager = manager
+                manager = await self.get_manager_by_telegram_id(int(telegram_id))
+                if manager and manager.is_active and manager.status == ManagerStatus.ONLINE:
+                    logger.info(f"🎯 Выбран менеджер: {manager.first_name}")
+                    return manager
                 
-                return best_manager
+                await redis_service.sync_manager_load(telegram_id, online=False)
+            
+            return None
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка выбора менеджера через индекс загрузки, используем БД: {e}")
+            return await self._pick_manager_from_db()
+    
+    async def _pick_manager_from_db(self) -> Optional[Manager]:
+        """Запасной выбор без Redis: загрузка по активным чатам в БД, один запрос"""
+        async with AsyncSessionLocal() as session:
+            try:
+                active_count = func.count(SupportChat.id)
+                result = await session.execute(
+                    select(Manager)
+                    .outerjoin(
+                        SupportChat,
+                        and_(
+                            SupportChat.manager_id == Manager.id,
+                            SupportChat.is_active == True
+                        )
+                    )
+                    .where(
+                        and_(
+                            Manager.is_active == True,
+                            Manager.status == ManagerStatus.ONLINE
+                        )
+                    )
+                    .group_by(Manager.id)
+                    .having(active_count < Manager.max_active_chats)
+                    .order_by(active_count)
+                    .limit(1)
+                )
+                return result.scalar_one_or_none()
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка поиска доступного менеджера: {e}")
                 return None
     
+    async def release_manager_chat_slot(self, telegram_id: int):
+        """Освободить слот чата менеджера (чат закрыт или не был создан)"""
+        await redis_service.release_manager_load(str(telegram_id))
+    
     async def assign_application_to_manager(
         self, 
         application_id: int, 
@@ -208,13 +290,152 @@ class ManagerService:
                 logger.error(f"❌ Ошибка назначения заявки: {e}")
                 return False
     
+    async def assign_applications_bulk(self, application_ids: List[int]) -> Dict[int, List[int]]:
+        """
+        Назначить пачку заявок онлайн-менеджерам поровну
+        
+        Один запрос на выбор менеджеров и по одному UPDATE на менеджера вместо
+        поиска и назначения для каждой заявки. Уже назначенные заявки пропускаются.
+        
+        Returns:
+            telegram_id менеджера -> ID назначенных ему заявок
+        """
+        if not application_ids:
+            return {}
+        
+        async with AsyncSessionLocal() as session:
+            try:
+                result = await session.execute(
+                    select(Manager).where(
+                        and_(
+                            Manager.is_active == True,
+                            Manager.status == ManagerStatus.ONLINE
+                        )
+                    ).order_by(Manager.total_applications)
+                )
+                managers = result.scalars().all()
+                
+                if not managers:
+                    logger.info(f"Нет онлайн менеджеров для {len(application_ids)} заявок")
+                    return {}
+                
+                # Круговое распределение, начиная с менеджера с наименьшим числом заявок
+                shares: Dict[int, List[int]] = {manager.id: [] for manager in managers}
+                for i, application_id in enumerate(application_ids):
+                    shares[managers[i % len(managers)].id].append(application_id)
+                
+                now = datetime.utcnow()
+                assignments: Dict[int, List[int]] = {}
+                
+                for manager in managers:
+                    ids = shares[manager.id]
+                    assigned_ids = []
+                    
+                    # IN-список ограничен лимитом параметров драйвера
+                    for start in range(0, len(ids), self.BULK_ASSIGN_CHUNK):
+                        updated = await session.execute(
+                            update(Application)
+                            .where(
+                                and_(
+                                    Application.id.in_(ids[start:start + self.BULK_ASSIGN_CHUNK]),
+                                    Application.assigned_manager_id.is_(None)
+                                )
+                            )
+                            .values(
+                                assigned_manager_id=manager.id,
+                                status=ApplicationStatus.ASSIGNED,
+                                assigned_at=now
+                            )
+                            .returning(Application.id)
+                        )
+                        assigned_ids.extend(updated.scalars().all())
+                    
+                    if not assigned_ids:
+                        continue
+                    
+                    await session.execute(
+                        update(Manager)
+                        .where(Manager.id == manager.id)
+                        .values(total_applications=Manager.total_applications + len(assigned_ids))
+                    )
+                    assignments[manager.telegram_id] = assigned_ids
+                
+                await session.commit()
+                
+                logger.info(f"✅ Назначено заявок: {sum(map(len, assignments.values()))} между {len(assignments)} менеджерами")
+                return assignments
+                
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Ошибка пакетного назначения заявок: {e}")
+                return {}
+    
+    def _applications_filter(self, manager: Manager, status: Optional[ApplicationStatus], show_all: bool):
+        """Условие выборки заявок для списков в боте"""
+        # Если запрашиваются новые заявки
+        if status == ApplicationStatus.NEW:
+            # Показываем неназначенные NEW заявки + незавершенные заявки этого менеджера
+            return or_(
+                # Неназначенные новые заявки
+                and_(
+                    Application.status == ApplicationStatus.NEW,
+                    Application.assigned_manager_id.is_(None)
+                ),
+                # Незавершенные заявки этого менеджера
+                and_(
+                    Application.assigned_manager_id == manager.id,
+                    Application.status.in_([
+                        ApplicationStatus.ASSIGNED, 
+                        ApplicationStatus.IN_PROGRESS
+                    ])
+                )
+            )
+        # Если запрашиваются заявки в работе
+        if status == ApplicationStatus.IN_PROGRESS:
+            return and_(
+                Application.assigned_manager_id == manager.id,
+                Application.status.in_([
+                    ApplicationStatus.ASSIGNED,
+                    ApplicationStatus.IN_PROGRESS
+                ])
+            )
+        # Если запрашиваются все заявки (для админа)
+        if show_all:
+            return Application.status != ApplicationStatus.COMPLETED
+        # Если status is None (мои заявки) - исключаем завершенные
+        if status is None:
+            return and_(
+                Application.assigned_manager_id == manager.id,
+                Application.status != ApplicationStatus.COMPLETED
+            )
+        # Все остальные конкретные статусы (включая COMPLETED):
+        # админ может видеть все заявки с этим статусом, обычный менеджер - только свои.
+        if manager.is_admin:
+            return Application.status == status
+        return and_(
+            Application.status == status,
+            Application.assigned_manager_id == manager.id
+        )
+    
+    def _apply_keyset(self, query, after: Optional[Tuple[datetime, int]], before: Optional[Tuple[datetime, int]]):
+        """Сортировка по (created_at, id) от новых к старым и условие курсора вместо OFFSET"""
+        key = tuple_(Application.created_at, Application.id)
+        if before is not None:
+            # Предыдущая страница: берем ближайшие более новые заявки и разворачиваем порядок в вызывающем коде
+            return query.where(key > tuple(before)).order_by(Application.created_at, Application.id)
+        if after is not None:
+            query = query.where(key < tuple(after))
+        return query.order_by(desc(Application.created_at), desc(Application.id))
+    
     async def get_manager_applications(
         self, 
         telegram_id: int, 
         status: Optional[ApplicationStatus] = None,
         limit: int = 10,
         offset: int = 0,
-        show_all: bool = False
+        show_all: bool = False,
+        after: Optional[Tuple[datetime, int]] = None,
+        before: Optional[Tuple[datetime, int]] = None
     ) -> List[Application]:
         """Получить заявки менеджера
         
@@ -222,8 +443,10 @@ class ManagerService:
             telegram_id: Telegram ID менеджера
             status: Статус заявок для фильтрации
             limit: Максимальное количество заявок
-            offset: Смещение для пагинации
+            offset: Смещение для пагинации (устаревшие кнопки; для новых используется курсор)
             show_all: Показать все заявки (как для админа)
+            after: Курсор (created_at, id) последней заявки страницы - следующая страница
+            before: Курсор (created_at, id) первой заявки страницы - предыдущая страница
         """
         async with AsyncSessionLocal() as session:
             try:
@@ -235,93 +458,90 @@ class ManagerService:
                 if not manager:
                     return []
                 
-                # Если запрашиваются новые заявки
-                if status == ApplicationStatus.NEW:
-                    # Показываем неназначенные NEW заявки + незавершенные заявки этого менеджера
-                    query = select(Application).where(
-                        or_(
-                            # Неназначенные новые заявки
-                            and_(
-                                Application.status == ApplicationStatus.NEW,
-                                Application.assigned_manager_id.is_(None)
-                            ),
-                            # Незавершенные заявки этого менеджера
-                            and_(
-                                Application.assigned_manager_id == manager.id,
-                                Application.status.in_([
-                                    ApplicationStatus.ASSIGNED, 
-                                    ApplicationStatus.IN_PROGRESS
-                                ])
-                            )
-                        )
-                    ).options(selectinload(Application.assigned_manager))
-                # Если запрашиваются заявки в работе
-                elif status == ApplicationStatus.IN_PROGRESS:
-                    query = select(Application).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status.in_([
-                                ApplicationStatus.ASSIGNED,
-                                ApplicationStatus.IN_PROGRESS
-                            ])
-                        )
-                    ).options(selectinload(Application.assigned_manager))
-                # Если запрашиваются все заявки (для админа)
-                elif show_all:
-                    query = select(Application).where(
-                        Application.status != ApplicationStatus.COMPLETED
-                    ).options(
-                        selectinload(Application.assigned_manager)
-                    )
-                # Если status is None (мои заявки) - исключаем завершенные
-                elif status is None:
-                    query = select(Application).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status != ApplicationStatus.COMPLETED
-                        )
-                    ).options(selectinload(Application.assigned_manager))
-                # Все остальные конкретные статусы (включая COMPLETED)
-                else:
-                    query = select(Application).where(
-                        Application.status == status
-                    ).options(selectinload(Application.assigned_manager))
-
-                    # Админ может видеть все заявки с этим статусом,
-                    # обычный менеджер - только свои.
-                    if not manager.is_admin:
-                         query = query.where(Application.assigned_manager_id == manager.id)
-
+                query = select(Application).where(
+                    self._applications_filter(manager, status, show_all)
+                ).options(selectinload(Application.assigned_manager))
+                
                 # Добавляем сортировку и пагинацию
-                query = query.order_by(desc(Application.created_at)).limit(limit).offset(offset)
-
+                query = self._apply_keyset(query, after, before).limit(limit)
+                if offset and after is None and before is None:
+                    query = query.offset(offset)
+                
                 result = await session.execute(query)
-                return result.scalars().all()
+                applications = list(result.scalars().all())
+                if before is not None:
+                    applications.reverse()
+                return applications
             except Exception as e:
                 logger.error(f"❌ Ошибка получения заявок менеджера: {e}")
                 return []
     
-    async def get_all_applications(self, limit: int = 20, offset: int = 0) -> tuple[List[Application], int]:
+    async def count_manager_applications(
+        self,
+        telegram_id: int,
+        status: Optional[ApplicationStatus] = None,
+        show_all: bool = False
+    ) -> int:
+        """Количество заявок в списке (кэшируется на APPLICATIONS_COUNT_TTL, для номера страницы)"""
+        cache_key = f"{self.STATS_CACHE_PREFIX}applications_count:{telegram_id}:{status.value if status else 'none'}:{int(show_all)}"
+        cached = await redis_service.get_value(cache_key)
+        if isinstance(cached, int):
+            return cached
+        
+        async with AsyncSessionLocal() as session:
+            try:
+                manager = await session.execute(
+                    select(Manager).where(Manager.telegram_id == telegram_id)
+                )
+                manager = manager.scalar_one_or_none()
+                if not manager:
+                    return 0
+                
+                result = await session.execute(
+                    select(func.count(Application.id)).where(self._applications_filter(manager, status, show_all))
+                )
+                count = result.scalar() or 0
+                
+                await redis_service.set_value(cache_key, count, self.APPLICATIONS_COUNT_TTL)
+                return count
+            except Exception as e:
+                logger.error(f"❌ Ошибка подсчета заявок менеджера: {e}")
+                return 0
+    
+    async def get_all_applications(
+        self,
+        limit: int = 20,
+        offset: int = 0,
+        after: Optional[Tuple[datetime, int]] = None
+    ) -> tuple[List[Application], int]:
         """Получить все заявки в системе (для админов и менеджеров)
         
         Args:
             limit: Максимальное количество заявок
-            offset: Смещение для пагинации
+            offset: Смещение для пагинации (если не задан курсор)
+            after: Курсор (created_at, id) последней заявки предыдущей страницы
             
         Returns:
-            Tuple[List[Application], int]: Список заявок и общее количество заявок
+            Tuple[List[Application], int]: Список заявок и примерное общее количество заявок
         """
         async with AsyncSessionLocal() as session:
             try:
-                # Получаем общее количество заявок для пагинации
-                total_count_query = select(func.count(Application.id))
-                total_count_result = await session.execute(total_count_query)
-                total_count = total_count_result.scalar() or 0
+                # Оценка числа строк из статистики планировщика вместо COUNT(*) по всей таблице
+                total_count = await redis_service.get_value(f"{self.STATS_CACHE_PREFIX}applications_total")
+                if not isinstance(total_count, int):
+                    estimate = await session.execute(
+                        sql_text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'applications'")
+                    )
+                    total_count = estimate.scalar() or 0
+                    # reltuples = -1/0 до первого ANALYZE - на маленькой таблице считаем точно
+                    if total_count <= 0:
+                        total_count = (await session.execute(select(func.count(Application.id)))).scalar() or 0
+                    await redis_service.set_value(f"{self.STATS_CACHE_PREFIX}applications_total", total_count, self.APPLICATIONS_COUNT_TTL)
                 
                 # Запрос с пагинацией
-                query = select(Application).order_by(desc(Application.created_at))
+                query = self._apply_keyset(select(Application), after, None)
                 
-                if offset > 0:
+                if offset > 0 and after is None:
                     query = query.offset(offset)
                 query = query.limit(limit)
                 
@@ -386,6 +606,7 @@ class ManagerService:
                 manager.last_seen = datetime.utcnow()
                 
                 await session.commit()
+                await self._sync_load_index(manager)
                 
                 logger.info(f"✅ Начата рабочая сессия для {manager.first_name}")
                 return True
@@ -428,6 +649,8 @@ class ManagerService:
                 await redis_service.set_manager_active_chats(str(telegram_id), [])
                 
                 await session.commit()
+                await self._sync_load_index(manager)
+                await self.invalidate_manager_stats(telegram_id)
                 
                 logger.info(f"✅ Завершена рабочая сессия для {manager.first_name}")
                 return True
@@ -449,41 +672,39 @@ class ManagerService:
                     return None
                 
                 # Активные чаты
-                active_chats = await redis_service.get_manager_active_chats(str(telegram_id))
-                
-                # Заявки за сегодня
-                today_utc = datetime.utcnow().date()
-                today_applications_query = await session.execute(
-                    select(func.count(Application.id)).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status == ApplicationStatus.COMPLETED,
-                            func.date(Application.processed_at) == today_utc
-                        )
+                active_chats = await redis_service.count_manager_active_chats(str(telegram_id))
+                
+                # Агрегаты из БД считаются одним запросом и кэшируются на STATS_CACHE_TTL
+                cache_key = f"{self.STATS_CACHE_PREFIX}manager:{telegram_id}"
+                aggregates = await redis_service.get_value(cache_key)
+                if not isinstance(aggregates, dict):
+                    now = datetime.utcnow()
+                    today_start = datetime.combine(now.date(), datetime.min.time())
+                    week_ago_utc = now - timedelta(days=7)
+                    completed = and_(
+                        Application.assigned_manager_id == manager.id,
+                        Application.status == ApplicationStatus.COMPLETED
                     )
-                )
-                today_count = today_applications_query.scalar() or 0
-                
-                # Подсчет времени работы по заявкам за неделю
-                week_ago_utc = datetime.utcnow() - timedelta(days=7)
-                completed_apps_week_query = await session.execute(
-                    select(Application).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status == ApplicationStatus.COMPLETED,
-                            Application.processed_at >= week_ago_utc,
-                            Application.assigned_at.isnot(None)
-                        )
-                    )
-                )
-                completed_apps_week = completed_apps_week_query.scalars().all()
-                
-                total_work_seconds = 0
-                for app in completed_apps_week:
-                    duration = app.processed_at - app.assigned_at
-                    total_work_seconds += duration.total_seconds()
-                
-                week_work_hours = round(total_work_seconds / 3600, 1)
+                    
+                    row = (await session.execute(
+                        select(
+                            # Диапазон вместо func.date(), чтобы работал индекс по processed_at
+                            func.count(Application.id).filter(Application.processed_at >= today_start).label("today"),
+                            func.coalesce(
+                                func.sum(func.extract("epoch", Application.processed_at - Application.assigned_at)).filter(
+                                    Application.processed_at >= week_ago_utc,
+                                    Application.assigned_at.isnot(None)
+                                ),
+                                0
+                            ).label("week_work_seconds")
+                        ).where(completed, Application.processed_at >= week_ago_utc)
+                    )).one()
+                    
+                    aggregates = {
+                        "today_applications": row.today or 0,
+                        "week_work_hours": round(float(row.week_work_seconds or 0) / 3600, 1)
+                    }
+                    await redis_service.set_value(cache_key, aggregates, self.STATS_CACHE_TTL)
 
                 # Конвертация времени последней активности в MSK
                 last_seen_msk = "Никогда"
@@ -495,12 +716,12 @@ class ManagerService:
                 return {
                     "manager_name": f"{manager.first_name} {manager.last_name or ''}".strip(),
                     "status": manager.status.value,
-                    "active_chats": len(active_chats),
+                    "active_chats": active_chats,
                     "max_chats": manager.max_active_chats,
                     "total_applications": manager.total_applications,
-                    "today_applications": today_count,
+                    "today_applications": aggregates["today_applications"],
                     "avg_response_time": manager.avg_response_time,
-                    "week_work_hours": week_work_hours,
+                    "week_work_hours": aggregates["week_work_hours"],
                     "last_seen": last_seen_msk
                 }
                 
@@ -543,6 +764,7 @@ class ManagerService:
         client_phone: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
         """Создать чат поддержки из веб-чата"""
+        available_manager = None
         async with AsyncSessionLocal() as session:
             try:
                 # Находим доступного менеджера с детальным логированием
@@ -562,8 +784,8 @@ class ManagerService:
                         logger.info(f"📊 Менеджер {mgr.first_name} (ID: {mgr.telegram_id}) - статус: {mgr.status.value}")
                         
                         # Проверяем активные чаты через Redis
-                        redis_chats = await redis_service.get_manager_active_chats(str(mgr.telegram_id))
-                        logger.info(f"📊 Redis чаты для {mgr.first_name}: {len(redis_chats)} (макс: {mgr.max_active_chats})")
+                        redis_chats = await redis_service.count_manager_active_chats(str(mgr.telegram_id))
+                        logger.info(f"📊 Redis чаты для {mgr.first_name}: {redis_chats} (макс: {mgr.max_active_chats})")
                         
                         # Проверяем активные чаты через БД
                         db_chats = [chat for chat in mgr.support_chats if chat.is_active]
@@ -588,6 +810,7 @@ class ManagerService:
                     chat_type=ChatType.TRANSFER_FROM_AI,
                     client_name=client_name,
                     client_phone=client_phone,
+                    web_session_id=session_id,
                     manager_id=available_manager.id,
                     is_active=True,
                     is_ai_handed_over=True,
@@ -627,74 +850,51 @@ class ManagerService:
                     "created_at": support_chat.created_at
                 }
                 
+                # Следующие сообщения сессии пойдут менеджеру без запроса к БД
+                await chat_routing.set_manager_route(
+                    session_id,
+                    chat_id=support_chat.chat_id,
+                    client_name=support_chat.client_name,
+                    manager_name=available_manager.first_name
+                )
+                
                 logger.info(f"✅ Создан чат поддержки {support_chat.chat_id} для сессии {session_id}")
                 return chat_data
                 
             except Exception as e:
                 await session.rollback()
+                # Слот был занят при выборе менеджера - возвращаем его
+                if available_manager:
+                    await self.release_manager_chat_slot(available_manager.telegram_id)
                 logger.error(f"❌ Ошибка создания чата поддержки: {e}")
                 import traceback
                 logger.error(f"Полная ошибка: {traceback.format_exc()}")
                 return None
     
     async def get_available_manager_for_chat(self) -> Optional[Manager]:
-        """Найти доступного менеджера для нового чата (используем Redis для корректного подсчета)"""
-        async with AsyncSessionLocal() as session:
-            try:
-                # Ищем онлайн менеджеров с наименьшей загрузкой
-                query = select(Manager).where(
-                    and_(
-                        Manager.is_active == True,
-                        Manager.status == ManagerStatus.ONLINE
-                    )
-                )
-                
-                result = await session.execute(query)
-                managers = result.scalars().all()
-                
-                if not managers:
-                    logger.info("❌ Нет онлайн менеджеров")
-                    return None
-                
-                # Находим менеджера с наименьшим количеством активных чатов (используем Redis)
-                best_manager = None
-                min_chats = float('inf')
-                
-                for manager in managers:
-                    # Используем Redis для актуального подсчета активных чатов
-                    active_chats = await redis_service.get_manager_active_chats(str(manager.telegram_id))
-                    active_count = len(active_chats)
-                    
-                    logger.info(f"🔍 Менеджер {manager.first_name}: {active_count}/{manager.max_active_chats} чатов")
-                    
-                    # Проверяем лимит активных чатов
-                    if active_count < manager.max_active_chats and active_count < min_chats:
-                        min_chats = active_count
-                        best_manager = manager
-                        logger.info(f"✅ Потенциальный кандидат: {manager.first_name} с {active_count} чатами")
-                
-                if best_manager:
-                    logger.info(f"🎯 Выбран менеджер: {best_manager.first_name} с {min_chats} активными чатами")
-                else:
-                    logger.warning("❌ Все менеджеры заняты (достигнут лимит чатов)")
-                
-                return best_manager
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка поиска доступного менеджера: {e}")
-                import traceback
-                logger.error(f"Полная ошибка: {traceback.format_exc()}")
-                return None
+        """
+        Найти доступного менеджера для нового чата
+        
+        Выбор и резервирование слота - одна атомарная операция в Redis, поэтому
+        одновременные передачи чатов не превышают лимит менеджера.
+        """
+        return await self._pick_manager(reserve=True)
     
     async def notify_manager_new_chat_by_data(self, manager_telegram_id: int, chat_data: Dict[str, Any], chat_history: List[Dict[str, Any]] = None):
         """Уведомить менеджера о новом чате (используя данные чата)"""
+        # Чат уже создан и занимает слот, выбранный при выборе менеджера: регистрируем его в активных
+        # до отправки уведомления, иначе при ошибке отправки слот не освободится при закрытии чата
+        added = await redis_service.add_manager_active_chat(
+            str(manager_telegram_id), 
+            chat_data['chat_id']
+        )
+        if not added:
+            await self.release_manager_chat_slot(manager_telegram_id)
+        
         try:
-            from aiogram import Bot
             from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
             from aiogram.enums import ParseMode
             
-            bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-            
             # Подготавливаем историю чата
             history_text = ""
             if chat_history:
@@ -741,19 +941,13 @@ class ManagerService:
             
             keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
             
-            await bot.send_message(
+            await messenger.send_message(
                 chat_id=manager_telegram_id,
                 text=text,
                 reply_markup=keyboard,
                 parse_mode=ParseMode.MARKDOWN
             )
             
-            # Добавляем чат в активные чаты менеджера в Redis
-            await redis_service.add_manager_active_chat(
-                str(manager_telegram_id), 
-                chat_data['chat_id']
-            )
-            
             logger.info(f"✅ Менеджер {manager_telegram_id} уведомлен о новом чате {chat_data['chat_id']}")
             
         except Exception as e:
@@ -769,7 +963,6 @@ class ManagerService:
     ) -> bool:
         """Отправить сообщение от веб-клиента менеджеру в Telegram"""
         try:
-            from aiogram import Bot
             from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
             
             logger.info(f"▶️ Попытка отправить сообщение от клиента в чат {chat_id}")
@@ -791,8 +984,6 @@ class ManagerService:
                     logger.warning(f"⚠️ Попытка отправить сообщение в неактивный чат {chat_id}. Процесс остановлен.")
                     return False
                 
-                bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-                
                 # Обрезаем длинное сообщение
                 display_message = message_text
                 if len(message_text) > 1000:
@@ -828,7 +1019,7 @@ class ManagerService:
                 ])
                 
                 logger.info(f"✉️ Отправка сообщения в Telegram менеджеру {support_chat.manager.telegram_id} для чата {chat_id}")
-                await bot.send_message(
+                await messenger.send_message(
                     chat_id=support_chat.manager.telegram_id,
                     text=text,
                     reply_markup=keyboard,
@@ -863,7 +1054,12 @@ class ManagerService:
             return False
     
     async def get_manager_detailed_stats(self, telegram_id: int) -> Optional[Dict[str, Any]]:
-        """Получить детальную статистику менеджера"""
+        """Получить детальную статистику менеджера (один агрегирующий запрос, кэш на STATS_CACHE_TTL)"""
+        cache_key = f"{self.STATS_CACHE_PREFIX}manager_detailed:{telegram_id}"
+        cached = await redis_service.get_value(cache_key)
+        if isinstance(cached, dict):
+            return cached
+        
         async with AsyncSessionLocal() as session:
             try:
                 manager = await session.execute(
@@ -873,158 +1069,113 @@ class ManagerService:
                 if not manager:
                     return None
                 
-                # Общая статистика
-                total_apps = await session.execute(
-                    select(func.count(Application.id)).where(
-                        Application.assigned_manager_id == manager.id
-                    )
-                )
-                total_applications = total_apps.scalar() or 0
-                
-                # Завершенные заявки
-                completed_apps = await session.execute(
-                    select(func.count(Application.id)).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status == ApplicationStatus.COMPLETED
-                        )
-                    )
-                )
-                completed_applications = completed_apps.scalar() or 0
-                
-                # Отмененные заявки
-                cancelled_apps = await session.execute(
-                    select(func.count(Application.id)).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.status == ApplicationStatus.CANCELLED
-                        )
-                    )
-                )
-                cancelled_applications = cancelled_apps.scalar() or 0
-                
-                # За месяц
                 month_ago = datetime.utcnow() - timedelta(days=30)
-                month_apps = await session.execute(
-                    select(func.count(Application.id)).where(
-                        and_(
-                            Application.assigned_manager_id == manager.id,
-                            Application.processed_at >= month_ago
-                        )
-                    )
-                )
-                month_applications = month_apps.scalar() or 0
                 
-                # Часы работы за месяц
-                month_sessions = await session.execute(
-                    select(ManagerWorkSession).where(
-                        and_(
-                            ManagerWorkSession.manager_id == manager.id,
-                            ManagerWorkSession.started_at >= month_ago
-                        )
+                # Часы работы за месяц (только завершенные сессии)
+                month_work_seconds = select(
+                    func.coalesce(
+                        func.sum(func.extract("epoch", ManagerWorkSession.ended_at - ManagerWorkSession.started_at)),
+                        0
                     )
-                )
-                month_sessions = month_sessions.scalars().all()
-                
-                month_work_time = 0
-                for session_obj in month_sessions:
-                    if session_obj.ended_at:
-                        work_time = (session_obj.ended_at - session_obj.started_at).total_seconds()
-                        month_work_time += work_time
+                ).where(
+                    ManagerWorkSession.manager_id == manager.id,
+                    ManagerWorkSession.started_at >= month_ago,
+                    ManagerWorkSession.ended_at.isnot(None)
+                ).scalar_subquery()
+                
+                # Рейтинг среди активных менеджеров по общему числу заявок
+                rank = select(func.count(Manager.id) + 1).where(
+                    Manager.is_active == True,
+                    Manager.total_applications > manager.total_applications
+                ).scalar_subquery()
+                total_managers = select(func.count(Manager.id)).where(Manager.is_active == True).scalar_subquery()
+                
+                row = (await session.execute(
+                    select(
+                        func.count(Application.id).label("total"),
+                        func.count(Application.id).filter(Application.status == ApplicationStatus.COMPLETED).label("completed"),
+                        func.count(Application.id).filter(Application.status == ApplicationStatus.CANCELLED).label("cancelled"),
+                        func.count(Application.id).filter(Application.processed_at >= month_ago).label("month"),
+                        month_work_seconds.label("month_work_seconds"),
+                        rank.label("rank"),
+                        total_managers.label("total_managers")
+                    ).where(Application.assigned_manager_id == manager.id)
+                )).one()
+                
+                total_applications = row.total or 0
+                completed_applications = row.completed or 0
                 
                 # Процент успеха
                 success_rate = round((completed_applications / max(total_applications, 1)) * 100, 1)
                 
-                # Рейтинг среди менеджеров
-                all_managers = await session.execute(
-                    select(Manager).where(Manager.is_active == True)
-                    .order_by(desc(Manager.total_applications))
-                )
-                all_managers = all_managers.scalars().all()
-                
-                rank = 1
-                for i, mgr in enumerate(all_managers, 1):
-                    if mgr.id == manager.id:
-                        rank = i
-                        break
-                
-                return {
+                stats = {
                     "manager_name": f"{manager.first_name} {manager.last_name or ''}".strip(),
                     "total_applications": total_applications,
                     "completed_applications": completed_applications,
-                    "cancelled_applications": cancelled_applications,
+                    "cancelled_applications": row.cancelled or 0,
                     "success_rate": success_rate,
-                    "month_applications": month_applications,
-                    "month_work_hours": round(month_work_time / 3600, 1),
+                    "month_applications": row.month or 0,
+                    "month_work_hours": round(float(row.month_work_seconds or 0) / 3600, 1),
                     "avg_response_time": manager.avg_response_time,
-                    "rank": rank,
-                    "total_managers": len(all_managers),
+                    "rank": row.rank,
+                    "total_managers": row.total_managers,
                     "client_rating": 4.5  # Пока захардкодим, потом можно добавить систему оценок
                 }
                 
+                await redis_service.set_value(cache_key, stats, self.STATS_CACHE_TTL)
+                return stats
+                
             except Exception as e:
                 logger.error(f"❌ Ошибка получения детальной статистики: {e}")
                 return None
     
+    async def invalidate_manager_stats(self, telegram_id: int):
+        """Сбросить кэш статистики менеджера (после изменения его заявок или смены)"""
+        await redis_service.delete_key(f"{self.STATS_CACHE_PREFIX}manager:{telegram_id}")
+        await redis_service.delete_key(f"{self.STATS_CACHE_PREFIX}manager_detailed:{telegram_id}")
+    
     async def get_system_stats(self) -> Dict[str, Any]:
-        """Получить общую статистику системы для админов"""
+        """Получить общую статистику системы для админов (одним запросом из скалярных подзапросов)"""
         async with AsyncSessionLocal() as session:
             try:
-                # Общее количество менеджеров
-                total_managers = await session.execute(
-                    select(func.count(Manager.id)).where(Manager.is_active == True)
-                )
-                total_managers = total_managers.scalar() or 0
-                
-                # Менеджеры онлайн
-                online_managers = await session.execute(
-                    select(func.count(Manager.id)).where(
-                        and_(
+                now = datetime.utcnow()
+                # Диапазоны вместо func.date(), чтобы работали индексы по created_at/processed_at
+                today_start = datetime.combine(now.date(), datetime.min.time())
+                hour_ago = now - timedelta(hours=1)
+                
+                row = (await session.execute(
+                    select(
+                        # Общее количество менеджеров
+                        select(func.count(Manager.id)).where(Manager.is_active == True)
+                        .scalar_subquery().label("total_managers"),
+                        # Менеджеры онлайн
+                        select(func.count(Manager.id)).where(
                             Manager.is_active == True,
                             Manager.status.in_([ManagerStatus.ONLINE, ManagerStatus.BUSY])
-                        )
-                    )
-                )
-                online_managers = online_managers.scalar() or 0
-                
-                # Активные чаты (из Redis или подсчет через базу)
-                active_chats = 0  # Можно подсчитать через Redis
-                
-                # Заявки за сегодня
-                today = datetime.utcnow().date()
-                today_applications = await session.execute(
-                    select(func.count(Application.id)).where(
-                        func.date(Application.created_at) == today
-                    )
-                )
-                today_applications = today_applications.scalar() or 0
-                
-                # За последний час
-                hour_ago = datetime.utcnow() - timedelta(hours=1)
-                hour_applications = await session.execute(
-                    select(func.count(Application.id)).where(
-                        Application.created_at >= hour_ago
-                    )
-                )
-                hour_applications = hour_applications.scalar() or 0
-                
-                hour_completed = await session.execute(
-                    select(func.count(Application.id)).where(
-                        and_(
+                        ).scalar_subquery().label("online_managers"),
+                        # Активные чаты
+                        select(func.count(SupportChat.id)).where(SupportChat.is_active == True)
+                        .scalar_subquery().label("active_chats"),
+                        # Заявки за сегодня (UTC)
+                        select(func.count(Application.id)).where(Application.created_at >= today_start)
+                        .scalar_subquery().label("today_applications"),
+                        # За последний час
+                        select(func.count(Application.id)).where(Application.created_at >= hour_ago)
+                        .scalar_subquery().label("hour_applications"),
+                        select(func.count(Application.id)).where(
                             Application.processed_at >= hour_ago,
                             Application.status == ApplicationStatus.COMPLETED
-                        )
+                        ).scalar_subquery().label("hour_completed")
                     )
-                )
-                hour_completed = hour_completed.scalar() or 0
+                )).one()
                 
                 return {
-                    "total_managers": total_managers,
-                    "online_managers": online_managers,
-                    "active_chats": active_chats,
-                    "today_applications": today_applications,
-                    "hour_applications": hour_applications,
-                    "hour_completed": hour_completed
+                    "total_managers": row.total_managers or 0,
+                    "online_managers": row.online_managers or 0,
+                    "active_chats": row.active_chats or 0,
+                    "today_applications": row.today_applications or 0,
+                    "hour_applications": row.hour_applications or 0,
+                    "hour_completed": row.hour_completed or 0
                 }
                 
             except Exception as e:
@@ -0,0 +1,205 @@
+"""
+Исходящие сообщения в Telegram через один долгоживущий Bot на процесс
+В процессе бота используется экземпляр из telegram_bot.main, в веб-процессе
+Bot создается при первой отправке; HTTP-сессия (пул соединений) переиспользуется
+
+Отправка ограничена лимитами Telegram (~30 сообщений/с на бота и 1/с в один чат),
+рассылки выполняются параллельно с ограничением конкурентности
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from telegram_bot.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket с резервированием в долг
+
+    reserve() сразу забирает токен и возвращает, сколько нужно подождать до отправки,
+    поэтому одновременные отправители выстраиваются в очередь без блокировок.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def idle_since(self, now: float) -> bool:
+        """Бакет восстановился полностью - его можно удалить"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class MessengerService:
+    """Общий Bot для уведомлений менеджерам и админам"""
+
+    MAX_RETRIES = 3
+    CHAT_BUCKETS_LIMIT = 10000
+
+    def __init__(self):
+        self._bot = None
+        self._owns_bot = False  # Bot создан сервисом, а не зарегистрирован процессом бота
+        self._lock = asyncio.Lock()
+        self.pool_size = int(os.getenv("TELEGRAM_SEND_POOL_SIZE", "100"))
+        self.upload_timeout = int(os.getenv("TELEGRAM_UPLOAD_TIMEOUT", "300"))
+
+        global_rate = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+        self.chat_rate = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "20")))
+
+    def attach(self, bot):
+        """Зарегистрировать Bot процесса (его сессию закрывает владелец)"""
+        self._bot = bot
+        self._owns_bot = False
+
+    async def get_bot(self):
+        """Общий экземпляр Bot (создается при первом обращении)"""
+        if self._bot is not None:
+            return self._bot
+
+        async with self._lock:
+            if self._bot is None:
+                from aiogram import Bot
+                from aiogram.client.session.aiohttp import AiohttpSession
+
+                self._bot = Bot(
+                    token=settings.TELEGRAM_BOT_TOKEN,
+                    session=AiohttpSession(limit=self.pool_size)
+                )
+                self._owns_bot = True
+                logger.info(f"✅ Создан общий Bot для исходящих сообщений (пул {self.pool_size} соединений)")
+
+        return self._bot
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.CHAT_BUCKETS_LIMIT:
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.idle_since(now)
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    async def _send(self, chat_id: int, method: str, **kwargs: Any):
+        """
+        Вызвать метод Bot с учетом лимитов; при TelegramRetryAfter - повтор после паузы (до MAX_RETRIES раз)
+
+        Ожидание лимитов и паузы TelegramRetryAfter проходят вне семафора: медленный чат
+        не занимает слоты конкурентности, нужные отправкам в другие чаты.
+        """
+        from aiogram.exceptions import TelegramRetryAfter
+
+        bot = await self.get_bot()
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            # Сначала лимит чата, затем общий: ожидающий чат не расходует общие токены заранее
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delay = self._global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                async with self._semaphore:
+                    return await getattr(bot, method)(chat_id=chat_id, **kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                logger.warning(f"⚠️ Лимит Telegram для чата {chat_id}, повтор через {e.retry_after}с")
+                await asyncio.sleep(e.retry_after)
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: Optional[str] = None, **kwargs: Any):
+        """
+        Отправить сообщение с учетом лимитов Telegram
+
+        parse_mode передается явно: у Bot процесса бота режим разметки по умолчанию - Markdown,
+        у созданного здесь - не задан. При TelegramRetryAfter отправка повторяется после
+        указанной паузы (до MAX_RETRIES раз), остальные ошибки пробрасываются.
+        """
+        return await self._send(chat_id, "send_message", text=text, parse_mode=parse_mode, **kwargs)
+
+    async def send_document(
+        self,
+        chat_id: int,
+        path: str,
+        filename: Optional[str] = None,
+        caption: Optional[str] = None,
+        parse_mode: Optional[str] = None,
+        **kwargs: Any
+    ):
+        """Отправить файл с диска документом (файл читается потоком, не загружается в память)"""
+        from aiogram.types import FSInputFile
+
+        kwargs.setdefault("request_timeout", self.upload_timeout)
+        return await self._send(
+            chat_id,
+            "send_document",
+            document=FSInputFile(path, filename=filename),
+            caption=caption,
+            parse_mode=parse_mode,
+            **kwargs
+        )
+
+    async def broadcast(
+        self,
+        chat_ids: Iterable[int],
+        text: str,
+        parse_mode: Optional[str] = None,
+        **kwargs: Any
+    ) -> Dict[int, bool]:
+        """
+        Разослать сообщение нескольким получателям параллельно
+
+        Returns:
+            chat_id -> доставлено ли сообщение
+        """
+        recipients = list(dict.fromkeys(chat_ids))
+
+        async def deliver(chat_id: int) -> bool:
+            try:
+                await self.send_message(chat_id, text, parse_mode=parse_mode, **kwargs)
+                return True
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось отправить сообщение в чат {chat_id}: {e}")
+                return False
+
+        results = await asyncio.gather(*(deliver(chat_id) for chat_id in recipients))
+        delivered = sum(results)
+        if recipients:
+            logger.info(f"📨 Рассылка: доставлено {delivered}/{len(recipients)}")
+        return dict(zip(recipients, results))
+
+    async def close(self):
+        """Закрыть HTTP-сессию, если Bot создан этим сервисом"""
+        if self._bot is not None and self._owns_bot:
+            try:
+                await self._bot.session.close()
+                logger.info("✅ Сессия исходящих сообщений закрыта")
+            except Exception as e:
+                logger.error(f"❌ Ошибка закрытия сессии исходящих сообщений: {e}")
+
+        self._bot = None
+        self._owns_bot = False
+
+# Глобальный экземпляр сервиса исходящих сообщений
+messenger = MessengerService()
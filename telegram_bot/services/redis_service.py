@@ -5,17 +5,104 @@
 import redis.asyncio as redis
 import json
 import logging
-from typing import Any, Optional, Dict, List
+import time
+from typing import Any, Awaitable, Callable, Optional, Dict, List
 from telegram_bot.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Атомарный выбор наименее загруженного онлайн-менеджера с резервированием слота.
+# KEYS[1] - ZSET загрузки (telegram_id -> активных чатов), KEYS[2] - HASH лимитов
+# ARGV[1] - лимит по умолчанию, ARGV[2] - "1" чтобы зарезервировать слот
+_RESERVE_MANAGER_LUA = """
+local candidates = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+for i = 1, #candidates, 2 do
+    local manager_id = candidates[i]
+    local load = tonumber(candidates[i + 1])
+    local capacity = tonumber(redis.call('HGET', KEYS[2], manager_id) or ARGV[1])
+    if load < capacity then
+        if ARGV[2] == '1' then
+            redis.call('ZINCRBY', KEYS[1], 1, manager_id)
+        end
+        return {manager_id, tostring(load)}
+    end
+end
+return false
+"""
+
+# Освобождение слота: только если менеджер в индексе и загрузка положительная
+_RELEASE_MANAGER_LUA = """
+local load = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if load and tonumber(load) > 0 then
+    return redis.call('ZINCRBY', KEYS[1], -1, ARGV[1])
+end
+return load
+"""
+
+# Перенос уведомлений, у которых истекла задержка повтора, из ZSET отложенных в stream
+# KEYS[1] - ZSET (score - время повтора), KEYS[2] - stream; ARGV[1] - сейчас, ARGV[2] - лимит, ARGV[3] - MAXLEN
+_PROMOTE_DELAYED_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    local job = cjson.decode(member)
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'data', job.data, 'attempts', job.attempts)
+    redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+# Активные чаты менеджера - SET; добавление с обновлением TTL одной командой
+# KEYS[1] - SET чатов; ARGV[1] - chat_id, ARGV[2] - TTL
+_ADD_ACTIVE_CHAT_LUA = """
+local added = redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return added
+"""
+
+# Удаление чата; если чат действительно был активен - освобождаем слот в индексе загрузки
+# KEYS[1] - SET чатов, KEYS[2] - ZSET загрузки; ARGV[1] - chat_id, ARGV[2] - TTL, ARGV[3] - telegram_id
+_REMOVE_ACTIVE_CHAT_LUA = """
+local removed = redis.call('SREM', KEYS[1], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if removed == 1 then
+    local load = redis.call('ZSCORE', KEYS[2], ARGV[3])
+    if load and tonumber(load) > 0 then
+        redis.call('ZINCRBY', KEYS[2], -1, ARGV[3])
+    end
+end
+return removed
+"""
+
+# Перевод ключа старого формата (JSON-список в строке) в SET с сохранением TTL
+_MIGRATE_ACTIVE_CHATS_LUA = """
+if redis.call('TYPE', KEYS[1])['ok'] ~= 'string' then
+    return 0
+end
+local raw = redis.call('GET', KEYS[1])
+local ttl = redis.call('TTL', KEYS[1])
+redis.call('DEL', KEYS[1])
+local ok, chats = pcall(cjson.decode, raw)
+if ok and type(chats) == 'table' then
+    for _, chat_id in ipairs(chats) do
+        redis.call('SADD', KEYS[1], tostring(chat_id))
+    end
+end
+if ttl > 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
 class RedisService:
     """Сервис для работы с Redis"""
     
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
         self.is_connected = False
+        self._scripts: Dict[str, Any] = {}
+        self._notification_group_ready = False
     
     async def connect(self):
         """Подключение к Redis"""
@@ -109,13 +196,13 @@ class RedisService:
             logger.error(f"❌ Ошибка проверки ключа Redis {key}: {e}")
             return False
     
-    async def get_keys_pattern(self, pattern: str) -> List[str]:
-        """Получить ключи по паттерну"""
+    async def get_keys_pattern(self, pattern: str, count: int = 500) -> List[str]:
+        """Получить ключи по паттерну (инкрементальный SCAN, не блокирует Redis в отличие от KEYS)"""
         try:
             if not self.is_connected:
                 await self.connect()
             
-            return await self.redis_client.keys(pattern)
+            return [key async for key in self.redis_client.scan_iter(match=pattern, count=count)]
         except Exception as e:
             logger.error(f"❌ Ошибка поиска ключей Redis {pattern}: {e}")
             return []
@@ -142,32 +229,206 @@ class RedisService:
         key = f"chat_assignment:{chat_id}"
         return await self.get_value(key)
     
-    async def set_manager_active_chats(self, telegram_id: str, chat_ids: List[str], ttl: int = 3600) -> bool:
+    ACTIVE_CHATS_PREFIX = "manager_active_chats:"
+    ACTIVE_CHATS_TTL = 3600
+    
+    def _active_chats_key(self, telegram_id: str) -> str:
+        return f"{self.ACTIVE_CHATS_PREFIX}{telegram_id}"
+    
+    async def _active_chats_call(self, key: str, operation):
+        """
+        Выполнить операцию над SET активных чатов
+        
+        Ключ старого формата (JSON-список) дает WRONGTYPE - переводим его в SET и повторяем.
+        """
+        try:
+            return await operation()
+        except redis.ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            script = await self._script("migrate_active_chats", _MIGRATE_ACTIVE_CHATS_LUA)
+            await script(keys=[key])
+            return await operation()
+    
+    async def set_manager_active_chats(self, telegram_id: str, chat_ids: List[str], ttl: int = ACTIVE_CHATS_TTL) -> bool:
         """Установить активные чаты менеджера"""
-        key = f"manager_active_chats:{telegram_id}"
-        return await self.set_value(key, chat_ids, ttl)
+        key = self._active_chats_key(telegram_id)
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                if chat_ids:
+                    pipe.sadd(key, *chat_ids)
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения активных чатов {key}: {e}")
+            return False
     
     async def get_manager_active_chats(self, telegram_id: str) -> List[str]:
         """Получить активные чаты менеджера"""
-        key = f"manager_active_chats:{telegram_id}"
-        result = await self.get_value(key)
-        return result if result else []
+        key = self._active_chats_key(telegram_id)
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            chats = await self._active_chats_call(key, lambda: self.redis_client.smembers(key))
+            return list(chats)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения активных чатов {key}: {e}")
+            return []
     
-    async def add_manager_active_chat(self, telegram_id: str, chat_id: str) -> bool:
+    async def count_manager_active_chats(self, telegram_id: str) -> int:
+        """Количество активных чатов менеджера (SCARD, без выгрузки списка)"""
+        key = self._active_chats_key(telegram_id)
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            return await self._active_chats_call(key, lambda: self.redis_client.scard(key))
+        except Exception as e:
+            logger.error(f"❌ Ошибка подсчета активных чатов {key}: {e}")
+            return 0
+    
+    async def add_manager_active_chat(self, telegram_id: str, chat_id: str, ttl: int = ACTIVE_CHATS_TTL) -> bool:
         """Добавить активный чат менеджеру"""
-        active_chats = await self.get_manager_active_chats(telegram_id)
-        if chat_id not in active_chats:
-            active_chats.append(chat_id)
-            return await self.set_manager_active_chats(telegram_id, active_chats)
-        return True
-    
-    async def remove_manager_active_chat(self, telegram_id: str, chat_id: str) -> bool:
-        """Удалить активный чат у менеджера"""
-        active_chats = await self.get_manager_active_chats(telegram_id)
-        if chat_id in active_chats:
-            active_chats.remove(chat_id)
-            return await self.set_manager_active_chats(telegram_id, active_chats)
-        return True
+        key = self._active_chats_key(telegram_id)
+        try:
+            script = await self._script("add_active_chat", _ADD_ACTIVE_CHAT_LUA)
+            await self._active_chats_call(key, lambda: script(keys=[key], args=[chat_id, ttl]))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка добавления активного чата {key}: {e}")
+            return False
+    
+    async def remove_manager_active_chat(self, telegram_id: str, chat_id: str, ttl: int = ACTIVE_CHATS_TTL) -> bool:
+        """
+        Удалить активный чат у менеджера
+        
+        Если чат был в списке активных, слот менеджера в индексе загрузки освобождается
+        в той же операции.
+        """
+        key = self._active_chats_key(telegram_id)
+        try:
+            script = await self._script("remove_active_chat", _REMOVE_ACTIVE_CHAT_LUA)
+            await self._active_chats_call(
+                key,
+                lambda: script(keys=[key, self.MANAGER_LOAD_KEY], args=[chat_id, ttl, telegram_id])
+            )
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления активного чата {key}: {e}")
+            return False
+    
+    async def migrate_legacy_active_chats(self) -> int:
+        """Перевести все ключи активных чатов старого формата (JSON-список) в SET"""
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            script = await self._script("migrate_active_chats", _MIGRATE_ACTIVE_CHATS_LUA)
+            migrated = 0
+            async for key in self.redis_client.scan_iter(match=f"{self.ACTIVE_CHATS_PREFIX}*", count=500):
+                migrated += await script(keys=[key])
+            
+            if migrated:
+                logger.info(f"✅ Переведено ключей активных чатов в SET: {migrated}")
+            return migrated
+        except Exception as e:
+            logger.error(f"❌ Ошибка миграции активных чатов: {e}")
+            return 0
+    
+    # Индекс загрузки онлайн-менеджеров (выбор наименее загруженного за один запрос)
+    
+    MANAGER_LOAD_KEY = "managers:load"
+    MANAGER_CAPACITY_KEY = "managers:capacity"
+    MANAGER_LOAD_BUILT_KEY = "managers:load:built"
+    
+    async def _script(self, name: str, source: str):
+        """Зарегистрированный Lua-скрипт (EVALSHA с автоматической загрузкой)"""
+        if not self.is_connected:
+            await self.connect()
+        
+        if name not in self._scripts:
+            self._scripts[name] = self.redis_client.register_script(source)
+        return self._scripts[name]
+    
+    async def sync_manager_load(self, telegram_id: str, online: bool, active_chats: int = 0, capacity: int = 5) -> bool:
+        """Добавить менеджера в индекс загрузки (online) или убрать из него"""
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                if online:
+                    pipe.zadd(self.MANAGER_LOAD_KEY, {telegram_id: active_chats})
+                    pipe.hset(self.MANAGER_CAPACITY_KEY, telegram_id, capacity)
+                else:
+                    pipe.zrem(self.MANAGER_LOAD_KEY, telegram_id)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления индекса загрузки менеджера {telegram_id}: {e}")
+            return False
+    
+    async def rebuild_manager_load_index(self, entries: Dict[str, tuple], ttl: int = 300) -> bool:
+        """
+        Пересобрать индекс загрузки целиком
+        
+        Args:
+            entries: telegram_id -> (активных чатов, лимит чатов) для онлайн-менеджеров
+            ttl: Через сколько секунд индекс будет пересобран снова (исправление расхождений)
+        """
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(self.MANAGER_LOAD_KEY, self.MANAGER_CAPACITY_KEY)
+                if entries:
+                    pipe.zadd(self.MANAGER_LOAD_KEY, {telegram_id: load for telegram_id, (load, _) in entries.items()})
+                    pipe.hset(self.MANAGER_CAPACITY_KEY, mapping={telegram_id: capacity for telegram_id, (_, capacity) in entries.items()})
+                pipe.setex(self.MANAGER_LOAD_BUILT_KEY, ttl, "1")
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересборки индекса загрузки менеджеров: {e}")
+            return False
+    
+    async def is_manager_load_index_built(self) -> bool:
+        """Актуален ли индекс загрузки (не истек срок пересборки)"""
+        return await self.exists(self.MANAGER_LOAD_BUILT_KEY)
+    
+    async def reserve_least_loaded_manager(self, default_capacity: int, reserve: bool = True) -> Optional[str]:
+        """
+        Выбрать наименее загруженного онлайн-менеджера со свободным слотом
+        
+        Args:
+            default_capacity: Лимит чатов, если у менеджера он не задан
+            reserve: Атомарно занять слот (передача чата) или только выбрать (заявки)
+            
+        Returns:
+            telegram_id менеджера или None, если все заняты
+        """
+        script = await self._script("reserve_manager", _RESERVE_MANAGER_LUA)
+        result = await script(
+            keys=[self.MANAGER_LOAD_KEY, self.MANAGER_CAPACITY_KEY],
+            args=[default_capacity, "1" if reserve else "0"]
+        )
+        return result[0] if result else None
+    
+    async def release_manager_load(self, telegram_id: str) -> bool:
+        """Освободить слот менеджера (чат закрыт или передача не состоялась)"""
+        try:
+            script = await self._script("release_manager", _RELEASE_MANAGER_LUA)
+            await script(keys=[self.MANAGER_LOAD_KEY], args=[telegram_id])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка освобождения слота менеджера {telegram_id}: {e}")
+            return False
     
     async def set_web_chat_session(self, session_id: str, data: Dict, ttl: int = 7200) -> bool:
         """Сохранить данные веб-чата"""
@@ -179,22 +440,215 @@ class RedisService:
         key = f"web_chat:{session_id}"
         return await self.get_value(key)
     
+    # Очередь уведомлений: Redis Stream с группой потребителей
+    # Прочитанное, но не подтвержденное сообщение после NOTIFICATION_VISIBILITY_TIMEOUT
+    # забирает другой потребитель (XAUTOCLAIM, Redis >= 6.2)
+    
+    NOTIFICATION_STREAM = "notifications:stream"
+    NOTIFICATION_DEAD_STREAM = "notifications:dead"
+    NOTIFICATION_DELAYED = "notifications:delayed"  # ZSET повторов, ожидающих своей очереди
+    NOTIFICATION_GROUP = "notification_workers"
+    NOTIFICATION_MAXLEN = 10000
+    NOTIFICATION_VISIBILITY_TIMEOUT = 60000  # мс
+    NOTIFICATION_MAX_ATTEMPTS = 5
+    NOTIFICATION_RETRY_BASE_DELAY = 5  # сек, удваивается с каждой попыткой
+    NOTIFICATION_RETRY_MAX_DELAY = 300
+    
+    async def _ensure_notification_group(self):
+        """Создать stream и группу потребителей (один раз на процесс)"""
+        if self._notification_group_ready:
+            return
+        
+        if not self.is_connected:
+            await self.connect()
+        
+        try:
+            await self.redis_client.xgroup_create(self.NOTIFICATION_STREAM, self.NOTIFICATION_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._notification_group_ready = True
+    
+    @staticmethod
+    def _decode_notification(message_id: str, fields: Dict[str, str]) -> Dict[str, Any]:
+        return {
+            "message_id": message_id,
+            "attempts": int(fields.get("attempts", 0)),
+            "data": json.loads(fields.get("data", "{}"))
+        }
+    
+    async def enqueue_notification(self, data: Dict, attempts: int = 0) -> Optional[str]:
+        """Добавить уведомление в очередь, возвращает ID сообщения в stream"""
+        try:
+            await self._ensure_notification_group()
+            return await self.redis_client.xadd(
+                self.NOTIFICATION_STREAM,
+                {"data": json.dumps(data, ensure_ascii=False), "attempts": attempts},
+                maxlen=self.NOTIFICATION_MAXLEN,
+                approximate=True
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка добавления уведомления в очередь: {e}")
+            return None
+    
     async def set_notification_queue(self, notification_id: str, data: Dict, ttl: int = 600) -> bool:
-        """Добавить уведомление в очередь"""
-        key = f"notification:{notification_id}"
-        return await self.set_value(key, data, ttl)
+        """Добавить уведомление в очередь (совместимость: ID сохраняется внутри данных, TTL не используется)"""
+        return await self.enqueue_notification({**data, "notification_id": notification_id}) is not None
+    
+    async def read_notifications(self, consumer: str, count: int = 50, block_ms: int = 5000) -> List[Dict[str, Any]]:
+        """
+        Прочитать пачку уведомлений для потребителя
+        
+        Сначала забираются зависшие сообщения других потребителей (истек таймаут видимости),
+        затем новые. Каждое прочитанное сообщение нужно подтвердить через ack_notifications
+        или вернуть в очередь через retry_notification.
+        
+        Returns:
+            [{"message_id", "attempts", "data"}, ...]
+        """
+        try:
+            await self._ensure_notification_group()
+            await self._promote_delayed_notifications(count)
+            
+            claimed = await self.redis_client.xautoclaim(
+                self.NOTIFICATION_STREAM,
+                self.NOTIFICATION_GROUP,
+                consumer,
+                min_idle_time=self.NOTIFICATION_VISIBILITY_TIMEOUT,
+                start_id="0-0",
+                count=count
+            )
+            # Удаленные из stream сообщения приходят с пустыми полями
+            messages = [(message_id, fields) for message_id, fields in claimed[1] if fields]
+            
+            if len(messages) < count:
+                result = await self.redis_client.xreadgroup(
+                    self.NOTIFICATION_GROUP,
+                    consumer,
+                    {self.NOTIFICATION_STREAM: ">"},
+                    count=count - len(messages),
+                    block=None if messages else block_ms
+                )
+                for _, entries in result or []:
+                    messages.extend(entries)
+            
+            return [self._decode_notification(message_id, fields) for message_id, fields in messages]
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения очереди уведомлений: {e}")
+            return []
+    
+    async def _promote_delayed_notifications(self, count: int) -> int:
+        """Вернуть в stream отложенные повторы, время которых наступило"""
+        try:
+            script = await self._script("promote_delayed", _PROMOTE_DELAYED_LUA)
+            return await script(
+                keys=[self.NOTIFICATION_DELAYED, self.NOTIFICATION_STREAM],
+                args=[time.time(), count, self.NOTIFICATION_MAXLEN]
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка переноса отложенных уведомлений: {e}")
+            return 0
+    
+    def _retry_delay(self, attempts: int) -> float:
+        """Экспоненциальная задержка перед повтором: 5, 10, 20, 40... сек"""
+        return min(self.NOTIFICATION_RETRY_MAX_DELAY, self.NOTIFICATION_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    
+    async def ack_notifications(self, message_ids: List[str]) -> int:
+        """Подтвердить обработку уведомлений (одним пайплайном) и удалить их из stream"""
+        if not message_ids:
+            return 0
+        
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xack(self.NOTIFICATION_STREAM, self.NOTIFICATION_GROUP, *message_ids)
+                pipe.xdel(self.NOTIFICATION_STREAM, *message_ids)
+                acked, _ = await pipe.execute()
+            return acked
+        except Exception as e:
+            logger.error(f"❌ Ошибка подтверждения уведомлений: {e}")
+            return 0
+    
+    async def retry_notification(self, notification: Dict[str, Any]) -> bool:
+        """
+        Вернуть уведомление в очередь после ошибки обработки
+        
+        Повтор откладывается в notifications:delayed с экспоненциальной задержкой и попадает
+        в stream при следующем чтении после ее истечения. После NOTIFICATION_MAX_ATTEMPTS
+        попыток уведомление переносится в notifications:dead.
+        """
+        attempts = notification["attempts"] + 1
+        
+        try:
+            if attempts >= self.NOTIFICATION_MAX_ATTEMPTS:
+                await self.redis_client.xadd(
+                    self.NOTIFICATION_DEAD_STREAM,
+                    {"data": json.dumps(notification["data"], ensure_ascii=False), "attempts": attempts},
+                    maxlen=self.NOTIFICATION_MAXLEN,
+                    approximate=True
+                )
+                logger.warning(f"⚠️ Уведомление {notification['message_id']} перенесено в dead-очередь после {attempts} попыток")
+            else:
+                delay = self._retry_delay(attempts)
+                job = json.dumps({
+                    "id": notification["message_id"],
+                    "data": json.dumps(notification["data"], ensure_ascii=False),
+                    "attempts": str(attempts)
+                }, ensure_ascii=False)
+                await self.redis_client.zadd(self.NOTIFICATION_DELAYED, {job: time.time() + delay})
+                logger.info(f"🔁 Уведомление {notification['message_id']} будет повторено через {delay:g}с (попытка {attempts + 1})")
+            
+            await self.ack_notifications([notification["message_id"]])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка повторной постановки уведомления: {e}")
+            return False
     
-    async def get_pending_notifications(self) -> List[Dict]:
-        """Получить все ожидающие уведомления"""
-        keys = await self.get_keys_pattern("notification:*")
-        notifications = []
+    async def consume_notifications(
+        self,
+        consumer: str,
+        handler: Callable[[Dict], Awaitable[bool]],
+        count: int = 50,
+        block_ms: int = 5000
+    ) -> int:
+        """
+        Обработать одну пачку уведомлений
         
-        for key in keys:
-            data = await self.get_value(key)
-            if data:
-                notifications.append(data)
+        Args:
+            consumer: Имя потребителя (уникальное для процесса)
+            handler: Корутина обработки данных уведомления, возвращает успех
+            
+        Returns:
+            Количество успешно обработанных уведомлений
+        """
+        notifications = await self.read_notifications(consumer, count=count, block_ms=block_ms)
+        processed = []
         
-        return notifications
+        for notification in notifications:
+            try:
+                ok = await handler(notification["data"])
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки уведомления {notification['message_id']}: {e}")
+                ok = False
+            
+            if ok:
+                processed.append(notification["message_id"])
+            else:
+                await self.retry_notification(notification)
+        
+        await self.ack_notifications(processed)
+        return len(processed)
+    
+    async def get_pending_notifications(self, count: int = 100) -> List[Dict]:
+        """Получить необработанные уведомления (без изъятия из очереди)"""
+        try:
+            if not self.is_connected:
+                await self.connect()
+            
+            entries = await self.redis_client.xrange(self.NOTIFICATION_STREAM, count=count)
+            return [json.loads(fields.get("data", "{}")) for _, fields in entries]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения уведомлений: {e}")
+            return []
 
 # Создаем глобальный экземпляр сервиса
 redis_service = RedisService() 
\ No newline at end of file
@@ -0,0 +1,319 @@
+"""
+Почасовые и дневные агрегаты заявок для отчетов администраторов
+Фоновая задача бота пересчитывает только последние часы, поэтому отчеты за неделю
+и месяц читают несколько сотен строк агрегатов вместо всей таблицы заявок
+"""
+import asyncio
+import logging
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, insert, delete, func, case, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from telegram_bot.models.database import AsyncSessionLocal
+from telegram_bot.models.support_models import (
+    Application, ApplicationStatus, Manager,
+    ApplicationStatsHourly, ApplicationStatsDaily
+)
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы времени обработки (сек); последняя корзина - все, что дольше
+PROCESSING_BUCKETS = [300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 172800, 604800]
+
+COUNTERS = ("created_count", "completed_count", "cancelled_count", "processing_seconds")
+
+
+def _hour_floor(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _day_floor(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _as_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def _group_by_columns(count: int):
+    # GROUP BY по номерам колонок: иначе параметры date_trunc/case в SELECT и GROUP BY не совпадают
+    return [literal_column(str(i)) for i in range(1, count + 1)]
+
+
+def histogram_percentile(histogram: List[int], q: float) -> Optional[float]:
+    """Перцентиль (сек) по гистограмме с линейной интерполяцией внутри корзины"""
+    total = sum(histogram or [])
+    if not total:
+        return None
+
+    target = q * total
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        if count and cumulative + count >= target:
+            lower = PROCESSING_BUCKETS[index - 1] if index > 0 else 0
+            if index >= len(PROCESSING_BUCKETS):
+                return float(lower)
+            upper = PROCESSING_BUCKETS[index]
+            return lower + (upper - lower) * (target - cumulative) / count
+        cumulative += count
+    return float(PROCESSING_BUCKETS[-1])
+
+
+def _empty_row(bucket_start: datetime, category: str, city: str, manager_id: int) -> Dict[str, Any]:
+    return {
+        "bucket_start": bucket_start,
+        "category": category,
+        "city": city,
+        "manager_id": manager_id,
+        "created_count": 0,
+        "completed_count": 0,
+        "cancelled_count": 0,
+        "processing_seconds": 0,
+        "processing_histogram": [0] * (len(PROCESSING_BUCKETS) + 1)
+    }
+
+
+class StatsRollupService:
+    """Инкрементальное заполнение агрегатов и отчеты по ним"""
+
+    # Ключ pg_advisory_xact_lock: пересчет не выполняется параллельно из нескольких процессов
+    LOCK_ID = 720180
+
+    def __init__(self):
+        self.interval = int(os.getenv("STATS_ROLLUP_INTERVAL", "300"))
+        self.backfill_days = int(os.getenv("STATS_ROLLUP_BACKFILL_DAYS", "90"))
+        self.last_refresh: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # Пересчет
+
+    async def refresh(self, since: Optional[datetime] = None) -> int:
+        """
+        Пересчитать почасовые агрегаты с since до текущего часа и дневные за затронутые дни
+
+        Args:
+            since: Начало пересчета; по умолчанию - час до последнего посчитанного
+                   (при пустой таблице - STATS_ROLLUP_BACKFILL_DAYS дней назад)
+
+        Returns:
+            Количество записанных почасовых строк
+        """
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as session:
+            try:
+                locked = (await session.execute(select(func.pg_try_advisory_xact_lock(self.LOCK_ID)))).scalar()
+                if not locked:
+                    logger.info("⏭️ Пересчет агрегатов уже выполняется в другом процессе")
+                    return 0
+
+                if since is None:
+                    last_bucket = (await session.execute(select(func.max(ApplicationStatsHourly.bucket_start)))).scalar()
+                    if last_bucket:
+                        since = _as_utc(last_bucket) - timedelta(hours=1)
+                    else:
+                        since = now - timedelta(days=self.backfill_days)
+
+                start = _hour_floor(_as_utc(since))
+                end = _hour_floor(now) + timedelta(hours=1)
+
+                rows = await self._collect_hourly(session, start, end)
+                await session.execute(
+                    delete(ApplicationStatsHourly).where(
+                        ApplicationStatsHourly.bucket_start >= start,
+                        ApplicationStatsHourly.bucket_start < end
+                    )
+                )
+                if rows:
+                    await session.execute(insert(ApplicationStatsHourly), rows)
+
+                await self._rebuild_daily(session, _day_floor(start), end)
+                await session.commit()
+
+                self.last_refresh = now
+                logger.info(f"📊 Агрегаты заявок пересчитаны с {start:%d.%m %H:%M} UTC: {len(rows)} строк")
+                return len(rows)
+
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Ошибка пересчета агрегатов заявок: {e}")
+                return 0
+
+    async def _collect_hourly(self, session: AsyncSession, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """Почасовые строки за [start, end) двумя группирующими запросами по заявкам"""
+        rows: Dict[tuple, Dict[str, Any]] = {}
+
+        def row_for(bucket, category, city, manager_id):
+            key = (_as_utc(bucket), category, city, manager_id)
+            if key not in rows:
+                rows[key] = _empty_row(*key)
+            return rows[key]
+
+        manager_id = func.coalesce(Application.assigned_manager_id, 0)
+
+        # Поступившие заявки - по часу создания
+        created_hour = func.date_trunc("hour", func.timezone("UTC", Application.created_at))
+        created = await session.execute(
+            select(created_hour, Application.category, Application.city, manager_id, func.count(Application.id))
+            .where(Application.created_at >= start, Application.created_at < end)
+            .group_by(*_group_by_columns(4))
+        )
+        for bucket, category, city, manager, count in created:
+            row_for(bucket, category, city, manager)["created_count"] += count
+
+        # Завершенные и отмененные - по часу обработки, с корзиной времени обработки
+        processed_hour = func.date_trunc("hour", func.timezone("UTC", Application.processed_at))
+        seconds = func.extract("epoch", Application.processed_at - Application.created_at)
+        bucket_index = case(
+            *[(seconds < limit, index) for index, limit in enumerate(PROCESSING_BUCKETS)],
+            else_=len(PROCESSING_BUCKETS)
+        )
+        processed = await session.execute(
+            select(
+                processed_hour, Application.category, Application.city, manager_id,
+                Application.status, bucket_index,
+                func.count(Application.id), func.coalesce(func.sum(seconds), 0)
+            )
+            .where(
+                Application.processed_at >= start,
+                Application.processed_at < end,
+                Application.status.in_([ApplicationStatus.COMPLETED, ApplicationStatus.CANCELLED])
+            )
+            .group_by(*_group_by_columns(6))
+        )
+        for bucket, category, city, manager, status, index, count, total_seconds in processed:
+            row = row_for(bucket, category, city, manager)
+            if status == ApplicationStatus.CANCELLED:
+                row["cancelled_count"] += count
+                continue
+            row["completed_count"] += count
+            row["processing_seconds"] += int(total_seconds)
+            row["processing_histogram"][index] += count
+
+        return list(rows.values())
+
+    async def _rebuild_daily(self, session: AsyncSession, start: datetime, end: datetime):
+        """Пересобрать дневные строки за дни, пересекающие [start, end), из почасовых"""
+        day_end = _day_floor(end - timedelta(microseconds=1)) + timedelta(days=1)
+        hourly = await session.execute(
+            select(ApplicationStatsHourly).where(
+                ApplicationStatsHourly.bucket_start >= start,
+                ApplicationStatsHourly.bucket_start < day_end
+            )
+        )
+
+        days: Dict[tuple, Dict[str, Any]] = {}
+        for hour in hourly.scalars():
+            key = (_day_floor(_as_utc(hour.bucket_start)), hour.category, hour.city, hour.manager_id)
+            day = days.setdefault(key, _empty_row(*key))
+            for counter in COUNTERS:
+                day[counter] += getattr(hour, counter) or 0
+            for index, count in enumerate(hour.processing_histogram or []):
+                day["processing_histogram"][index] += count
+
+        await session.execute(
+            delete(ApplicationStatsDaily).where(
+                ApplicationStatsDaily.bucket_start >= start,
+                ApplicationStatsDaily.bucket_start < day_end
+            )
+        )
+        if days:
+            await session.execute(insert(ApplicationStatsDaily), list(days.values()))
+
+    # Фоновая задача
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка фонового пересчета агрегатов: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Запустить периодический пересчет (при старте бота)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"✅ Пересчет агрегатов заявок запущен (каждые {self.interval} сек)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # Отчеты
+
+    async def get_report(self, days: int) -> Dict[str, Any]:
+        """
+        Сводка за последние days дней (включая текущий) только по дневным агрегатам
+
+        Returns:
+            Итоги, разбивка по дням, топ категорий, городов и менеджеров, перцентили времени обработки
+        """
+        since = _day_floor(datetime.now(timezone.utc)) - timedelta(days=days - 1)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(ApplicationStatsDaily).where(ApplicationStatsDaily.bucket_start >= since)
+            )
+            rows = result.scalars().all()
+
+            totals = Counter()
+            by_day = defaultdict(Counter)
+            by_category = Counter()
+            by_city = Counter()
+            by_manager = Counter()
+            histogram = [0] * (len(PROCESSING_BUCKETS) + 1)
+
+            for row in rows:
+                for counter in COUNTERS:
+                    totals[counter] += getattr(row, counter) or 0
+                day = _as_utc(row.bucket_start).date()
+                by_day[day]["created_count"] += row.created_count or 0
+                by_day[day]["completed_count"] += row.completed_count or 0
+                by_category[row.category] += row.created_count or 0
+                by_city[row.city] += row.created_count or 0
+                if row.manager_id:
+                    by_manager[row.manager_id] += row.completed_count or 0
+                for index, count in enumerate(row.processing_histogram or []):
+                    histogram[index] += count
+
+            # Имена только для менеджеров из топа
+            top_managers = [(manager_id, count) for manager_id, count in by_manager.most_common(5) if count]
+            names = {}
+            if top_managers:
+                managers = await session.execute(
+                    select(Manager.id, Manager.first_name, Manager.last_name)
+                    .where(Manager.id.in_([manager_id for manager_id, _ in top_managers]))
+                )
+                names = {mid: f"{first} {last or ''}".strip() for mid, first, last in managers}
+
+        finished = totals["completed_count"] + totals["cancelled_count"]
+        return {
+            "days": days,
+            "since": since,
+            "updated_at": self.last_refresh,
+            "created": totals["created_count"],
+            "completed": totals["completed_count"],
+            "cancelled": totals["cancelled_count"],
+            "completion_rate": round(totals["completed_count"] / finished * 100, 1) if finished else None,
+            "avg_processing_seconds": (
+                totals["processing_seconds"] / totals["completed_count"] if totals["completed_count"] else None
+            ),
+            "p50_processing_seconds": histogram_percentile(histogram, 0.5),
+            "p90_processing_seconds": histogram_percentile(histogram, 0.9),
+            "by_day": [(day, by_day[day]["created_count"], by_day[day]["completed_count"]) for day in sorted(by_day)],
+            "top_categories": by_category.most_common(5),
+            "top_cities": by_city.most_common(5),
+            "top_managers": [(names.get(manager_id, f"#{manager_id}"), count) for manager_id, count in top_managers]
+        }
+
+# Глобальный экземпляр агрегатов статистики
+stats_rollup = StatsRollupService()
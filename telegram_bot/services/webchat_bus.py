@@ -0,0 +1,240 @@
+"""
+Шина доставки сообщений в веб-чат
+Redis pub/sub канал на каждую сессию: веб-воркер, держащий WebSocket, подписан на канал,
+бот публикует напрямую и получает подтверждение доставки
+"""
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram_bot.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+# Обработчик доставки: отправляет payload в WebSocket, возвращает успех
+DeliveryHandler = Callable[[Dict[str, Any]], Awaitable[bool]]
+
+# Обработчик служебного сигнала сессии (например, сброс кэша маршрутизации): (session_id, control)
+ControlHandler = Callable[[str, str], None]
+
+
+class WebChatBus:
+    """Доставка сообщений клиентам веб-чата между процессами"""
+
+    CHANNEL_PREFIX = "webchat:"
+    ACK_PREFIX = "webchat_ack:"
+    ACK_TTL = 30  # секунды
+
+    def __init__(self):
+        self._handlers: Dict[str, DeliveryHandler] = {}
+        self._control_handlers: List[ControlHandler] = []
+        self._pubsub = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _channel(self, session_id: str) -> str:
+        return f"{self.CHANNEL_PREFIX}{session_id}"
+
+    async def _redis(self):
+        """Клиент Redis или None, если Redis недоступен"""
+        try:
+            if not redis_service.is_connected:
+                await redis_service.connect()
+            return redis_service.redis_client
+        except Exception:
+            return None
+
+    async def _ensure_pubsub(self):
+        """Создать pub/sub соединение воркера и задачу чтения (одна на процесс)"""
+        if self._pubsub is not None:
+            return self._pubsub
+
+        client = await self._redis()
+        if client is None:
+            return None
+
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._reader_task = asyncio.create_task(self._reader_loop())
+        logger.info("✅ Шина веб-чата подключена к Redis pub/sub")
+        return self._pubsub
+
+    async def subscribe(self, session_id: str, handler: DeliveryHandler) -> bool:
+        """
+        Подписать воркер на сообщения сессии
+
+        Args:
+            session_id: ID веб-сессии
+            handler: Корутина доставки в WebSocket этой сессии
+
+        Returns:
+            True если подписка оформлена в Redis, False если работает только локальная доставка
+        """
+        self._handlers[session_id] = handler
+
+        async with self._lock:
+            try:
+                pubsub = await self._ensure_pubsub()
+                if pubsub is None:
+                    return False
+
+                await pubsub.subscribe(self._channel(session_id))
+                return True
+            except Exception as e:
+                logger.error(f"❌ Ошибка подписки на канал сессии {session_id}: {e}")
+                return False
+
+    async def unsubscribe(self, session_id: str):
+        """Отписать воркер от сессии (WebSocket закрыт)"""
+        self._handlers.pop(session_id, None)
+
+        if self._pubsub is None:
+            return
+
+        async with self._lock:
+            try:
+                await self._pubsub.unsubscribe(self._channel(session_id))
+            except Exception as e:
+                logger.error(f"❌ Ошибка отписки от канала сессии {session_id}: {e}")
+
+    async def publish(self, session_id: str, message: Dict[str, Any], wait_ack: bool = True, timeout: int = 5) -> bool:
+        """
+        Доставить сообщение клиенту веб-чата
+
+        Args:
+            session_id: ID веб-сессии
+            message: JSON-сообщение для WebSocket
+            wait_ack: Ждать подтверждения доставки от воркера
+            timeout: Время ожидания подтверждения (секунды)
+
+        Returns:
+            True если сообщение доставлено (или принято воркером при wait_ack=False)
+        """
+        # Сессия обслуживается этим же процессом - доставляем без Redis
+        handler = self._handlers.get(session_id)
+        if handler is not None:
+            return await self._deliver(handler, message)
+
+        client = await self._redis()
+        if client is None:
+            logger.warning(f"⚠️ Redis недоступен, сессия {session_id} не обслуживается этим процессом")
+            return False
+
+        delivery_id = str(uuid.uuid4())
+        envelope = json.dumps({"delivery_id": delivery_id, "message": message}, ensure_ascii=False)
+
+        try:
+            receivers = await client.publish(self._channel(session_id), envelope)
+            if not receivers:
+                # Ни один воркер не держит WebSocket этой сессии - клиент отключен
+                logger.warning(f"⚠️ Нет подписчиков для сессии {session_id}")
+                return False
+
+            if not wait_ack:
+                return True
+
+            ack = await client.blpop(f"{self.ACK_PREFIX}{delivery_id}", timeout=timeout)
+            if ack is None:
+                logger.warning(f"⚠️ Нет подтверждения доставки {delivery_id} для сессии {session_id}")
+                return False
+
+            return ack[1] == "1"
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации в канал сессии {session_id}: {e}")
+            return False
+
+    def add_control_handler(self, handler: ControlHandler):
+        """Зарегистрировать обработчик служебных сигналов сессий"""
+        self._control_handlers.append(handler)
+
+    async def publish_control(self, session_id: str, control: str):
+        """
+        Отправить служебный сигнал воркеру, который держит сессию (без подтверждения)
+
+        В клиентский WebSocket сигнал не попадает.
+        """
+        self._dispatch_control(session_id, control)
+
+        client = await self._redis()
+        if client is None:
+            return
+
+        try:
+            await client.publish(self._channel(session_id), json.dumps({"control": control}))
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации сигнала {control} для сессии {session_id}: {e}")
+
+    def _dispatch_control(self, session_id: str, control: str):
+        for handler in self._control_handlers:
+            try:
+                handler(session_id, control)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки сигнала {control}: {e}")
+
+    async def _deliver(self, handler: DeliveryHandler, message: Dict[str, Any]) -> bool:
+        try:
+            return bool(await handler(message))
+        except Exception as e:
+            logger.error(f"❌ Ошибка доставки сообщения в WebSocket: {e}")
+            return False
+
+    async def _reader_loop(self):
+        """Чтение сообщений из подписанных каналов и подтверждение доставки"""
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.5)
+                    continue
+
+                event = await self._pubsub.get_message(timeout=1.0)
+                if event is None or event.get("type") != "message":
+                    continue
+
+                session_id = event["channel"][len(self.CHANNEL_PREFIX):]
+                envelope = json.loads(event["data"])
+
+                if "control" in envelope:
+                    self._dispatch_control(session_id, envelope["control"])
+                    continue
+
+                handler = self._handlers.get(session_id)
+                delivered = await self._deliver(handler, envelope["message"]) if handler else False
+
+                # Несколько воркеров не подписываются на одну сессию, поэтому одного ответа достаточно
+                client = await self._redis()
+                if client is not None:
+                    ack_key = f"{self.ACK_PREFIX}{envelope['delivery_id']}"
+                    async with client.pipeline(transaction=False) as pipe:
+                        pipe.rpush(ack_key, "1" if delivered else "0")
+                        pipe.expire(ack_key, self.ACK_TTL)
+                        await pipe.execute()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения шины веб-чата: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        """Остановить чтение и закрыть pub/sub соединение"""
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+
+        if self._pubsub is not None:
+            try:
+                close = getattr(self._pubsub, "aclose", None) or self._pubsub.close
+                await close()
+            except Exception as e:
+                logger.error(f"❌ Ошибка закрытия pub/sub: {e}")
+            self._pubsub = None
+
+        self._handlers.clear()
+
+# Глобальный экземпляр шины
+webchat_bus = WebChatBus()